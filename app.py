@@ -1,24 +1,87 @@
+import contextlib
+import cProfile
 import json
 import logging
 import os
 import select
 import subprocess
-from collections import defaultdict
+import time
+from typing import Annotated, List, Optional
 
 import dtlpy as dl
 import numpy as np
-from fastapi import APIRouter, BackgroundTasks, FastAPI
+from fastapi import APIRouter, BackgroundTasks, FastAPI, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
 from faiss import IndexFlatIP, IndexHNSWFlat, METRIC_INNER_PRODUCT
 from sklearn.preprocessing import normalize
 
-from modules.exporter import Exporter
+from modules.actions import ActionRunner
+from modules.ann import BACKEND_AUTO, BACKENDS
+from modules.clustering import (
+    CLUSTERING_GREEDY,
+    CLUSTERING_LINKAGE,
+    greedy_clusters,
+    greedy_graph_clusters,
+)
+from modules.executors import BoundedPool, PoolBusy, PoolTimeout
+from modules.exporter import EXECUTION_POLLER, Exporter
+from modules.memory import memory_limit_bytes
+from modules.metrics import REGISTRY, Gauge, Histogram
+from modules.pagination import decode_cursor, encode_cursor, query_fingerprint
+from modules.profiling import ACTIVE_PROFILER, profile_summary
+from modules.quality import QUALITY_TYPES
+from modules.residency import ResidencyManager
+from modules.singleflight import SingleFlight
+from modules.storage import STORAGE_NAMES
+from modules.wire import (
+    FORMAT_COMPACT,
+    FORMAT_FULL,
+    FORMATS,
+    compact_clusters,
+    compress,
+    content_encoding,
+    encode_json,
+    item_table_page,
+)
 
 logger = logging.getLogger('[CLEANUP]')
 logging.basicConfig(level='INFO')
 
+# number of cluster items per page of the panel, for the unpaged similarity response
+PAGE_LIMIT = 1000
+# items, or clusters of a cursor page, returned by get_items when no limit is given
+DEFAULT_LIMIT = 10
+# largest number of bins of the quality score histogram
+MAX_HISTOGRAM_BINS = 1000
+# `greedy` (default) or `linkage` to answer the similarity queries from the single linkage hierarchies
+CLUSTERING = os.environ.get('CLEANUP_SIMILARITY_CLUSTERING', CLUSTERING_GREEDY)
+# threads and queued tasks of the pool running the clustering, scoring and response encoding
+CPU_WORKERS = int(os.environ.get('CLEANUP_CPU_WORKERS', min(4, os.cpu_count() or 1)))
+CPU_QUEUE = int(os.environ.get('CLEANUP_CPU_QUEUE', 16))
+# seconds a route waits for its CPU bound task, 0 for no timeout
+CPU_TIMEOUT = float(os.environ.get('CLEANUP_CPU_TIMEOUT', 120))
+# threads and queued tasks of the pool running the blocking Dataloop calls
+IO_WORKERS = int(os.environ.get('CLEANUP_IO_WORKERS', 8))
+IO_QUEUE = int(os.environ.get('CLEANUP_IO_QUEUE', 64))
+# seconds a route waits for its Dataloop calls, 0 for no timeout
+IO_TIMEOUT = float(os.environ.get('CLEANUP_IO_TIMEOUT', 60))
+# items of a bulk action applied by one filter based call
+ACTION_BATCH = int(os.environ.get('CLEANUP_ACTION_BATCH', 1000))
+# threads applying the bulk actions item by item, when a filter based call is not possible or failed
+ACTION_WORKERS = int(os.environ.get('CLEANUP_ACTION_WORKERS', 8))
+# bulk actions running at once, the others are queued
+ACTION_JOBS = int(os.environ.get('CLEANUP_ACTION_JOBS', 2))
+# bytes of exported state kept in memory for all the datasets, 0 for no budget
+MEMORY_BUDGET_BYTES = int(
+    os.environ.get('CLEANUP_MEMORY_BUDGET_BYTES', memory_limit_bytes() // 2)
+)
+# whether a request with the profile header is answered with its cProfile summary
+PROFILING = os.environ.get('CLEANUP_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_HEADER = 'X-Cleanup-Profile'
+
 
 class Runner(dl.BaseServiceRunner):
     """
@@ -83,6 +146,532 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# the routes are async, their blocking work runs in these pools to keep the event loop
+# free for the status polling of the other panels
+cpu_pool = BoundedPool('cpu', CPU_WORKERS, CPU_QUEUE, CPU_TIMEOUT)
+io_pool = BoundedPool('io', IO_WORKERS, IO_QUEUE, IO_TIMEOUT)
+# the exporter of every dataset, created once in the io pool as creating it calls the platform
+exporters = {}
+# identical concurrent queries, from several panels or a fast moving slider, are computed once
+single_flight = SingleFlight()
+# the least recently used datasets are evicted from memory over the budget
+residency = ResidencyManager(MEMORY_BUDGET_BYTES)
+# applies the bulk actions on the selected items in the background
+action_runner = ActionRunner(ACTION_BATCH, ACTION_WORKERS, ACTION_JOBS)
+
+GET_ITEMS_SECONDS = Histogram(
+    'cleanup_get_items_seconds',
+    'Latency of the get_items queries, including the wait for a pool worker.',
+    ['type'],
+)
+
+
+def pool_metrics(counter):
+    return [((pool.name,), pool.stats()[counter]) for pool in (cpu_pool, io_pool)]
+
+
+def dataset_memory_metrics():
+    for dataset_id, exporter in residency.exporters():
+        usage = exporter.memory_usage()
+        yield (dataset_id, 'heap'), usage['heap_bytes']
+        yield (dataset_id, 'mapped'), usage['mapped_bytes']
+
+
+def feature_set_memory_metrics():
+    for dataset_id, exporter in residency.exporters():
+        for key, usage in exporter.feature_set_memory_usage().items():
+            yield (dataset_id, key, 'heap'), usage['heap_bytes']
+            yield (dataset_id, key, 'mapped'), usage['mapped_bytes']
+
+
+Gauge(
+    'cleanup_dataset_resident_bytes',
+    'Bytes of exported state of a dataset, in the heap or memory-mapped from the index store.',
+    ['dataset_id', 'memory'],
+    callback=dataset_memory_metrics,
+)
+Gauge(
+    'cleanup_feature_set_resident_bytes',
+    'Bytes of vectors, neighbour graphs and anomaly scores of a feature set.',
+    ['dataset_id', 'feature_set', 'memory'],
+    callback=feature_set_memory_metrics,
+)
+Gauge(
+    'cleanup_pool_pending_tasks',
+    'Tasks queued or running in a worker pool.',
+    ['pool'],
+    callback=lambda: pool_metrics('pending'),
+)
+Gauge(
+    'cleanup_pool_rejected_total',
+    'Tasks rejected by a worker pool with a full queue.',
+    ['pool'],
+    callback=lambda: pool_metrics('rejected'),
+    metric_type='counter',
+)
+Gauge(
+    'cleanup_pool_timed_out_total',
+    'Tasks a route stopped waiting for.',
+    ['pool'],
+    callback=lambda: pool_metrics('timed_out'),
+    metric_type='counter',
+)
+Gauge(
+    'cleanup_coalesced_requests_total',
+    'Requests served by the in-flight computation of an identical request.',
+    callback=lambda: [((), single_flight.coalesced)],
+    metric_type='counter',
+)
+
+if PROFILING:
+
+    @app.middleware('http')
+    async def profile_request(request: Request, call_next):
+        """
+        Answers a request sent with the profile header with the cProfile summary of its blocking work.
+
+        The header value is the number of functions listed, by cumulative time.
+        """
+        rows = request.headers.get(PROFILE_HEADER)
+        if rows is None:
+            return await call_next(request)
+        profiler = cProfile.Profile()
+        token = ACTIVE_PROFILER.set(profiler)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+            body = b''.join([chunk async for chunk in response.body_iterator])
+        finally:
+            ACTIVE_PROFILER.reset(token)
+        summary = {
+            'path': request.url.path,
+            'status_code': response.status_code,
+            'seconds': round(time.perf_counter() - start, 6),
+            'response_bytes': len(body),
+            'profile': profile_summary(profiler, int(rows) if rows.isdigit() else 30),
+        }
+        return HTMLResponse(json.dumps(summary, indent=2), status_code=200)
+
+
+@app.exception_handler(PoolBusy)
+async def pool_busy_handler(request: Request, exc: PoolBusy):
+    return HTMLResponse(
+        json.dumps({'error': str(exc)}), headers={'Retry-After': '1'}, status_code=503
+    )
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return HTMLResponse(json.dumps({'error': str(exc)}), status_code=504)
+
+
+async def get_exporter(datasetId):
+    """
+    Retrieves the exporter of a dataset, creating it in the io pool the first time.
+
+    Args:
+        datasetId (str): The ID of the dataset.
+
+    Returns:
+        Exporter: The exporter of the dataset.
+    """
+    exporter = exporters.get(datasetId)
+    if exporter is None:
+        exporter = await single_flight.run(
+            ('exporter', datasetId), io_pool.run, Exporter, dataset_id=datasetId
+        )
+        exporters[datasetId] = exporter
+        residency.track(datasetId, exporter)
+    return exporter
+
+
+@contextlib.asynccontextmanager
+async def resident_exporter(datasetId):
+    """
+    Retrieves the exporter of a dataset for a query of its exported state, reloading the state
+    from the index store if it was evicted. The dataset is not evicted until the query completes.
+
+    Args:
+        datasetId (str): The ID of the dataset.
+
+    Yields:
+        Exporter: The exporter of the dataset.
+    """
+    exporter = await get_exporter(datasetId)
+    residency.acquire(datasetId)
+    try:
+        if not exporter.resident:
+            reloaded = await single_flight.run(
+                ('reload', datasetId), io_pool.run, exporter.reload
+            )
+            if reloaded:
+                residency.record_reload(datasetId)
+        yield exporter
+    finally:
+        residency.release(datasetId)
+
+
+def items_key(
+    exporter,
+    featureSetName,
+    similarity,
+    type,
+    pagination,
+    limit,
+    min_v,
+    max_v,
+    clusterSize,
+    cursor,
+    format=FORMAT_FULL,
+    encoding=None,
+):
+    """
+    Normalizes the parameters of a get_items query into its single flight key, keeping only
+    the parameters its type uses.
+
+    Returns:
+        tuple: The key, for the export the query is answered from.
+    """
+    if format == FORMAT_COMPACT:
+        return ('compact', encoding) + items_key(
+            exporter,
+            featureSetName,
+            similarity,
+            type,
+            pagination,
+            limit,
+            min_v,
+            max_v,
+            clusterSize,
+            cursor,
+        )
+    if type == 'Similarity':
+        params = (featureSetName, float(similarity), clusterSize, cursor)
+        if cursor is not None:
+            params += (limit,)
+    elif type == 'Anomalies':
+        params = (featureSetName, float(similarity), pagination, limit)
+    else:
+        params = (float(min_v), float(max_v), pagination, limit)
+    return ('get_items', exporter.dataset.id, exporter.data_version, type) + params
+
+
+def quality_pool(exporter, qtype):
+    """
+    Chooses the pool of a quality query, the io pool while it is answered by the platform.
+    """
+    if qtype in QUALITY_TYPES and qtype not in exporter.quality_scores:
+        return io_pool
+    return cpu_pool
+
+
+def similarity_clusters(exporter, featureSetName, similarity, clusterSize):
+    """
+    Retrieves the clusters of a similarity query, materialized once per export and query.
+
+    Args:
+        exporter (Exporter): The exporter of the dataset.
+        featureSetName (str): The name of the feature set to use.
+        similarity (float): The similarity threshold to use for clustering.
+        clusterSize (int): The minimum number of items to include in a cluster.
+
+    Returns:
+        ClusterList: The clusters sorted by descending size.
+    """
+    cache_key = (
+        'SimilarityClusters',
+        exporter.data_version,
+        featureSetName,
+        similarity,
+        clusterSize,
+    )
+    clusters = exporter.results_cache.get(cache_key)
+    if clusters is None:
+        graph = exporter.graphs.get(featureSetName)
+        hierarchy = None
+        if CLUSTERING == CLUSTERING_LINKAGE:
+            hierarchy = exporter.hierarchy(featureSetName)
+        if hierarchy is not None:
+            clusters = hierarchy.clusters(similarity, clusterSize)
+        elif graph is not None:
+            clusters = greedy_graph_clusters(graph, similarity, clusterSize)
+        else:
+            clusters = greedy_clusters(
+                exporter.distance[featureSetName],
+                exporter.indices[featureSetName],
+                similarity,
+                clusterSize,
+            )
+        exporter.results_cache.put(cache_key, clusters, clusters.nbytes)
+    return clusters
+
+
+def cluster_records(clusters, feature_set, start, stop):
+    """
+    Builds the cluster dictionaries returned to the panel for a range of clusters.
+
+    Args:
+        clusters (ClusterList): The clusters of the query.
+        feature_set (FeatureSetColumns): The exported feature set the cluster members point to.
+        start (int): The index of the first cluster.
+        stop (int): The index after the last cluster.
+
+    Returns:
+        list: The cluster dictionaries, with the panel page of every cluster.
+    """
+    records = []
+    for i in range(start, stop):
+        members = clusters[i].tolist()
+        # the panel pages over the non main items of the clusters
+        items_before = int(clusters.offsets[i]) - i
+        records.append(
+            {
+                'key': f"Cluster {clusters.ids[i]}",
+                'main_item': feature_set.record(members[0]),
+                'items': [feature_set.record(m) for m in members[1:]],
+                'is_choosed': False,
+                'page': items_before // PAGE_LIMIT + 1,
+            }
+        )
+    return records
+
+
+def items_response(
+    exporter,
+    featureSetName,
+    similarity,
+    type,
+    pagination,
+    limit,
+    min_v,
+    max_v,
+    clusterSize,
+    cursor,
+):
+    """
+    Computes the response of a get_items query, blocking, see `get_items` for the arguments.
+
+    Returns:
+        HTMLResponse: The items in JSON format.
+    """
+    if type == 'Similarity':
+        feature_set = exporter.feature_sets_export[featureSetName]
+
+        if cursor is not None:
+            fingerprint = query_fingerprint(
+                exporter.data_version, featureSetName, similarity, clusterSize
+            )
+            try:
+                start = decode_cursor(cursor, fingerprint)
+            except ValueError as e:
+                return HTMLResponse(json.dumps({'error': str(e)}), status_code=400)
+
+            clusters = similarity_clusters(
+                exporter, featureSetName, similarity, clusterSize
+            )
+            stop = min(start + max(limit, 1), len(clusters))
+            page_clusters = cluster_records(clusters, feature_set, start, stop)
+            if start == 0 and len(page_clusters) > 0:
+                page_clusters[0]['is_choosed'] = True
+            page = {
+                'clusters': page_clusters,
+                'total_clusters': len(clusters),
+                'total_items': len(clusters.members),
+                'next_cursor': (
+                    encode_cursor(stop, fingerprint) if stop < len(clusters) else None
+                ),
+            }
+            headers = {
+                'X-Total-Count': str(page['total_clusters']),
+                'X-Total-Items': str(page['total_items']),
+                'X-Data-Version': str(exporter.data_version),
+            }
+            return HTMLResponse(
+                json.dumps(page, indent=2), headers=headers, status_code=200
+            )
+
+        # the clusters are cached, not their far larger JSON body
+        clusters = similarity_clusters(exporter, featureSetName, similarity, clusterSize)
+        output_clusters = cluster_records(clusters, feature_set, 0, len(clusters))
+
+        # first cluster have is_choosed = True
+        if len(output_clusters) > 0:
+            output_clusters[0]['is_choosed'] = True
+        else:
+            # create dummy cluster
+            output_clusters.append(
+                {
+                    'key': 'Cluster 0',
+                    'main_item': '',
+                    'items': [],
+                    'is_choosed': True,
+                }
+            )
+
+        return HTMLResponse(
+            json.dumps(output_clusters, indent=2),
+            headers={'X-Data-Version': str(exporter.data_version)},
+            status_code=200,
+        )
+
+    elif type == 'Anomalies':
+        # scores are sorted once per export, a threshold query is a binary search and a slice
+        feature_set = exporter.feature_sets_export[featureSetName]
+        total, rows = exporter.anomaly_scores[featureSetName].above(
+            similarity, offset=pagination * max(limit, 0), limit=limit
+        )
+        ids = [feature_set.record(i) for i in rows.tolist()]
+
+        return HTMLResponse(
+            json.dumps({'items': ids, 'total': total}, indent=2), status_code=200
+        )
+
+    else:
+        items_count, ids = exporter.quality_score(
+            type, min_v, max_v, limit=limit, pagination=pagination, return_ids=True
+        )
+        return HTMLResponse(
+            json.dumps({'items': ids, 'total': items_count}, indent=2), status_code=200
+        )
+
+
+def compact_body(value, encoding):
+    """
+    Serializes a compact response, compressed when the client accepts it.
+
+    Args:
+        value (dict): The response, possibly holding numpy arrays.
+        encoding (str): The compression accepted by the client, see `content_encoding`.
+
+    Returns:
+        tuple: The body and its Content-Encoding, None if not compressed.
+    """
+    return compress(encode_json(value), encoding)
+
+
+def compact_response(body, used_encoding, headers=None):
+    """
+    Builds the `application/json` response of a compact body.
+
+    Args:
+        body (bytes): The body returned by `compact_body`.
+        used_encoding (str): Its Content-Encoding, None if not compressed.
+        headers (dict, optional): More response headers.
+
+    Returns:
+        Response: The response.
+    """
+    headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+    if used_encoding is not None:
+        headers['Content-Encoding'] = used_encoding
+    return Response(
+        content=body, media_type='application/json', headers=headers, status_code=200
+    )
+
+
+def compact_items_response(
+    exporter,
+    featureSetName,
+    similarity,
+    type,
+    pagination,
+    limit,
+    min_v,
+    max_v,
+    clusterSize,
+    cursor,
+    encoding,
+):
+    """
+    Computes the compact response of a get_items query, blocking, see `get_items` for the arguments.
+
+    The items are the rows of the item table of the export, see `item_table`, instead of full
+    item dictionaries, and the clusters are laid out as arrays of rows.
+
+    Returns:
+        Response: The items in compact JSON format.
+    """
+    if type == 'Similarity':
+        feature_set = exporter.feature_sets_export[featureSetName]
+        start = 0
+        if cursor is not None:
+            fingerprint = query_fingerprint(
+                exporter.data_version, featureSetName, similarity, clusterSize
+            )
+            try:
+                start = decode_cursor(cursor, fingerprint)
+            except ValueError as e:
+                return HTMLResponse(json.dumps({'error': str(e)}), status_code=400)
+        else:
+            # the whole clusters are requested again while the user re-opens the panel
+            cache_key = (
+                'CompactSimilarity',
+                exporter.data_version,
+                featureSetName,
+                similarity,
+                clusterSize,
+                encoding,
+            )
+            cached = exporter.results_cache.get(cache_key)
+            if cached is not None:
+                return compact_response(*cached)
+
+        clusters = similarity_clusters(exporter, featureSetName, similarity, clusterSize)
+        stop = len(clusters)
+        if cursor is not None:
+            stop = min(start + max(limit, 1), stop)
+        page = {
+            'data_version': exporter.data_version,
+            **compact_clusters(clusters, feature_set, start, stop),
+            'total_clusters': len(clusters),
+            'total_items': len(clusters.members),
+        }
+        if cursor is None:
+            body, used_encoding = compact_body(page, encoding)
+            exporter.results_cache.put(cache_key, (body, used_encoding), len(body))
+            return compact_response(body, used_encoding)
+        page['next_cursor'] = (
+            encode_cursor(stop, fingerprint) if stop < len(clusters) else None
+        )
+        return compact_response(
+            *compact_body(page, encoding),
+            headers={
+                'X-Total-Count': str(page['total_clusters']),
+                'X-Total-Items': str(page['total_items']),
+            },
+        )
+
+    elif type == 'Anomalies':
+        feature_set = exporter.feature_sets_export[featureSetName]
+        total, rows = exporter.anomaly_scores[featureSetName].above(
+            similarity, offset=pagination * max(limit, 0), limit=limit
+        )
+        return compact_response(
+            *compact_body(
+                {
+                    'data_version': exporter.data_version,
+                    'items': feature_set.rows[rows],
+                    'total': total,
+                },
+                encoding,
+            )
+        )
+
+    else:
+        found = exporter.quality_rows(type, min_v, max_v, limit, pagination)
+        if found is not None:
+            total, rows = found
+            page = {'items': rows, 'total': total}
+        else:
+            # items queried on the platform are not in the item table, they are sent in full
+            total, records = exporter.quality_score(
+                type, min_v, max_v, limit=limit, pagination=pagination, return_ids=True
+            )
+            page = {'records': records, 'total': total}
+        return compact_response(
+            *compact_body({'data_version': exporter.data_version, **page}, encoding)
+        )
+
 
 @router.get("/get_items")
 async def get_items(
@@ -91,10 +680,13 @@ async def get_items(
     similarity: float,
     type: str,
     pagination: int = 0,
-    limit: int = 10,
+    limit: Optional[int] = None,
     min_v: float = 0,
     max_v: float = 1.0,
     clusterSize: int = 2,
+    cursor: Optional[str] = None,
+    format: str = FORMAT_FULL,
+    accept_encoding: Annotated[Optional[str], Header()] = None,
 ):
     """
     Retrieves items from a dataset based on the specified parameters.
@@ -105,10 +697,17 @@ async def get_items(
         similarity (float): The similarity threshold to use for clustering.
         type (str): The type of items to retrieve (e.g., 'Similarity', 'Anomalies', 'Darkness/Brightness').
         pagination (int): The pagination index to use.
-        limit (int): The number of items to retrieve.
+        limit (int, optional): The number of items to retrieve (0 for all of them), or the number of
+            clusters per page when a cursor is given. By default all the anomalies, else 10.
         min_v (float): The minimum value to use for filtering.
         max_v (float): The maximum value to use for filtering.
         clusterSize (int): The minimum number of items to include in a cluster.
+        cursor (str, optional): An opaque similarity page cursor, empty for the first page.
+            Without it all the clusters are returned at once.
+        format (str): `full` (default) for item dictionaries, or `compact` for rows of the item
+            table returned by `/api/item_table`, without indentation and compressed when accepted.
+        accept_encoding (str, optional): The Accept-Encoding header, the compact responses are
+            compressed with gzip, or brotli when installed.
 
     Returns:
         HTMLResponse: An HTML response containing the items in JSON format with an HTTP status code of 200.
@@ -116,112 +715,64 @@ async def get_items(
     Notes:
         The 'type' parameter can be one of the following:
             - 'Similarity': Retrieves similar items based on the feature set and similarity threshold.
-            - 'Anomalies': Retrieves anomalous items based on the feature set and similarity threshold.
-            - 'Darkness/Brightness': Retrieves items based on the darkness/brightness quality score.
+            - 'Anomalies': Retrieves anomalous items based on the feature set and similarity threshold,
+              the most anomalous first.
+            - 'Darkness/Brightness': Retrieves items based on the darkness/brightness quality score,
+              by ascending score and paged by `pagination`/`limit`.
+
+        With a cursor, the similarity response is a page of `limit` clusters:
+        {'clusters': [...], 'total_clusters': int, 'total_items': int, 'next_cursor': str or None},
+        the totals are also returned in the 'X-Total-Count' and 'X-Total-Items' headers. The full
+        similarity responses return the data version of the export in the 'X-Data-Version' header.
+
+        The compact similarity response is {'data_version': int, 'ids': [...], 'items': [...],
+        'offsets': [...], 'total_clusters': int, 'total_items': int}, the members of the i-th
+        cluster being items[offsets[i]:offsets[i + 1]], the main item first. The compact anomaly and
+        quality responses are {'data_version': int, 'items': [...], 'total': int}, quality items
+        answered by the platform being sent in full as 'records' instead.
     """
-
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    if type == 'Similarity' or type == 'Anomalies':
-        feature_vectors = exporter.feature_sets_export[featureSetName]
-        item_ids = [
-            {
-                'itemId': item['itemId'],
-                'thumbnail': item['thumbnail'],
-                'name': item['name'],
-                'annotated': item['annotated'],
-            }
-            for item in feature_vectors
-        ]
-        eps_value = similarity
-
-        if type == 'Similarity':
-
-            cluster_dict = defaultdict(list)
-
-            # Determine clusters based on eps_value
-            for i, (dist, idx) in enumerate(
-                zip(exporter.distance[featureSetName], exporter.indices[featureSetName])
-            ):
-                cluster_dict[i] = idx[
-                    : np.searchsorted(dist, eps_value, side='right')
-                ].tolist()
-
-            # Sort clusters by size
-            sorted_clusters = sorted(
-                cluster_dict.items(), key=lambda x: len(x[1]), reverse=True
+    if format not in FORMATS:
+        return HTMLResponse(
+            json.dumps({'error': f"Format {format} not supported"}), status_code=400
+        )
+    if limit is None:
+        # the anomalies were returned all at once before they were paged
+        limit = 0 if type == 'Anomalies' else DEFAULT_LIMIT
+
+    params = (
+        featureSetName,
+        similarity,
+        type,
+        pagination,
+        limit,
+        min_v,
+        max_v,
+        clusterSize,
+        cursor,
+    )
+    with GET_ITEMS_SECONDS.time(
+        type=type if type in ('Similarity', 'Anomalies', *QUALITY_TYPES) else 'other'
+    ):
+        async with resident_exporter(datasetId) as exporter:
+            pool = (
+                cpu_pool
+                if type in ('Similarity', 'Anomalies')
+                else quality_pool(exporter, type)
             )
-
-            # Use a set to track used items
-            used_items = set()
-
-            # Prepare the output data structure
-            output_clusters = []
-            cluster_id = 0
-            page_limit = 1000
-            for _, members in sorted_clusters:
-                # Remove used members
-                unique_members = [m for m in members if m not in used_items]
-                if len(unique_members) >= clusterSize:
-                    # Create a new cluster
-                    main_item = item_ids[unique_members[0]]
-                    rest_items = [item_ids[m] for m in unique_members[1:]]
-
-                    cluster_info = {
-                        'key': f"Cluster {cluster_id}",
-                        'main_item': main_item,
-                        'items': rest_items,
-                        'is_choosed': False,
-                    }
-                    output_clusters.append(cluster_info)
-
-                    # Mark members as used
-                    used_items.update(unique_members)
-                    cluster_id += 1
-
-            # Sorting clusters by the number of items (descending order)
-            output_clusters.sort(key=lambda x: len(x['items']), reverse=True)
-
-            total_items_processed = 0
-            for cluster in output_clusters:
-                cluster_size = len(cluster['items'])  # Include the main item
-                cluster['page'] = total_items_processed // page_limit + 1
-                total_items_processed += cluster_size
-
-            # first cluster have is_choosed = True
-            if len(output_clusters) > 0:
-                output_clusters[0]['is_choosed'] = True
-            else:
-                # create dummy cluster
-                output_clusters.append(
-                    {
-                        'key': 'Cluster 0',
-                        'main_item': '',
-                        'items': [],
-                        'is_choosed': True,
-                    }
+            if format == FORMAT_COMPACT:
+                encoding = content_encoding(accept_encoding)
+                return await single_flight.run(
+                    items_key(exporter, *params, format, encoding),
+                    pool.run,
+                    compact_items_response,
+                    exporter,
+                    *params,
+                    encoding,
                 )
-
-            return HTMLResponse(json.dumps(output_clusters, indent=2), status_code=200)
-
-        else:
-            ids = [
-                item_ids[i]
-                for i, dist in enumerate(exporter.distance[featureSetName])
-                if dist[1] > eps_value  # Adjust for cosine similarity
-            ]
-
-            return HTMLResponse(
-                json.dumps({'items': ids, 'total': len(ids)}, indent=2), status_code=200
+            return await single_flight.run(
+                items_key(exporter, *params), pool.run, items_response, exporter, *params
             )
 
-    else:
-        items_count, ids = exporter.quality_score(
-            type, min_v, max_v, pagination, limit, True
-        )
-        return HTMLResponse(
-            json.dumps({'items': ids, 'total': items_count}, indent=2), status_code=200
-        )
-
 
 @router.get("/export/status")
 async def export_status(datasetId: str):
@@ -239,7 +790,7 @@ async def export_status(datasetId: str):
         HTMLResponse: An HTML response containing the export status in JSON format with a status code of 200.
     """
 
-    exporter: Exporter = Exporter(dataset_id=datasetId)
+    exporter: Exporter = await get_exporter(datasetId)
     status = {
         'progress': int(exporter.progress),
         'exportDate': exporter.last_update,
@@ -250,7 +801,13 @@ async def export_status(datasetId: str):
 
 
 @router.get("/export/run")
-async def export_run(datasetId: str, cache: str, background_tasks: BackgroundTasks):
+async def export_run(
+    datasetId: str,
+    cache: str,
+    background_tasks: BackgroundTasks,
+    indexBackend: Optional[str] = None,
+    vectorStorage: Optional[str] = None,
+):
     """
     Initiates an export run for the given dataset.
 
@@ -258,16 +815,115 @@ async def export_run(datasetId: str, cache: str, background_tasks: BackgroundTas
         datasetId (str): The ID of the dataset to be exported.
         cache (str): Indicates whether to use cache during the export process.
         background_tasks (BackgroundTasks): The background tasks manager to handle asynchronous tasks.
+        indexBackend (str, optional): Forces the index backend of the dataset, `flat`, `hnsw` or `ivfpq`,
+                                      or `auto` to choose it by feature set size again.
+        vectorStorage (str, optional): Forces the vector storage of the dataset, `float32`, `float16`,
+                                       `int8` or `pca`.
 
     Returns:
         HTMLResponse: A response indicating that the export process has started.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
+    exporter: Exporter = await get_exporter(datasetId)
+    if indexBackend is not None:
+        if indexBackend != BACKEND_AUTO and indexBackend not in BACKENDS:
+            return HTMLResponse(
+                json.dumps({'error': f"Index backend {indexBackend} not supported"}),
+                status_code=400,
+            )
+        exporter.index_backend = None if indexBackend == BACKEND_AUTO else indexBackend
+    if vectorStorage is not None:
+        if vectorStorage not in STORAGE_NAMES:
+            return HTMLResponse(
+                json.dumps({'error': f"Vector storage {vectorStorage} not supported"}),
+                status_code=400,
+            )
+        exporter.vector_storage = vectorStorage
     exporter.progress = 0
     background_tasks.add_task(exporter.check_and_run, use_cache=cache)
     return HTMLResponse(json.dumps({'status': 'started'}), status_code=200)
 
 
+@router.get("/cache_stats")
+async def cache_stats(datasetId: str):
+    """
+    Retrieve the query results cache counters for a given dataset.
+
+    Args:
+        datasetId (str): The ID of the dataset for which to retrieve the cache counters.
+
+    Returns:
+        HTMLResponse: An HTML response containing the cache hits, misses, evictions and size in JSON format.
+    """
+    exporter: Exporter = await get_exporter(datasetId)
+    return HTMLResponse(
+        json.dumps(exporter.results_cache.stats(), indent=2), status_code=200
+    )
+
+
+@router.get("/request_stats")
+async def request_stats():
+    """
+    Retrieve the counters of the request handling: the coalesced identical queries, the worker pools and
+    the execution poller.
+
+    Returns:
+        HTMLResponse: An HTML response containing the single flight, pool and execution poller counters in JSON format.
+    """
+    stats = {
+        'single_flight': single_flight.stats(),
+        'cpu_pool': cpu_pool.stats(),
+        'io_pool': io_pool.stats(),
+        'execution_poller': EXECUTION_POLLER.stats(),
+        'actions': action_runner.stats(),
+    }
+    return HTMLResponse(json.dumps(stats, indent=2), status_code=200)
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Retrieve the metrics of the service in the Prometheus text format: the export phase, get_items and
+    platform quality query latency histograms, the resident bytes per dataset and feature set, the
+    pending platform executions and the pool and coalescing counters.
+
+    Returns:
+        PlainTextResponse: The metrics.
+    """
+    # the resident bytes gauges measure every dataset, off the event loop
+    body = await io_pool.run(REGISTRY.render)
+    return PlainTextResponse(
+        body, media_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@router.get("/memory")
+async def memory():
+    """
+    Retrieve the memory budget and the bytes of exported state every dataset keeps in memory.
+
+    Returns:
+        HTMLResponse: An HTML response containing the budget, the total resident bytes and the per dataset
+                      heap and memory-mapped bytes, residency and eviction counters in JSON format.
+    """
+    return HTMLResponse(json.dumps(residency.stats(), indent=2), status_code=200)
+
+
+@router.get("/index_info")
+async def index_info(datasetId: str):
+    """
+    Retrieve the index backend, vector storage, parameters and build time of every feature set of a dataset,
+    with the agreement check of compressed vectors.
+
+    Args:
+        datasetId (str): The ID of the dataset for which to retrieve the index information.
+
+    Returns:
+        HTMLResponse: An HTML response containing the per feature set index information in JSON format.
+    """
+    exporter: Exporter = await get_exporter(datasetId)
+    return HTMLResponse(json.dumps(exporter.index_info, indent=2), status_code=200)
+
+
 @router.get("/available_feature_sets")
 async def available_feature_sets(datasetId: str):
     """
@@ -279,15 +935,15 @@ async def available_feature_sets(datasetId: str):
     Returns:
         HTMLResponse: An HTML response containing a JSON-encoded list of feature set names and a status code of 200.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    feature_sets = exporter.get_feature_sets_names()
+    async with resident_exporter(datasetId) as exporter:
+        feature_sets = exporter.get_feature_sets_names()
     return HTMLResponse(json.dumps(feature_sets), status_code=200)
 
 
 @router.get("/start_execution")
 async def start_execution(datasetId: str, exec_type: str):
     """
-    Starts the execution of a dataset export process.
+    Starts the execution of a dataset export process, unless one of the type is already running for the dataset.
     Args:
         datasetId (str): The ID of the dataset to be exported.
         exec_type (str): The type of execution to be performed.
@@ -295,8 +951,8 @@ async def start_execution(datasetId: str, exec_type: str):
         HTMLResponse: A response object containing the status of the execution process in JSON format.
     """
 
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    exporter.start_execution(exec_type)
+    exporter: Exporter = await get_exporter(datasetId)
+    await io_pool.run(exporter.start_execution, exec_type)
     status = {
         'progress': exporter.execution_running.get(exec_type)['progress'],
         'status': exporter.execution_running.get(exec_type)['status'],
@@ -317,7 +973,7 @@ async def get_execution_status(datasetId: str, exec_type: str):
     Returns:
         HTMLResponse: A response object containing the execution status in JSON format with a status code of 200.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
+    exporter: Exporter = await get_exporter(datasetId)
     status = {
         'progress': exporter.execution_running.get(exec_type)['progress'],
         'status': exporter.execution_running.get(exec_type)['status'],
@@ -337,12 +993,441 @@ async def get_quality_score_exist(datasetId: str):
     Returns:
         HTMLResponse: A response object containing the quality score in JSON format and a status code of 200.
     """
-    exporter: Exporter = Exporter(dataset_id=datasetId)
-    items_count = exporter.quality_score('Darkness/Brightness', 0, 1)
+    async with resident_exporter(datasetId) as exporter:
+        items_count = await single_flight.run(
+            ('get_quality_score_exist', datasetId, exporter.data_version),
+            quality_pool(exporter, 'Darkness/Brightness').run,
+            exporter.quality_score,
+            'Darkness/Brightness',
+            0,
+            1,
+        )
     status = items_count
     return HTMLResponse(json.dumps(status), status_code=200)
 
 
+@router.get("/quality_histogram")
+async def quality_histogram(datasetId: str, type: str, bins: int = 20):
+    """
+    Retrieves the number of exported items in quality score bins, for the panel slider.
+
+    Args:
+        datasetId (str): The ID of the dataset.
+        type (str): The quality type, 'Darkness/Brightness' or 'Blurriness/Sharpness'.
+        bins (int): The number of equal width bins between 0 and 1.
+
+    Returns:
+        HTMLResponse: The bin counts and edges and the number of scored items,
+                      or a 404 if no scores of the type were exported.
+    """
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        return HTMLResponse(
+            json.dumps({'error': f"bins must be between 1 and {MAX_HISTOGRAM_BINS}"}),
+            status_code=400,
+        )
+    async with resident_exporter(datasetId) as exporter:
+        histogram = exporter.quality_histogram(type, bins)
+    if histogram is None:
+        return HTMLResponse(
+            json.dumps({'error': f"No {type} quality scores exported"}), status_code=404
+        )
+    return HTMLResponse(json.dumps(histogram), status_code=200)
+
+
+@router.get("/similarity_curve")
+async def similarity_curve(datasetId: str, featureSetName: str, bins: int = 30):
+    """
+    Retrieves the number of similarity clusters and duplicates along the similarity slider.
+
+    Args:
+        datasetId (str): The ID of the dataset.
+        featureSetName (str): The name of the feature set.
+        bins (int): The number of intervals between the thresholds.
+
+    Returns:
+        HTMLResponse: The thresholds and the cluster and duplicate counts at every threshold, with
+                      the 'clustering' they are counted with, `linkage`, whatever the clustering of
+                      the similarity queries, or a 404 if the feature set was not exported.
+    """
+    if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+        return HTMLResponse(
+            json.dumps({'error': f"bins must be between 1 and {MAX_HISTOGRAM_BINS}"}),
+            status_code=400,
+        )
+    async with resident_exporter(datasetId) as exporter:
+        # the hierarchy is built by the first curve or linkage query of an export
+        curve = await single_flight.run(
+            ('similarity_curve', datasetId, exporter.data_version, featureSetName, bins),
+            cpu_pool.run,
+            exporter.similarity_curve,
+            featureSetName,
+            bins,
+        )
+    if curve is None:
+        return HTMLResponse(
+            json.dumps({'error': f"Feature set {featureSetName} not exported"}),
+            status_code=404,
+        )
+    return HTMLResponse(json.dumps(curve), status_code=200)
+
+
+@router.get("/item_table")
+async def item_table(
+    datasetId: str,
+    start: int = 0,
+    limit: int = 0,
+    accept_encoding: Annotated[Optional[str], Header()] = None,
+):
+    """
+    Retrieves the metadata of the exported items, the rows the compact `get_items` responses point to.
+
+    The table is fetched once per export, whole or `limit` rows at a time, and is valid for the
+    compact responses of the same 'data_version'.
+
+    Args:
+        datasetId (str): The ID of the dataset.
+        start (int): The first row.
+        limit (int): The number of rows, 0 for all the following ones.
+        accept_encoding (str, optional): The Accept-Encoding header, the response is compressed when accepted.
+
+    Returns:
+        Response: {'data_version': int, 'start': int, 'total': int, 'ids': [...], 'names': [...],
+                  'thumbnails': [...], 'annotated': [...]} in compact JSON format.
+    """
+    encoding = content_encoding(accept_encoding)
+
+    def table_response(exporter):
+        page = item_table_page(exporter.items, start, limit)
+        return compact_response(
+            *compact_body({'data_version': exporter.data_version, **page}, encoding)
+        )
+
+    async with resident_exporter(datasetId) as exporter:
+        key = ('item_table', datasetId, exporter.data_version, start, limit, encoding)
+        return await single_flight.run(key, cpu_pool.run, table_response, exporter)
+
+
+def cross_duplicates_response(
+    source, target, featureSetName, similarity, maxMatches, limit, cursor
+):
+    """
+    Computes a page of a cross dataset duplicates query, blocking, see `cross_duplicates` for the arguments.
+
+    Returns:
+        HTMLResponse: The page in JSON format.
+    """
+    fingerprint = query_fingerprint(
+        source.data_version,
+        target.dataset.id,
+        target.data_version,
+        featureSetName,
+        similarity,
+        maxMatches,
+    )
+    try:
+        start = decode_cursor(cursor, fingerprint)
+    except ValueError as e:
+        return HTMLResponse(json.dumps({'error': str(e)}), status_code=400)
+    if featureSetName not in source.feature_sets_export:
+        return HTMLResponse(
+            json.dumps({'error': f"Feature set {featureSetName} not exported"}),
+            status_code=404,
+        )
+    if featureSetName not in target.feature_sets_export:
+        return HTMLResponse(
+            json.dumps(
+                {'error': f"Feature set {featureSetName} not exported in the target"}
+            ),
+            status_code=404,
+        )
+
+    # the matches are searched once, then every page is a slice of them
+    cache_key = ('CrossDuplicates', fingerprint)
+    matches = source.results_cache.get(cache_key)
+    if matches is None:
+        try:
+            matches = source.cross_duplicates(
+                featureSetName, target, similarity, maxMatches
+            )
+        except ValueError as e:
+            return HTMLResponse(json.dumps({'error': str(e)}), status_code=400)
+        source.results_cache.put(cache_key, matches, matches.nbytes)
+
+    source_set = source.feature_sets_export[featureSetName]
+    target_set = target.feature_sets_export[featureSetName]
+    stop = min(start + max(limit, 1), len(matches))
+    records = []
+    for i in range(start, stop):
+        targets, distances = matches.matches(i)
+        records.append(
+            {
+                'source_item': source_set.record(matches.sources[i]),
+                'items': [
+                    {**target_set.record(t), 'distance': round(d, 6)}
+                    for t, d in zip(targets.tolist(), distances.tolist())
+                ],
+            }
+        )
+    page = {
+        'matches': records,
+        'total_items': len(matches),
+        'total_pairs': len(matches.targets),
+        'next_cursor': (
+            encode_cursor(stop, fingerprint) if stop < len(matches) else None
+        ),
+    }
+    headers = {
+        'X-Total-Count': str(page['total_items']),
+        'X-Total-Pairs': str(page['total_pairs']),
+    }
+    return HTMLResponse(json.dumps(page, indent=2), headers=headers, status_code=200)
+
+
+@router.get("/cross_duplicates")
+async def cross_duplicates(
+    sourceDatasetId: str,
+    targetDatasetId: str,
+    featureSetName: str,
+    similarity: float,
+    maxMatches: int = 10,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+):
+    """
+    Finds the items of a source dataset that near duplicate items of a target dataset, for
+    example the test items leaked into the train dataset.
+
+    The source vectors are searched against the stored index of the target, the two datasets
+    must have been exported and are not exported again.
+
+    Args:
+        sourceDatasetId (str): The ID of the dataset whose items are searched, e.g. the test dataset.
+        targetDatasetId (str): The ID of the dataset searched against, e.g. the train dataset.
+        featureSetName (str): The name of the feature set, in both datasets.
+        similarity (float): The maximum distance of a near duplicate, as the similarity threshold of `get_items`.
+        maxMatches (int): The maximum number of target near duplicates of every source item.
+        limit (int): The number of source items per page.
+        cursor (str, optional): The opaque cursor of the next page, empty for the first page.
+
+    Returns:
+        HTMLResponse: A page of source items with their target near duplicates, nearest first:
+                      {'matches': [{'source_item': {...}, 'items': [{..., 'distance': float}]}],
+                      'total_items': int, 'total_pairs': int, 'next_cursor': str or None}.
+    """
+    if maxMatches < 1:
+        return HTMLResponse(
+            json.dumps({'error': "maxMatches must be at least 1"}), status_code=400
+        )
+    params = (featureSetName, float(similarity), maxMatches, limit, cursor)
+    async with resident_exporter(sourceDatasetId) as source:
+        async with resident_exporter(targetDatasetId) as target:
+            key = (
+                'cross_duplicates',
+                sourceDatasetId,
+                source.data_version,
+                targetDatasetId,
+                target.data_version,
+            ) + params
+            return await single_flight.run(
+                key, cpu_pool.run, cross_duplicates_response, source, target, *params
+            )
+
+
+class ActionRequest(BaseModel):
+    """
+    The body of a bulk action: the action, and the items given by ID or by similarity cluster.
+
+    Attributes
+    ----------
+    datasetId : str
+        The ID of the dataset of the items.
+    action : str
+        `delete`, `move` or `tag`.
+    itemIds : list
+        The IDs of items to apply the action to.
+    featureSetName : str
+        The feature set of the selected clusters.
+    similarity : float
+        The similarity threshold of the selected clusters.
+    clusterSize : int
+        The minimum cluster size of the selected clusters.
+    clusterIds : list
+        The selected clusters, the number of their `get_items` key or their compact `ids`.
+    dataVersion : int
+        The data version of the export the clusters were listed from, the `X-Data-Version`
+        header or the compact `data_version` of their `get_items` response.
+    cursor : str
+        Instead of dataVersion, a non empty page cursor of the query the clusters were listed by.
+    keepMain : bool
+        Whether the main item of every selected cluster is left out of the action.
+    directory : str
+        The directory items are moved to.
+    targetDatasetId : str
+        The dataset items are moved to, into `directory` or their current path.
+    tag : str
+        The tag set as `metadata.user.cleanup.<tag>` by a tag action.
+    """
+
+    datasetId: str
+    action: str
+    itemIds: List[str] = []
+    featureSetName: Optional[str] = None
+    similarity: Optional[float] = None
+    clusterSize: int = 2
+    clusterIds: List[int] = []
+    dataVersion: Optional[int] = None
+    cursor: Optional[str] = None
+    keepMain: bool = True
+    directory: Optional[str] = None
+    targetDatasetId: Optional[str] = None
+    tag: str = 'duplicate'
+
+
+def selection_error(exporter, body):
+    """
+    Checks that the selected clusters were listed from the current export of the dataset.
+
+    The cluster ids are only valid for the export they were listed from, a new export numbers
+    the clusters again, so an action on them would apply to items that were not selected.
+
+    Args:
+        exporter (Exporter): The exporter of the dataset.
+        body (ActionRequest): The action, with its selected clusters.
+
+    Returns:
+        tuple: The status code and the message of the error, None if the selection is current.
+    """
+    if not body.clusterIds:
+        return None
+    if body.dataVersion is None and not body.cursor:
+        return 400, "Clusters are selected with the dataVersion or cursor of their query"
+    if body.dataVersion is not None and body.dataVersion != exporter.data_version:
+        return 409, "The clusters were listed from another export, list them again"
+    if body.cursor:
+        fingerprint = query_fingerprint(
+            exporter.data_version,
+            body.featureSetName,
+            body.similarity,
+            body.clusterSize,
+        )
+        try:
+            decode_cursor(body.cursor, fingerprint)
+        except ValueError as e:
+            return 409, str(e)
+    return None
+
+
+def selected_item_ids(exporter, body):
+    """
+    Collects the IDs of the items selected by a bulk action.
+
+    Args:
+        exporter (Exporter): The exporter of the dataset.
+        body (ActionRequest): The action, with its item IDs and selected clusters.
+
+    Returns:
+        list: The item IDs, then the IDs of the members of the selected clusters.
+
+    Raises:
+        ValueError: If the clusters are selected without their query, or some are not found.
+    """
+    item_ids = list(body.itemIds)
+    if not body.clusterIds:
+        return item_ids
+    if (
+        body.featureSetName not in exporter.feature_sets_export
+        or body.similarity is None
+    ):
+        raise ValueError(
+            "Clusters are selected by an exported featureSetName and a similarity"
+        )
+    clusters = similarity_clusters(
+        exporter, body.featureSetName, body.similarity, body.clusterSize
+    )
+    positions = np.flatnonzero(np.isin(clusters.ids, body.clusterIds))
+    if len(positions) < len(set(body.clusterIds)):
+        raise ValueError(
+            f"{len(set(body.clusterIds)) - len(positions)} selected clusters not found"
+        )
+    first = 1 if body.keepMain else 0
+    members = [clusters[i][first:] for i in positions]
+    rows = exporter.feature_sets_export[body.featureSetName].rows[
+        np.concatenate(members)
+    ]
+    item_ids.extend(exporter.items.ids[row] for row in rows.tolist())
+    return item_ids
+
+
+@router.post("/actions")
+async def start_action(body: ActionRequest):
+    """
+    Applies an action to items of a dataset in the background: delete them, move them to a
+    directory or another dataset, or tag them, e.g. as duplicates.
+
+    The items are given by ID, or as the members of similarity clusters. The clusters are
+    selected with the data version, or a page cursor, of the export they were listed from,
+    a selection from another export is answered with a 409. The items are applied in batches
+    of filter based calls, and the batches that fail item by item.
+
+    Args:
+        body (ActionRequest): The action and the selected items.
+
+    Returns:
+        HTMLResponse: The state of the queued job, see `/api/actions/{jobId}`.
+    """
+    params = {
+        'directory': body.directory,
+        'target_dataset_id': body.targetDatasetId,
+        'tag': body.tag,
+    }
+    async with resident_exporter(body.datasetId) as exporter:
+        error = selection_error(exporter, body)
+        if error is not None:
+            return HTMLResponse(json.dumps({'error': error[1]}), status_code=error[0])
+        try:
+            item_ids = await cpu_pool.run(selected_item_ids, exporter, body)
+            job = action_runner.submit(exporter.dataset, body.action, item_ids, params)
+        except ValueError as e:
+            return HTMLResponse(json.dumps({'error': str(e)}), status_code=400)
+    return HTMLResponse(json.dumps(job.state(), indent=2), status_code=200)
+
+
+@router.get("/actions/{jobId}")
+async def action_status(jobId: str, maxFailures: int = 100):
+    """
+    Retrieves the progress and the partial failures of a bulk action.
+
+    Args:
+        jobId (str): The ID of the job.
+        maxFailures (int): The number of failed items returned with their error.
+
+    Returns:
+        HTMLResponse: {'status': str, 'total': int, 'done': int, 'failed': int, 'progress': int,
+                      'failures': [{'itemId': str, 'error': str}], ...}, 404 if the job is unknown.
+    """
+    job = action_runner.get(jobId)
+    if job is None:
+        return HTMLResponse(
+            json.dumps({'error': f"Job {jobId} not found"}), status_code=404
+        )
+    return HTMLResponse(json.dumps(job.state(maxFailures), indent=2), status_code=200)
+
+
+@router.get("/actions")
+async def list_actions(datasetId: Optional[str] = None):
+    """
+    Lists the bulk actions, without their failures.
+
+    Args:
+        datasetId (str, optional): The ID of a dataset to list the actions of.
+
+    Returns:
+        HTMLResponse: The states of the jobs, oldest first.
+    """
+    states = [job.state(0) for job in action_runner.jobs(datasetId)]
+    return HTMLResponse(json.dumps(states, indent=2), status_code=200)
+
+
 app.include_router(router, prefix='/api')
 
 app.mount(
@@ -0,0 +1,418 @@
+import contextlib
+import copy
+import logging
+import threading
+from unittest import mock
+
+import dtlpy as dl
+import numpy as np
+
+logger = logging.getLogger('[BENCHMARK]')
+logging.basicConfig(level='INFO')
+
+QUALITY_FIELDS = {
+    'metadata.user.quality_scores.darkness_score': 'darkness',
+    'metadata.user.quality_scores.blurriness_score': 'blurriness',
+}
+# records generated at once by the synthetic export
+BLOCK_ROWS = 4096
+
+
+class SyntheticExport:
+    """
+    A synthetic stand-in for the downloaded export of a dataset, in the format `Exporter.process_data` reads.
+
+    Records are generated on access, block by block and deterministically from the seed, so
+    millions of items do not have to be held as Python objects. Every item has one vector per
+    feature set: a share of the items are near duplicates of an earlier item, some of them exact
+    copies, a share are outliers far from everything, and the others are spread around a few topic centers.
+
+    Attributes
+    ----------
+    n : int
+        The number of items.
+    dimension : int
+        The dimension of the vectors.
+    feature_set_ids : list
+        The ids of the feature sets every item has a vector in.
+    darkness : np.ndarray
+        The darkness quality score of every item.
+    blurriness : np.ndarray
+        The blurriness quality score of every item.
+    annotated : np.ndarray
+        Whether every item is annotated.
+
+    Methods
+    -------
+    record(i)
+        Builds the export record of an item.
+    materialize()
+        Builds the list of all the records, as a real export would.
+    """
+
+    def __init__(
+        self,
+        n,
+        dimension=512,
+        duplicate_rate=0.05,
+        outlier_rate=0.01,
+        exact_copy_rate=0.0,
+        feature_set_ids=('clip',),
+        topics=100,
+        seed=0,
+    ):
+        self.n = int(n)
+        self.dimension = int(dimension)
+        self.feature_set_ids = list(feature_set_ids)
+        self.seed = seed
+        rs = np.random.RandomState(seed)
+        self.darkness = rs.rand(self.n)
+        self.blurriness = rs.rand(self.n)
+        self.annotated = rs.rand(self.n) < 0.3
+        kind = rs.rand(self.n)
+        duplicate = kind < duplicate_rate
+        self._outlier = (kind >= duplicate_rate) & (kind < duplicate_rate + outlier_rate)
+        self._topic = rs.randint(topics, size=self.n)
+        self._centers = rs.randn(len(self.feature_set_ids), topics, self.dimension)
+
+        # every duplicate copies an earlier original item, the copies of an item form a group
+        originals = np.flatnonzero(~duplicate)
+        copies = np.flatnonzero(duplicate)
+        earlier = np.searchsorted(originals, copies)
+        copies, earlier = copies[earlier > 0], earlier[earlier > 0]
+        sources = originals[(rs.rand(len(copies)) * earlier).astype(np.int64)]
+        heads, group_of_copy = np.unique(sources, return_inverse=True)
+        self._group = np.full(self.n, -1, dtype=np.int64)
+        self._group[heads] = np.arange(len(heads))
+        self._group[copies] = group_of_copy.reshape(-1)
+        self._group_vectors = (
+            self._centers[:, self._topic[heads]]
+            + rs.randn(len(self.feature_set_ids), len(heads), self.dimension)
+        ).astype(np.float32)
+        # the share of the duplicates that have the exact vector of their group, as re-uploaded files
+        self._exact = np.zeros(self.n, dtype=bool)
+        self._exact[copies] = rs.rand(len(copies)) < exact_copy_rate
+        self._exact[heads] = exact_copy_rate > 0
+        self._block = None
+        self._block_vectors = None
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def n_duplicates(self):
+        """
+        The number of items that belong to a group of near duplicates.
+        """
+        return int(np.count_nonzero(self._group >= 0))
+
+    def _vectors(self, block):
+        if self._block != block:
+            rows = np.arange(block * BLOCK_ROWS, min(self.n, (block + 1) * BLOCK_ROWS))
+            groups = self._group[rows]
+            grouped = groups >= 0
+            outliers = self._outlier[rows] & ~grouped
+            vectors = []
+            for fs in range(len(self.feature_set_ids)):
+                rs = np.random.RandomState([self.seed, fs, block])
+                block_vectors = self._centers[fs, self._topic[rows]] + rs.randn(
+                    len(rows), self.dimension
+                )
+                block_vectors[outliers] = 10 * rs.randn(
+                    np.count_nonzero(outliers), self.dimension
+                )
+                noise = 0.01 * rs.randn(np.count_nonzero(grouped), self.dimension)
+                noise[self._exact[rows[grouped]]] = 0
+                block_vectors[grouped] = self._group_vectors[fs, groups[grouped]] + noise
+                vectors.append(block_vectors.astype(np.float32))
+            self._block = block
+            self._block_vectors = vectors
+        return self._block_vectors
+
+    def record(self, i):
+        """
+        Builds the export record of an item.
+
+        Args:
+            i (int): The item index.
+
+        Returns:
+            dict: The record, with the item metadata and its vectors as lists of floats.
+        """
+        vectors = self._vectors(i // BLOCK_ROWS)
+        offset = i % BLOCK_ROWS
+        return {
+            'id': f'item-{i:08d}',
+            'name': f'image-{i:08d}.jpg',
+            'thumbnail': f'https://example.com/thumbnails/{i:08d}',
+            'annotated': bool(self.annotated[i]),
+            'metadata': {
+                'user': {
+                    'quality_scores': {
+                        'darkness_score': float(self.darkness[i]),
+                        'blurriness_score': float(self.blurriness[i]),
+                    }
+                }
+            },
+            'itemVectors': [
+                {'featureSetId': fs_id, 'value': vectors[fs][offset].tolist()}
+                for fs, fs_id in enumerate(self.feature_set_ids)
+            ],
+        }
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return self.record(i)
+
+    def __setitem__(self, i, value):
+        # process_data releases the consumed records, there is nothing to release here
+        pass
+
+    def materialize(self):
+        """
+        Builds the list of all the records, as a real export would hold them.
+
+        Returns:
+            list: The records.
+        """
+        return [self.record(i) for i in range(self.n)]
+
+
+class FakeItem:
+    def __init__(self, export, i, items=None):
+        self._items = items
+        self._row = i
+        self.id = f'item-{i:08d}'
+        self.name = f'image-{i:08d}.jpg'
+        self.thumbnail = f'https://example.com/thumbnails/{i:08d}'
+        self.annotated = bool(export.annotated[i])
+        self.dir = '/' if items is None else items.directories.get(i, '/')
+        user = None if items is None else items.user_metadata.get(i)
+        self.metadata = {'user': copy.deepcopy(user)} if user else {}
+
+    def update(self, system_metadata=False):
+        return self._items._update_item(self)
+
+    def move(self, new_path):
+        return self._items._move_item(self, new_path)
+
+    def delete(self):
+        return self._items.delete(item_id=self.id)
+
+    def clone(self, dst_dataset_id=None, remote_filepath=None, **kwargs):
+        return self._items._clone_item(self, dst_dataset_id, remote_filepath)
+
+
+def _merge(target, values):
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class FakePages:
+    def __init__(self, export, rows, items=None):
+        self._export = export
+        self._rows = rows
+        self._items = items
+        self.items_count = len(rows)
+
+    def all(self):
+        for i in self._rows.tolist():
+            yield FakeItem(self._export, i, self._items)
+
+
+class FakeItems:
+    """
+    A stand-in for `dataset.items`, filtering the synthetic items on their quality scores and IDs,
+    and applying the deletes, moves and metadata updates of the bulk actions in memory.
+
+    Failures can be injected: the filter based calls of more than `bulk_limit` items are rejected,
+    and the calls of the items in `failing` always fail.
+
+    Attributes
+    ----------
+    deleted : np.ndarray
+        Whether every item was deleted.
+    directories : dict
+        The directory of every moved item.
+    user_metadata : dict
+        The user metadata set on every item.
+    clones : dict
+        The target dataset and path of every cloned item.
+    calls : dict
+        The number of calls of every kind.
+    """
+
+    def __init__(self, export, bulk_limit=None, failing=()):
+        self._export = export
+        self.bulk_limit = bulk_limit
+        self.failing = set(failing)
+        self.deleted = np.zeros(export.n, dtype=bool)
+        self.directories = {}
+        self.user_metadata = {}
+        self.clones = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, kind):
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def _row(self, item_id):
+        row = int(item_id.rsplit('-', 1)[1])
+        if self.deleted[row]:
+            raise dl.exceptions.NotFound('404', f'Item not found: {item_id}')
+        if row in self.failing:
+            raise dl.exceptions.InternalServerError(
+                '500', f'Injected failure: {item_id}'
+            )
+        return row
+
+    def _rows(self, filters):
+        mask = ~self.deleted
+        for single in filters.and_filter_list if filters is not None else []:
+            if single.field == 'id':
+                rows = [int(item_id.rsplit('-', 1)[1]) for item_id in single.values]
+                in_ids = np.zeros(self._export.n, dtype=bool)
+                in_ids[rows] = True
+                mask &= in_ids
+                continue
+            column = QUALITY_FIELDS.get(single.field)
+            if column is None:
+                continue
+            values = getattr(self._export, column)
+            operator = single.operator
+            if operator == dl.FiltersOperations.GREATER_THAN:
+                mask &= values > single.values
+            elif operator == dl.FiltersOperations.LESS_THAN:
+                mask &= values < single.values
+            else:
+                mask &= values == single.values
+        return np.flatnonzero(mask)
+
+    def _bulk(self, kind, filters):
+        self._call(f'bulk_{kind}')
+        rows = self._rows(filters)
+        if self.bulk_limit is not None and len(rows) > self.bulk_limit:
+            raise dl.exceptions.BadRequest('400', 'Too many items in the query')
+        return rows
+
+    def list(self, filters=None):
+        return FakePages(self._export, self._rows(filters), self)
+
+    def get(self, item_id=None, **kwargs):
+        self._call('get')
+        return FakeItem(self._export, self._row(item_id), self)
+
+    def delete(self, item_id=None, filters=None, **kwargs):
+        if filters is not None:
+            self.deleted[self._bulk('delete', filters)] = True
+            return True
+        self._call('delete')
+        self.deleted[self._row(item_id)] = True
+        return True
+
+    def update(self, filters=None, update_values=None, **kwargs):
+        rows = self._bulk('update', filters)
+        # the values are set under metadata.user, as in the query the SDK sends
+        prepared = filters.prepare(operation='update', update=update_values)
+        user = prepared['update']['metadata']['user']
+        with self._lock:
+            for row in rows.tolist():
+                _merge(self.user_metadata.setdefault(row, {}), user)
+        return {'updated': len(rows)}
+
+    def move_items(self, destination, filters=None, **kwargs):
+        for row in self._bulk('move', filters).tolist():
+            self.directories[row] = destination
+        return True
+
+    def _update_item(self, item):
+        self._call('update')
+        row = self._row(item.id)
+        self.user_metadata[row] = copy.deepcopy(item.metadata.get('user', {}))
+        return item
+
+    def _move_item(self, item, new_path):
+        self._call('move')
+        self.directories[self._row(item.id)] = new_path.rstrip('/') or '/'
+        return item
+
+    def _clone_item(self, item, dst_dataset_id, remote_filepath):
+        self._call('clone')
+        self.clones[self._row(item.id)] = (dst_dataset_id, remote_filepath)
+        return item
+
+
+class FakeFeatureSet:
+    def __init__(self, feature_set_id, name):
+        self.id = feature_set_id
+        self.name = name
+
+
+class FakeFeatureSets:
+    def __init__(self, feature_sets):
+        self._feature_sets = feature_sets
+
+    def list(self):
+        return self
+
+    def all(self):
+        return iter(self._feature_sets)
+
+
+class FakeProject:
+    def __init__(self, feature_sets):
+        self.id = 'benchmark-project'
+        self.feature_sets = FakeFeatureSets(feature_sets)
+
+
+class FakeDataset:
+    """
+    A stand-in for the `dl.Dataset` the exporter reads feature sets and items from.
+    """
+
+    def __init__(self, dataset_id, export):
+        self.id = dataset_id
+        self.project = FakeProject(
+            [FakeFeatureSet(fs_id, fs_id) for fs_id in export.feature_set_ids]
+        )
+        self.items = FakeItems(export)
+
+
+@contextlib.contextmanager
+def offline_exporter(exporter_cls, dataset_id, export):
+    """
+    Creates an exporter of a synthetic dataset, without calling the Dataloop platform.
+
+    The platform bound initialization of `ExportBase` is replaced until the context exits.
+
+    Args:
+        exporter_cls (type): The exporter class, `Exporter`.
+        dataset_id (str): The id of the synthetic dataset.
+        export (SyntheticExport): The synthetic export, set as the downloaded data.
+
+    Yields:
+        Exporter: The exporter, ready for `process_data`.
+    """
+    # imported here, the items fakes are used without the exporter package
+    from dtlpy_exporter import ExportBase, ExportStatus
+
+    def init(self, dataset_id, *args, **kwargs):
+        if getattr(self, 'dataset', None) is None:
+            self.dataset = FakeDataset(dataset_id, export)
+            self.download_data = export
+            self.progress = 0
+            self.status = ExportStatus.READY
+            self.last_update = None
+
+    # the routes create the exporter of the dataset again, the patch stays for their calls
+    with mock.patch.object(ExportBase, '__init__', init):
+        exporter = exporter_cls(dataset_id=dataset_id)
+        exporter.download_data = export
+        yield exporter
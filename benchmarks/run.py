@@ -0,0 +1,443 @@
+"""
+Offline benchmark of the dataset cleanup service on synthetic datasets.
+
+Times and memory-profiles the export processing and the panel queries against a local
+stand-in for the Dataloop export, and writes the results as JSON:
+
+    python -m benchmarks.run --sizes 10000,100000,1000000 --dimension 512 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger('[BENCHMARK]')
+logging.basicConfig(level='INFO')
+
+SIMILARITY_THRESHOLDS = (0.001, 0.01, 0.05)
+ANOMALY_THRESHOLDS = (0.5, 0.8)
+QUALITY_RANGES = (
+    ('Darkness/Brightness', 0.0, 0.1),
+    ('Blurriness/Sharpness', 0.4, 0.6),
+)
+
+
+class MemorySampler:
+    """
+    Samples the resident set size of the process in a background thread while a phase runs.
+
+    Attributes
+    ----------
+    start : int
+        The RSS in bytes when the phase started.
+    peak : int
+        The highest RSS in bytes sampled during the phase.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        from modules.memory import current_rss_bytes
+
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def __enter__(self):
+        from modules.memory import current_rss_bytes
+
+        self.start = self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        from modules.memory import current_rss_bytes
+
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def measure(function):
+    """
+    Runs a function, timing it and sampling the memory it uses.
+
+    Returns:
+        tuple: The function result and a dictionary of its duration, RSS peak and RSS growth in bytes.
+    """
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+    from modules.memory import current_rss_bytes
+
+    return result, {
+        'seconds': round(seconds, 4),
+        'peak_rss_bytes': memory.peak,
+        'peak_rss_growth_bytes': memory.peak - memory.start,
+        'rss_growth_bytes': current_rss_bytes() - memory.start,
+    }
+
+
+def query(app, **params):
+    """
+    Calls the get_items route in process, cold then warm.
+
+    Returns:
+        dict: The query parameters, the cold and warm durations and the response size.
+    """
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        response = asyncio.run(app.get_items(**params))
+        timings.append(time.perf_counter() - start)
+    return {
+        'params': {k: v for k, v in params.items() if k != 'datasetId'},
+        'status_code': response.status_code,
+        'seconds_cold': round(timings[0], 4),
+        'seconds_warm': round(timings[1], 4),
+        'response_bytes': len(response.body),
+    }
+
+
+def serialization(app, exporter, feature_set, similarity):
+    """
+    Serializes the whole clusters of a similarity query in the full and the compact formats.
+
+    Returns:
+        dict: The threshold, and the seconds and bytes of every format, with and without gzip.
+    """
+    from modules.wire import compact_clusters, compress, encode_json
+
+    clusters = app.similarity_clusters(exporter, feature_set, similarity, 2)
+    vectors = exporter.feature_sets_export[feature_set]
+    formats = {
+        'full': lambda: json.dumps(
+            app.cluster_records(clusters, vectors, 0, len(clusters)), indent=2
+        ).encode(),
+        'compact': lambda: encode_json(
+            compact_clusters(clusters, vectors, 0, len(clusters))
+        ),
+    }
+    result = {'similarity': similarity, 'clusters': len(clusters)}
+    for name, encode in formats.items():
+        start = time.perf_counter()
+        body = encode()
+        encoded = time.perf_counter()
+        compressed, _ = compress(body, 'gzip')
+        result[name] = {
+            'seconds': round(encoded - start, 4),
+            'bytes': len(body),
+            'gzip_seconds': round(time.perf_counter() - encoded, 4),
+            'gzip_bytes': len(compressed),
+        }
+    return result
+
+
+def wait_action(app, response):
+    job = app.action_runner.get(json.loads(response.body)['jobId'])
+    while job.finished is None:
+        time.sleep(0.01)
+    return job
+
+
+def actions(app, exporter, feature_set, similarity):
+    """
+    Applies bulk actions to the duplicates of every similarity cluster, through the actions
+    route and against the fake items API.
+
+    The duplicates are tagged with filter based calls, then moved with the filter based calls
+    rejected and 1% of the items failing, so that they are applied item by item, then deleted.
+    The items changed in the fake are counted to check the reported progress.
+
+    Returns:
+        list: The action, the duration, the job state counters and the changed items of every action.
+    """
+    from modules.actions import ACTION_DELETE, ACTION_MOVE, ACTION_TAG
+
+    clusters = app.similarity_clusters(exporter, feature_set, similarity, 2)
+    items = exporter.dataset.items
+    selection = {
+        'datasetId': exporter.dataset.id,
+        'featureSetName': feature_set,
+        'similarity': similarity,
+        'clusterIds': clusters.ids.tolist(),
+        'dataVersion': exporter.data_version,
+    }
+    body = app.ActionRequest(action=ACTION_TAG, **selection)
+    selected = app.selected_item_ids(exporter, body)
+    failing = {int(item_id.rsplit('-', 1)[1]) for item_id in selected[::100]}
+    runs = (
+        (ACTION_TAG, {}, lambda: len(items.user_metadata)),
+        (ACTION_MOVE, {'directory': '/duplicates'}, lambda: len(items.directories)),
+        (ACTION_DELETE, {}, lambda: int(items.deleted.sum())),
+    )
+    results = []
+    for action, params, changed in runs:
+        if action == ACTION_MOVE:
+            items.bulk_limit, items.failing = 100, failing
+        else:
+            items.bulk_limit, items.failing = None, set()
+        start = time.perf_counter()
+        response = asyncio.run(
+            app.start_action(app.ActionRequest(action=action, **selection, **params))
+        )
+        job = wait_action(app, response)
+        state = job.state(0)
+        results.append(
+            {
+                'action': action,
+                'seconds': round(time.perf_counter() - start, 4),
+                'status': state['status'],
+                'total': state['total'],
+                'done': state['done'],
+                'failed': state['failed'],
+                'bulk_calls': state['bulk_calls'],
+                'item_calls': state['item_calls'],
+                'changed_items': changed(),
+            }
+        )
+    return results
+
+
+def run_size(config):
+    """
+    Benchmarks one dataset size, in a fresh process for its memory measures to be its own.
+
+    Args:
+        config (dict): The dataset size and the benchmark parameters.
+
+    Returns:
+        dict: The measures of every phase and query.
+    """
+    os.environ['CLEANUP_INDEX_DIR'] = config['index_dir']
+    os.environ['CLEANUP_VECTOR_STORAGE'] = config['vector_storage']
+    if config['shard_min_items']:
+        os.environ['CLEANUP_SHARD_MIN_ITEMS'] = str(config['shard_min_items'])
+    os.environ['CLEANUP_SHARDS'] = str(config['shards'])
+    os.environ['CLEANUP_SHARD_PROCESSES'] = str(config['shard_processes'])
+    import app
+    from modules.exporter import Exporter
+    from benchmarks.fakes import SyntheticExport, offline_exporter
+
+    n = config['size']
+    dataset_id = f"benchmark-{n}"
+    export = SyntheticExport(
+        n,
+        dimension=config['dimension'],
+        duplicate_rate=config['duplicate_rate'],
+        outlier_rate=config['outlier_rate'],
+        exact_copy_rate=config['exact_copy_rate'],
+        feature_set_ids=[f'fs-{i}' for i in range(config['feature_sets'])],
+        seed=config['seed'],
+    )
+    result = {
+        'size': n,
+        'dimension': config['dimension'],
+        'feature_sets': config['feature_sets'],
+        'duplicates': export.n_duplicates,
+        'phases': {},
+        'queries': [],
+        'serialization': [],
+    }
+    with offline_exporter(Exporter, dataset_id, export) as exporter:
+        if config['materialize']:
+            records, result['phases']['materialize_export'] = measure(export.materialize)
+            exporter.download_data = records
+            del records
+        _, result['phases']['process_data'] = measure(exporter.process_data)
+        result['index_info'] = exporter.index_info
+
+        # a second export of the same content is served from the index store
+        exporter.download_data = export
+        _, result['phases']['process_data_unchanged'] = measure(exporter.process_data)
+
+        feature_set = export.feature_set_ids[0]
+        for similarity in config['similarity_thresholds']:
+            # the whole clusters response, then the first page of the paged one
+            for cursor in (None, ''):
+                result['queries'].append(
+                    query(
+                        app,
+                        datasetId=dataset_id,
+                        featureSetName=feature_set,
+                        similarity=similarity,
+                        type='Similarity',
+                        clusterSize=2,
+                        cursor=cursor,
+                        limit=100,
+                    )
+                )
+            # the whole clusters response in the compact format, gzipped
+            result['queries'].append(
+                query(
+                    app,
+                    datasetId=dataset_id,
+                    featureSetName=feature_set,
+                    similarity=similarity,
+                    type='Similarity',
+                    clusterSize=2,
+                    format='compact',
+                    accept_encoding='gzip',
+                )
+            )
+            result['serialization'].append(
+                serialization(app, exporter, feature_set, similarity)
+            )
+        # the item table the compact responses point to, fetched once per export
+        start = time.perf_counter()
+        response = asyncio.run(
+            app.item_table(datasetId=dataset_id, accept_encoding='gzip')
+        )
+        result['item_table'] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'response_bytes': len(response.body),
+        }
+        for threshold in config['anomaly_thresholds']:
+            result['queries'].append(
+                query(
+                    app,
+                    datasetId=dataset_id,
+                    featureSetName=feature_set,
+                    similarity=threshold,
+                    type='Anomalies',
+                    pagination=0,
+                    limit=100,
+                )
+            )
+        for qtype, min_v, max_v in config['quality_ranges']:
+            result['queries'].append(
+                query(
+                    app,
+                    datasetId=dataset_id,
+                    featureSetName=feature_set,
+                    similarity=0,
+                    type=qtype,
+                    min_v=min_v,
+                    max_v=max_v,
+                    pagination=0,
+                    limit=100,
+                )
+            )
+        # last, the fake items are changed
+        result['actions'] = actions(
+            app, exporter, feature_set, config['similarity_thresholds'][-1]
+        )
+    return result
+
+
+def environment():
+    import faiss
+    import numpy as np
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'dataloop.json')) as f:
+        version = json.load(f).get('version')
+    return {
+        'version': version,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'faiss': faiss.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--dimension', type=int, default=512)
+    parser.add_argument('--feature-sets', type=int, default=1)
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--outlier-rate', type=float, default=0.01)
+    parser.add_argument('--exact-copy-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--vector-storage',
+        default='float32',
+        help='float32, float16, int8 or pca, the encoding of the held vectors',
+    )
+    parser.add_argument(
+        '--shard-min-items',
+        type=int,
+        default=0,
+        help='index feature sets of at least this many items in shards, 0 keeps the service default',
+    )
+    parser.add_argument(
+        '--shards', type=int, default=0, help='the number of shards, 0 for one per process'
+    )
+    parser.add_argument(
+        '--shard-processes',
+        type=int,
+        default=0,
+        help='the processes building and searching the shards, 0 for the index threads',
+    )
+    parser.add_argument(
+        '--materialize',
+        action='store_true',
+        help='hold the whole export as Python records, as a real download does',
+    )
+    parser.add_argument(
+        '--index-dir', default='', help='index store root, a fresh temporary directory by default'
+    )
+    parser.add_argument('--output', default='benchmark_results.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {'environment': environment(), 'config': vars(args), 'runs': []}
+    context = multiprocessing.get_context('spawn')
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        with tempfile.TemporaryDirectory(prefix='cleanup-benchmark-') as tmp_dir:
+            config = {
+                'size': size,
+                'dimension': args.dimension,
+                'feature_sets': args.feature_sets,
+                'duplicate_rate': args.duplicate_rate,
+                'outlier_rate': args.outlier_rate,
+                'exact_copy_rate': args.exact_copy_rate,
+                'seed': args.seed,
+                'vector_storage': args.vector_storage,
+                'shard_min_items': args.shard_min_items,
+                'shards': args.shards,
+                'shard_processes': args.shard_processes,
+                'materialize': args.materialize,
+                'index_dir': args.index_dir or tmp_dir,
+                'similarity_thresholds': SIMILARITY_THRESHOLDS,
+                'anomaly_thresholds': ANOMALY_THRESHOLDS,
+                'quality_ranges': QUALITY_RANGES,
+            }
+            logger.info("Benchmarking %d items", size)
+            # not a multiprocessing.Pool, whose daemonic worker cannot start the shard workers
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                run = pool.submit(run_size, config).result()
+            results['runs'].append(run)
+            logger.info(
+                "%d items processed in %.1f[s], peak RSS %.0f MB",
+                size,
+                run['phases']['process_data']['seconds'],
+                run['phases']['process_data']['peak_rss_bytes'] / 1024**2,
+            )
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    logger.info("Results written to %s", args.output)
+    return results
+
+
+if __name__ == '__main__':
+    sys.exit(main() and 0)
@@ -0,0 +1,381 @@
+import time
+import uuid
+import logging
+import posixpath
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import dtlpy as dl
+
+logger = logging.getLogger('[ACTIONS]')
+logging.basicConfig(level='INFO')
+
+ACTION_DELETE = 'delete'
+ACTION_MOVE = 'move'
+ACTION_TAG = 'tag'
+ACTIONS = (ACTION_DELETE, ACTION_MOVE, ACTION_TAG)
+# the user metadata the tags of the tag action are set in, as metadata.user.cleanup.<tag> = true
+TAG_METADATA = 'cleanup'
+# the failures returned by the job state, the others are only counted
+MAX_REPORTED_FAILURES = 100
+
+
+class ActionJob:
+    """
+    A bulk action applied to items of a dataset, in batches, by the action runner.
+
+    Attributes
+    ----------
+    id : str
+        The ID of the job.
+    dataset_id : str
+        The ID of the dataset of the items.
+    action : str
+        `delete`, `move` or `tag`.
+    item_ids : list
+        The IDs of the items, without repetitions.
+    params : dict
+        The `directory` and `target_dataset_id` of a move, the `tag` of a tag action.
+    status : str
+        `queued`, `running`, then `success`, `partial` when some items failed, or `failed`.
+    done : int
+        The number of items the action was applied to.
+    failures : dict
+        The error of every item the action failed for.
+    bulk_calls : int
+        The filter based calls made, one per batch.
+    item_calls : int
+        The items the action was applied to one by one.
+
+    Methods
+    -------
+    state(max_failures)
+        Returns the progress and the failures of the job.
+    """
+
+    def __init__(self, dataset_id, action, item_ids, params):
+        self.id = uuid.uuid4().hex
+        self.dataset_id = dataset_id
+        self.action = action
+        self.item_ids = list(dict.fromkeys(item_ids))
+        self.params = params
+        self.status = 'queued'
+        self.done = 0
+        self.failures = {}
+        self.bulk_calls = 0
+        self.item_calls = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def _succeeded(self, count):
+        with self._lock:
+            self.done += count
+
+    def _failed(self, item_id, error):
+        with self._lock:
+            self.failures[item_id] = error
+
+    def state(self, max_failures=MAX_REPORTED_FAILURES):
+        """
+        Returns the progress and the failures of the job.
+
+        Args:
+            max_failures (int): The number of failed items returned with their error.
+
+        Returns:
+            dict: The job, its counters and progress percentage, and the first failures.
+        """
+        with self._lock:
+            processed = self.done + len(self.failures)
+            failures = [
+                {'itemId': item_id, 'error': error}
+                for item_id, error in list(self.failures.items())[:max_failures]
+            ]
+            return {
+                'jobId': self.id,
+                'datasetId': self.dataset_id,
+                'action': self.action,
+                'params': self.params,
+                'status': self.status,
+                'total': len(self.item_ids),
+                'done': self.done,
+                'failed': len(self.failures),
+                'progress': (
+                    100 if not self.item_ids else int(100 * processed / len(self.item_ids))
+                ),
+                'bulk_calls': self.bulk_calls,
+                'item_calls': self.item_calls,
+                'error': self.error,
+                'failures': failures,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+
+class ActionRunner:
+    """
+    Applies the bulk actions on the items of the datasets in background threads.
+
+    The items of a job are split in batches, every batch is applied with one filter based call
+    on the `id` of its items. A batch whose call fails, and the moves to another dataset which
+    have no filter based call, are applied item by item by a pool of threads shared by all the
+    jobs, which bounds the concurrent connections to the platform. The items still failing are
+    reported with their error, the others are applied.
+
+    Attributes
+    ----------
+    batch_size : int
+        The maximum number of items of a filter based call.
+    max_jobs : int
+        The jobs running at once, the others are queued.
+    history : int
+        The finished jobs kept for their state.
+
+    Methods
+    -------
+    submit(dataset, action, item_ids, params)
+        Queues a job.
+    get(job_id)
+        Returns a job.
+    jobs(dataset_id)
+        Returns the jobs of a dataset.
+    stats()
+        Returns the counters.
+    """
+
+    def __init__(self, batch_size, item_workers, max_jobs=2, history=100):
+        self.batch_size = max(int(batch_size), 1)
+        self.max_jobs = max(int(max_jobs), 1)
+        self.history = max(int(history), 1)
+        self.submitted = 0
+        self.bulk_failures = 0
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._runner = ThreadPoolExecutor(
+            max_workers=self.max_jobs, thread_name_prefix='cleanup-action'
+        )
+        self._items = ThreadPoolExecutor(
+            max_workers=max(int(item_workers), 1),
+            thread_name_prefix='cleanup-action-item',
+        )
+
+    def submit(self, dataset, action, item_ids, params=None):
+        """
+        Queues a bulk action.
+
+        Args:
+            dataset (dl.entities.Dataset): The dataset of the items.
+            action (str): `delete`, `move` or `tag`.
+            item_ids (list): The IDs of the items.
+            params (dict): The `directory` and `target_dataset_id` of a move, the `tag` of a tag action.
+
+        Returns:
+            ActionJob: The queued job.
+
+        Raises:
+            ValueError: If the action is unknown or its parameters are missing.
+        """
+        params = dict(params or {})
+        if action not in ACTIONS:
+            raise ValueError(f"Action {action} not supported")
+        if action == ACTION_MOVE and not (
+            params.get('directory') or params.get('target_dataset_id')
+        ):
+            raise ValueError("A move needs a directory or a target dataset")
+        if action == ACTION_TAG and not params.get('tag'):
+            raise ValueError("A tag action needs a tag")
+        job = ActionJob(dataset.id, action, item_ids, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self.submitted += 1
+            finished = [j for j in self._jobs.values() if j.finished is not None]
+            for old in finished[: max(len(finished) - self.history, 0)]:
+                del self._jobs[old.id]
+        logger.info(
+            "Queued %s of %d items of dataset %s as job %s",
+            action,
+            len(job),
+            dataset.id,
+            job.id,
+        )
+        self._runner.submit(self._run, job, dataset)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns a job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            ActionJob: The job, None if it is unknown or was dropped from the history.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, dataset_id=None):
+        """
+        Returns the known jobs, oldest first.
+
+        Args:
+            dataset_id (str): The ID of a dataset to return the jobs of, None for all.
+
+        Returns:
+            list: The jobs.
+        """
+        with self._lock:
+            return [
+                job
+                for job in self._jobs.values()
+                if dataset_id is None or job.dataset_id == dataset_id
+            ]
+
+    def _run(self, job, dataset):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            for start in range(0, len(job.item_ids), self.batch_size):
+                batch = job.item_ids[start : start + self.batch_size]
+                if not self._apply_bulk(job, dataset, batch):
+                    self._apply_items(job, dataset, batch)
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.error = str(e)
+        job.finished = time.time()
+        if job.error is not None or (job.item_ids and job.done == 0):
+            job.status = 'failed'
+        elif job.failures:
+            job.status = 'partial'
+        else:
+            job.status = 'success'
+        logger.info(
+            "Job %s %s: %d items done, %d failed in %.1f[s]",
+            job.id,
+            job.status,
+            job.done,
+            len(job.failures),
+            job.finished - job.started,
+        )
+
+    @staticmethod
+    def _filters(batch):
+        filters = dl.Filters()
+        filters.add(field='id', values=batch, operator=dl.FiltersOperations.IN)
+        filters.page_size = len(batch)
+        return filters
+
+    def _apply_bulk(self, job, dataset, batch):
+        """
+        Applies the action to a batch with one filter based call.
+
+        The filter calls do not return the items they were applied to, the items of the batch
+        are listed first: the ones that are not found (already deleted, or moved out of the
+        dataset) are applied one by one, so they are reported as failures instead of counted as done.
+
+        Returns:
+            bool: False if the batch was not applied and is to be applied item by item.
+        """
+        params = job.params
+        if job.action == ACTION_MOVE and params.get('target_dataset_id'):
+            return False
+        try:
+            job.bulk_calls += 1
+            filters = self._filters(batch)
+            matched = {item.id for item in dataset.items.list(filters=filters).all()}
+            if not matched:
+                applied = True
+            elif job.action == ACTION_DELETE:
+                applied = dataset.items.delete(filters=filters)
+            elif job.action == ACTION_MOVE:
+                applied = dataset.items.move_items(
+                    destination=params['directory'], filters=filters
+                )
+            else:
+                # the update values are set under metadata.user by the filters
+                applied = dataset.items.update(
+                    filters=filters,
+                    update_values={TAG_METADATA: {params['tag']: True}},
+                )
+        except Exception as e:
+            applied = False
+            logger.warning(
+                "Bulk %s of %d items failed, applying them one by one: %s",
+                job.action,
+                len(batch),
+                e,
+            )
+        if applied is False or applied is None:
+            self.bulk_failures += 1
+            return False
+        job._succeeded(len(matched))
+        missing = [item_id for item_id in batch if item_id not in matched]
+        if missing:
+            self._apply_items(job, dataset, missing)
+        return True
+
+    def _apply_items(self, job, dataset, batch):
+        job.item_calls += len(batch)
+        futures = [
+            (item_id, self._items.submit(self._apply_item, job, dataset, item_id))
+            for item_id in batch
+        ]
+        for item_id, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                job._failed(item_id, str(e) or type(e).__name__)
+            else:
+                job._succeeded(1)
+
+    @staticmethod
+    def _apply_item(job, dataset, item_id):
+        params = job.params
+        if job.action == ACTION_DELETE:
+            if dataset.items.delete(item_id=item_id) is False:
+                raise RuntimeError("Delete failed")
+            return
+        item = dataset.items.get(item_id=item_id)
+        if job.action == ACTION_TAG:
+            user = item.metadata.setdefault('user', {})
+            user.setdefault(TAG_METADATA, {})[params['tag']] = True
+            if item.update() is None:
+                raise RuntimeError("Update failed")
+            return
+        directory = params.get('directory')
+        if params.get('target_dataset_id'):
+            item.clone(
+                dst_dataset_id=params['target_dataset_id'],
+                remote_filepath=(
+                    posixpath.join(directory, item.name) if directory else None
+                ),
+            )
+            if item.delete() is False:
+                raise RuntimeError("Cloned, but the source item was not deleted")
+        elif item.move(new_path=directory.rstrip('/') + '/') is None:
+            raise RuntimeError("Move failed")
+
+    def stats(self):
+        """
+        Returns the counters.
+
+        Returns:
+            dict: The submitted jobs, the jobs by status and the bulk calls that fell back to item calls.
+        """
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            'submitted': self.submitted,
+            'jobs': statuses,
+            'bulk_failures': self.bulk_failures,
+        }
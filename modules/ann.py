@@ -0,0 +1,254 @@
+import abc
+import logging
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger('[ANN]')
+logging.basicConfig(level='INFO')
+
+BACKEND_AUTO = 'auto'
+BACKEND_FLAT = 'flat'
+BACKEND_HNSW = 'hnsw'
+BACKEND_IVFPQ = 'ivfpq'
+# rows re-ranked at once by the approximate backends, to bound the gathered candidate vectors
+RERANK_CHUNK_ROWS = 256
+
+
+class IndexBackend(abc.ABC):
+    """
+    The base class of the approximate nearest neighbour index types a feature set can be indexed with.
+
+    Every backend returns squared L2 distances between the normalized vectors, sorted by
+    ascending distance, so the similarity and anomaly thresholds mean the same whatever the backend.
+
+    Attributes
+    ----------
+    name : str
+        The name of the backend, as used in the configuration.
+    approximate_distances : bool
+        Whether the index returns approximate distances, its results are then re-ranked
+        against the vectors and it cannot be range searched or updated incrementally.
+
+    Methods
+    -------
+    params(n, dimension)
+        Returns the parameters of the index, part of the stored entries fingerprint.
+    build(vectors, quantizer=None)
+        Creates an empty, trained index for the vectors.
+    search(index, queries, k, vectors)
+        Searches the k nearest neighbours of the queries.
+    set_search_depth(index, depth)
+        Sets how exhaustive the searches of the index are, None for the default.
+    """
+
+    name = None
+    approximate_distances = False
+
+    @abc.abstractmethod
+    def params(self, n, dimension):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def build(self, vectors, quantizer=None):
+        """
+        Creates an empty, trained index for the vectors.
+
+        Args:
+            vectors (np.ndarray): The float32 (N, dimension) vectors to index.
+            quantizer (faiss.ScalarQuantizer, optional): The trained quantizer of the compressed
+                                                         vectors, the index then stores their codes.
+
+        Returns:
+            faiss.Index: The index.
+        """
+        raise NotImplementedError
+
+    def search(self, index, queries, k, vectors):
+        """
+        Searches the k nearest neighbours of the queries.
+
+        Args:
+            index (faiss.Index): The index of the vectors.
+            queries (np.ndarray): A float32 (M, dimension) matrix of queries.
+            k (int): The number of neighbours.
+            vectors (np.ndarray): The indexed vectors, used by the backends that re-rank their results.
+
+        Returns:
+            tuple: The (M, k) float32 distances and int64 indices.
+        """
+        return index.search(queries, k)
+
+    def set_search_depth(self, index, depth=None):
+        pass
+
+
+class FlatBackend(IndexBackend):
+    """
+    Exact brute force search, the fastest for small feature sets.
+    """
+
+    name = BACKEND_FLAT
+
+    def params(self, n, dimension):
+        return {'index': 'FlatL2'}
+
+    def build(self, vectors, quantizer=None):
+        if quantizer is None:
+            return faiss.IndexFlatL2(vectors.shape[1])
+        index = faiss.IndexScalarQuantizer(
+            vectors.shape[1], quantizer.qtype, faiss.METRIC_L2
+        )
+        _set_quantizer(index, quantizer)
+        return index
+
+
+class HNSWBackend(IndexBackend):
+    """
+    A HNSW graph over the full vectors, fast and accurate but with a per vector link overhead.
+    """
+
+    name = BACKEND_HNSW
+
+    def __init__(self, m=32, ef_search=50):
+        self.m = m
+        self.ef_search = ef_search
+
+    def params(self, n, dimension):
+        return {'index': 'HNSWFlat', 'M': self.m, 'efSearch': self.ef_search}
+
+    def build(self, vectors, quantizer=None):
+        if quantizer is None:
+            index = faiss.IndexHNSWFlat(vectors.shape[1], self.m)
+        else:
+            index = faiss.IndexHNSWSQ(vectors.shape[1], quantizer.qtype, self.m)
+            _set_quantizer(faiss.downcast_index(index.storage), quantizer)
+            index.is_trained = True
+        index.metric_type = faiss.METRIC_ABS_INNER_PRODUCT
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def set_search_depth(self, index, depth=None):
+        index.hnsw.efSearch = max(depth or 0, self.ef_search)
+
+
+class IVFPQBackend(IndexBackend):
+    """
+    An inverted file of product quantized codes, a fraction of the memory of the full vectors.
+
+    The codes only give approximate distances, so more candidates than asked are retrieved
+    and re-ranked with the exact distances to the vectors.
+    """
+
+    name = BACKEND_IVFPQ
+    approximate_distances = True
+
+    def __init__(self, nprobe=32, refine_factor=2, max_lists=65536, seed=0):
+        self.nprobe = nprobe
+        self.refine_factor = refine_factor
+        self.max_lists = max_lists
+        self.seed = seed
+
+    def _lists(self, n):
+        return int(min(self.max_lists, max(1, 4 * np.sqrt(n))))
+
+    @staticmethod
+    def _subquantizers(dimension):
+        # the most sub-quantizers (up to 64) of at least 4 dimensions each
+        for m in range(min(64, dimension // 4), 0, -1):
+            if dimension % m == 0:
+                return m
+        return 1
+
+    def params(self, n, dimension):
+        return {
+            'index': 'IVFPQ',
+            'nlist': self._lists(n),
+            'm': self._subquantizers(dimension),
+            'nbits': 8,
+            'nprobe': self.nprobe,
+            'refine': self.refine_factor,
+        }
+
+    def build(self, vectors, quantizer=None):
+        # the product quantizer compresses the vectors further, the scalar quantizer is not used
+        n, dimension = vectors.shape
+        params = self.params(n, dimension)
+        index = faiss.index_factory(
+            dimension, f"IVF{params['nlist']},PQ{params['m']}x{params['nbits']}"
+        )
+        # the fewest points faiss accepts for the coarse centroids and the sub-quantizer centroids
+        n_train = min(n, max(39 * params['nlist'], 39 * 256))
+        sample = np.sort(
+            np.random.RandomState(self.seed).choice(n, n_train, replace=False)
+        )
+        index.train(np.ascontiguousarray(vectors[sample]))
+        index.nprobe = self.nprobe
+        return index
+
+    def search(self, index, queries, k, vectors):
+        n_candidates = min(index.ntotal, k * self.refine_factor)
+        _, candidates = index.search(queries, n_candidates)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), RERANK_CHUNK_ROWS):
+            rows = slice(start, start + RERANK_CHUNK_ROWS)
+            chunk = candidates[rows]
+            found = chunk >= 0
+            differences = vectors[np.maximum(chunk, 0)] - queries[rows, None, :]
+            exact = np.einsum('ijk,ijk->ij', differences, differences)
+            exact[~found] = np.finfo(np.float32).max
+            order = np.argsort(exact, axis=1, kind='stable')[:, :k]
+            distances[rows] = np.take_along_axis(exact, order, axis=1)
+            indices[rows] = np.where(
+                np.take_along_axis(found, order, axis=1),
+                np.take_along_axis(chunk, order, axis=1),
+                -1,
+            )
+        return distances, indices
+
+    def set_search_depth(self, index, depth=None):
+        faiss.extract_index_ivf(index).nprobe = max(depth or 0, self.nprobe)
+
+
+def _set_quantizer(index, quantizer):
+    """
+    Gives a scalar quantizer index the trained quantizer of the stored codes, so it encodes the
+    vectors into the same codes.
+    """
+    index.sq = quantizer
+    index.is_trained = True
+
+
+BACKENDS = {
+    BACKEND_FLAT: FlatBackend(),
+    BACKEND_HNSW: HNSWBackend(),
+    BACKEND_IVFPQ: IVFPQBackend(),
+}
+
+
+def select_backend(n, name=BACKEND_AUTO, flat_max_items=20000, ivfpq_min_items=2000000):
+    """
+    Chooses the index backend of a feature set.
+
+    Args:
+        n (int): The number of vectors of the feature set.
+        name (str): A backend name to force it, or `auto` to choose by size.
+        flat_max_items (int): Feature sets up to this size are searched exactly.
+        ivfpq_min_items (int): Feature sets from this size are product quantized.
+
+    Returns:
+        IndexBackend: The backend.
+
+    Raises:
+        ValueError: If the backend name is not supported.
+    """
+    if name and name != BACKEND_AUTO:
+        if name not in BACKENDS:
+            raise ValueError(f"Index backend {name} not supported")
+        return BACKENDS[name]
+    if n <= flat_max_items:
+        return BACKENDS[BACKEND_FLAT]
+    if n >= ivfpq_min_items:
+        return BACKENDS[BACKEND_IVFPQ]
+    return BACKENDS[BACKEND_HNSW]
@@ -0,0 +1,104 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('[ANOMALY]')
+logging.basicConfig(level='INFO')
+
+# distance to the nearest neighbour that is not the item itself
+SCORE_NEAREST = 'nearest'
+# mean distance to the k nearest neighbours that are not the item itself
+SCORE_KNN_MEAN = 'knn_mean'
+
+
+def anomaly_scores(distance, method=SCORE_NEAREST, k=5):
+    """
+    Computes a per item anomaly score from the kNN search of the items against themselves.
+
+    The first column of the search is the item itself, so it is not used. Higher scores are
+    more anomalous.
+
+    Args:
+        distance (np.ndarray): An (N, k) matrix of neighbour distances sorted per row.
+        method (str): The score to compute, `SCORE_NEAREST` or `SCORE_KNN_MEAN`.
+        k (int): The number of neighbours averaged by `SCORE_KNN_MEAN`.
+
+    Returns:
+        np.ndarray: An (N,) float32 array of scores, items without neighbours get an infinite score.
+
+    Raises:
+        ValueError: If the method is not supported.
+    """
+    if distance.shape[1] < 2:
+        return np.full(len(distance), np.inf, dtype=np.float32)
+    if method == SCORE_NEAREST:
+        return np.ascontiguousarray(distance[:, 1], dtype=np.float32)
+    elif method == SCORE_KNN_MEAN:
+        neighbours = distance[:, 1 : k + 1].astype(np.float32)
+        # missing results are returned with a huge distance by the index
+        found = neighbours < np.finfo(np.float32).max / 2
+        counts = np.count_nonzero(found, axis=1)
+        sums = np.where(found, neighbours, 0).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, sums / counts, np.inf).astype(np.float32)
+    else:
+        raise ValueError(f"Anomaly score {method} not supported")
+
+
+class AnomalyScores:
+    """
+    The anomaly scores of a feature set, sorted from the most to the least anomalous item.
+
+    Attributes
+    ----------
+    order : np.ndarray
+        The item indices sorted by descending score, ties in item order.
+    sorted_scores : np.ndarray
+        The scores of the items in `order`.
+
+    Methods
+    -------
+    above(threshold, offset=0, limit=0)
+        Returns the number of items scored above the threshold and a page of them.
+    """
+
+    def __init__(self, scores):
+        self.order = np.argsort(-scores, kind='stable')
+        self.sorted_scores = scores[self.order]
+        # ascending keys for the binary search, in float64 to compare exactly with the threshold
+        self._keys = -self.sorted_scores.astype(np.float64)
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.sorted_scores.nbytes + self._keys.nbytes
+
+    def count_above(self, threshold):
+        """
+        Counts the items with a score strictly greater than the threshold.
+
+        Args:
+            threshold (float): The score threshold.
+
+        Returns:
+            int: The number of items above the threshold.
+        """
+        return int(np.searchsorted(self._keys, -np.float64(threshold), side='left'))
+
+    def above(self, threshold, offset=0, limit=0):
+        """
+        Retrieves the items with a score strictly greater than the threshold, most anomalous first.
+
+        Args:
+            threshold (float): The score threshold.
+            offset (int): The number of items to skip.
+            limit (int): The maximum number of items to return, 0 for no limit.
+
+        Returns:
+            tuple: The total number of items above the threshold and the indices of the requested items.
+        """
+        total = self.count_above(threshold)
+        stop = total if limit <= 0 else min(total, offset + limit)
+        return total, self.order[min(offset, stop) : stop]
@@ -0,0 +1,181 @@
+import os
+import logging
+import threading
+
+import faiss
+import numpy as np
+
+from modules.graph import NeighbourGraph
+
+logger = logging.getLogger('[BUILD]')
+logging.basicConfig(level='INFO')
+
+# rows added to an index or searched at once, each chunk reports its progress
+CHUNK_ROWS = 16384
+
+
+def thread_budget(total_threads, n_tasks, max_workers=0):
+    """
+    Splits a thread budget between parallel tasks and the faiss (OpenMP) threads of each task.
+
+    Args:
+        total_threads (int): The number of threads to use, 0 for the number of CPUs.
+        n_tasks (int): The number of tasks to run.
+        max_workers (int): The maximum number of tasks running at once, 0 for no maximum.
+
+    Returns:
+        tuple: The number of parallel workers and the number of faiss threads of each worker.
+    """
+    total_threads = total_threads if total_threads > 0 else os.cpu_count() or 1
+    workers = max(1, min(n_tasks, total_threads))
+    if max_workers > 0:
+        workers = min(workers, max_workers)
+    return workers, max(1, total_threads // workers)
+
+
+class BuildProgress:
+    """
+    A thread safe counter of the rows processed by parallel index builds.
+
+    Attributes
+    ----------
+    total : int
+        The number of rows to process.
+    done : int
+        The number of rows processed so far.
+
+    Methods
+    -------
+    advance(rows)
+        Counts processed rows and reports the completed fraction.
+    """
+
+    def __init__(self, total, callback=None):
+        self.total = max(int(total), 1)
+        self.done = 0
+        self._callback = callback
+        self._lock = threading.Lock()
+
+    def advance(self, rows):
+        """
+        Counts processed rows and reports the completed fraction to the callback.
+
+        Args:
+            rows (int): The number of rows just processed.
+        """
+        with self._lock:
+            self.done += int(rows)
+            fraction = min(self.done / self.total, 1.0)
+        if self._callback is not None:
+            self._callback(fraction)
+
+
+def add_chunked(index, vectors, progress=None):
+    """
+    Adds vectors to an index chunk by chunk.
+
+    Args:
+        index (faiss.Index): The index.
+        vectors (np.ndarray): A float32 (N, dimension) matrix.
+        progress (BuildProgress, optional): Advanced by every added chunk.
+    """
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = vectors[start : start + CHUNK_ROWS]
+        index.add(chunk)
+        if progress is not None:
+            progress.advance(len(chunk))
+
+
+def search_chunked(index, vectors, k, progress=None, backend=None):
+    """
+    Searches the indexed vectors against their index chunk by chunk, into preallocated result matrices.
+
+    Args:
+        index (faiss.Index): The index.
+        vectors (np.ndarray): The float32 (N, dimension) matrix of the indexed vectors.
+        k (int): The number of neighbours to retrieve.
+        progress (BuildProgress, optional): Advanced by every searched chunk.
+        backend (IndexBackend, optional): The backend of the index, to re-rank approximate distances.
+
+    Returns:
+        tuple: The (N, k) float32 distances and int64 indices.
+    """
+    distances = np.empty((len(vectors), k), dtype=np.float32)
+    indices = np.empty((len(vectors), k), dtype=np.int64)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = vectors[start : start + CHUNK_ROWS]
+        stop = start + len(chunk)
+        if backend is not None and backend.approximate_distances:
+            distances[start:stop], indices[start:stop] = backend.search(
+                index, chunk, k, vectors
+            )
+        else:
+            index.search(chunk, k, D=distances[start:stop], I=indices[start:stop])
+        if progress is not None:
+            progress.advance(len(chunk))
+    return distances, indices
+
+
+def range_search_chunked(
+    index, vectors, radius, fallback_k, progress=None, backend=None
+):
+    """
+    Finds every neighbour within a radius of the indexed vectors, chunk by chunk.
+
+    Index types without range search, or with approximate distances, are searched for
+    `fallback_k` neighbours instead, the ones farther than the radius being dropped.
+
+    Args:
+        index (faiss.Index): The index.
+        vectors (np.ndarray): The float32 (N, dimension) matrix of the indexed vectors.
+        radius (float): The maximum distance of a neighbour, exclusive.
+        fallback_k (int): The number of neighbours searched when range search is not supported.
+        progress (BuildProgress, optional): Advanced by every searched chunk.
+        backend (IndexBackend, optional): The backend of the index, to re-rank approximate distances.
+
+    Returns:
+        NeighbourGraph: The neighbours of every vector, sorted by ascending distance.
+    """
+    graphs = []
+    supported = backend is None or not backend.approximate_distances
+    search = backend.search if backend is not None else None
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = vectors[start : start + CHUNK_ROWS]
+        if supported:
+            try:
+                limits, distances, indices = index.range_search(chunk, radius)
+                graphs.append(
+                    NeighbourGraph.from_rows(
+                        np.diff(limits), indices, distances, first_row=start
+                    )
+                )
+            except RuntimeError as e:
+                logger.warning(
+                    "Range search not supported, keeping %d neighbours: %s", fallback_k, e
+                )
+                supported = False
+        if not supported:
+            k = min(fallback_k, index.ntotal)
+            if search is not None:
+                distances, indices = search(index, chunk, k, vectors)
+            else:
+                distances, indices = index.search(chunk, k)
+            within = (distances < radius) & (indices >= 0)
+            graphs.append(
+                NeighbourGraph.from_rows(
+                    np.count_nonzero(within, axis=1),
+                    indices[within],
+                    distances[within],
+                    first_row=start,
+                )
+            )
+        if progress is not None:
+            progress.advance(len(chunk))
+    return NeighbourGraph.concatenate(graphs)
+
+
+def set_worker_threads(threads):
+    """
+    Sets the number of OpenMP threads faiss uses from the calling thread.
+    """
+    faiss.omp_set_num_threads(int(threads))
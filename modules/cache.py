@@ -0,0 +1,231 @@
+import sys
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('[CACHE]')
+logging.basicConfig(level='INFO')
+
+
+class ResultCache:
+    """
+    A thread safe LRU cache bounded by the total size in bytes of the stored values.
+
+    The entries can be put in namespaces, one per dataset, sharing the bound: the least
+    recently used entries are evicted whatever their namespace, and the counters are kept
+    per namespace as well.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The maximum number of bytes the cache may hold. Zero disables the cache.
+    hits : int
+        The number of lookups that found a value.
+    misses : int
+        The number of lookups that did not find a value.
+    evictions : int
+        The number of entries dropped to stay under `max_bytes`.
+    current_bytes : int
+        The number of bytes held.
+
+    Methods
+    -------
+    get(key, default=None, namespace=None)
+        Returns the cached value for key and marks it as most recently used.
+    put(key, value, nbytes=None, namespace=None)
+        Stores a value, evicting the least recently used entries if needed.
+    clear(namespace=None)
+        Drops the entries of a namespace or all of them, keeping the hit/miss counters.
+    namespace_bytes(namespace)
+        Returns the number of bytes held by the entries of a namespace.
+    stats(namespace=None)
+        Returns a dictionary with the cache counters and sizes.
+    scope(namespace)
+        Returns a view of the cache restricted to a namespace.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max(int(max_bytes), 0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def _counters(self, namespace):
+        counters = self._namespaces.get(namespace)
+        if counters is None:
+            counters = self._namespaces[namespace] = {
+                'hits': 0,
+                'misses': 0,
+                'evictions': 0,
+                'entries': 0,
+                'bytes': 0,
+            }
+        return counters
+
+    def _drop(self, entry_key, nbytes):
+        counters = self._counters(entry_key[0])
+        counters['entries'] -= 1
+        counters['bytes'] -= nbytes
+        self.current_bytes -= nbytes
+
+    def get(self, key, default=None, namespace=None):
+        """
+        Retrieves a value from the cache.
+
+        Args:
+            key (hashable): The cache key.
+            default: The value to return when the key is not cached.
+            namespace (hashable, optional): The namespace of the key.
+
+        Returns:
+            The cached value, or `default` if the key is not cached.
+        """
+        entry_key = (namespace, key)
+        with self._lock:
+            counters = self._counters(namespace)
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                self.misses += 1
+                counters['misses'] += 1
+                return default
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes=None, namespace=None):
+        """
+        Stores a value in the cache.
+
+        Values bigger than `max_bytes` are not stored.
+
+        Args:
+            key (hashable): The cache key.
+            value: The value to store.
+            nbytes (int, optional): The size of the value in bytes. Defaults to `sys.getsizeof(value)`.
+            namespace (hashable, optional): The namespace of the key.
+        """
+        if nbytes is None:
+            nbytes = sys.getsizeof(value)
+        if nbytes > self.max_bytes:
+            logger.debug("Value of %s bytes is bigger than the cache, not caching", nbytes)
+            return
+        entry_key = (namespace, key)
+        with self._lock:
+            old = self._entries.pop(entry_key, None)
+            if old is not None:
+                self._drop(entry_key, old[1])
+            self._entries[entry_key] = (value, nbytes)
+            counters = self._counters(namespace)
+            counters['entries'] += 1
+            counters['bytes'] += nbytes
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                evicted_key, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._drop(evicted_key, evicted_bytes)
+                self.evictions += 1
+                self._counters(evicted_key[0])['evictions'] += 1
+
+    def clear(self, namespace=None):
+        """
+        Drops entries from the cache.
+
+        Args:
+            namespace (hashable, optional): The namespace to drop the entries of, None for all the entries.
+        """
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                self.current_bytes = 0
+                for counters in self._namespaces.values():
+                    counters['entries'] = counters['bytes'] = 0
+                return
+            for entry_key in [key for key in self._entries if key[0] == namespace]:
+                self._drop(entry_key, self._entries.pop(entry_key)[1])
+
+    def namespace_bytes(self, namespace):
+        """
+        Returns the number of bytes held by the entries of a namespace.
+        """
+        with self._lock:
+            counters = self._namespaces.get(namespace)
+            return 0 if counters is None else counters['bytes']
+
+    def stats(self, namespace=None):
+        """
+        Returns the cache counters.
+
+        Args:
+            namespace (hashable, optional): The namespace to return the counters of, None for the whole cache.
+
+        Returns:
+            dict: The hits, misses, evictions, number of entries and bytes used. The counters of a
+                  namespace also have the bytes used by the whole cache, as `total_bytes`.
+        """
+        with self._lock:
+            if namespace is None:
+                return {
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.current_bytes,
+                    'max_bytes': self.max_bytes,
+                }
+            return {
+                **self._counters(namespace),
+                'total_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def scope(self, namespace):
+        """
+        Returns a view of the cache restricted to a namespace.
+
+        Args:
+            namespace (hashable): The namespace, the dataset ID.
+
+        Returns:
+            CacheScope: The view, with the `get`, `put`, `clear` and `stats` of the namespace.
+        """
+        return CacheScope(self, namespace)
+
+
+class CacheScope:
+    """
+    The entries of one namespace of a shared ResultCache.
+
+    Attributes
+    ----------
+    cache : ResultCache
+        The shared cache.
+    namespace : hashable
+        The namespace of the entries.
+    """
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    @property
+    def current_bytes(self):
+        """
+        The number of bytes held by the entries of the namespace.
+        """
+        return self.cache.namespace_bytes(self.namespace)
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default, namespace=self.namespace)
+
+    def put(self, key, value, nbytes=None):
+        self.cache.put(key, value, nbytes, namespace=self.namespace)
+
+    def clear(self):
+        self.cache.clear(namespace=self.namespace)
+
+    def stats(self):
+        return self.cache.stats(namespace=self.namespace)
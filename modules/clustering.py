@@ -0,0 +1,268 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('[CLUSTERING]')
+logging.basicConfig(level='INFO')
+
+# the similarity clusters: `greedy` proposals around every item, or `linkage` connected groups from the precomputed hierarchy
+CLUSTERING_GREEDY = 'greedy'
+CLUSTERING_LINKAGE = 'linkage'
+# rows are compared against the threshold in chunks to bound the temporary boolean matrix
+CUTOFF_CHUNK_ROWS = 65536
+# minimum number of proposals resolved one by one when a round resolves too few of them
+SEQUENTIAL_MIN_PROPOSALS = 1024
+
+
+def cutoff_lengths(distance, threshold):
+    """
+    Counts, for every row of a kNN distance matrix, the neighbours within the threshold.
+
+    The rows returned by the index are sorted by ascending distance, so the count is the
+    length of the row prefix that is within the threshold (same as `np.searchsorted(row, threshold, side='right')`).
+
+    Args:
+        distance (np.ndarray): An (N, k) matrix of neighbour distances sorted per row.
+        threshold (float): The maximum distance of a neighbour to be counted.
+
+    Returns:
+        np.ndarray: An (N,) int64 array with the number of neighbours within the threshold.
+    """
+    lengths = np.empty(len(distance), dtype=np.int64)
+    for start in range(0, len(distance), CUTOFF_CHUNK_ROWS):
+        chunk = distance[start : start + CUTOFF_CHUNK_ROWS]
+        lengths[start : start + len(chunk)] = np.count_nonzero(
+            chunk <= threshold, axis=1
+        )
+    return lengths
+
+
+def _runs(positions):
+    """
+    Splits a sorted array of proposal positions into runs of equal values.
+
+    Returns:
+        tuple: The start offset and the length of every run.
+    """
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    is_start = np.empty(len(positions), dtype=bool)
+    is_start[0] = True
+    np.not_equal(positions[1:], positions[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    return starts, np.diff(np.append(starts, len(positions)))
+
+
+def run_ranks(sizes):
+    """
+    Returns the position of every entry within its run, for runs laid out one after the other.
+
+    Args:
+        sizes (np.ndarray): The length of every run.
+
+    Returns:
+        np.ndarray: The sum(sizes) ranks, 0 to size - 1 for every run.
+    """
+    offsets = np.cumsum(sizes) - sizes
+    return np.arange(int(np.sum(sizes))) - np.repeat(offsets, sizes)
+
+
+class ClusterList:
+    """
+    A list of clusters stored as one flat array of members and the offsets of every cluster.
+
+    Attributes
+    ----------
+    members : np.ndarray
+        The item indices of all the clusters, one cluster after the other.
+    offsets : np.ndarray
+        An array of len(clusters) + 1 offsets into `members`, cluster i is members[offsets[i]:offsets[i + 1]].
+    ids : np.ndarray
+        A stable id for every cluster, kept when clusters are reordered.
+    """
+
+    def __init__(self, members, offsets, ids=None):
+        self.members = members
+        self.offsets = offsets
+        if ids is None:
+            ids = np.arange(len(offsets) - 1)
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.members[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.members.nbytes + self.offsets.nbytes + self.ids.nbytes
+
+    def take(self, selection):
+        """
+        Builds a new cluster list from a selection of clusters.
+
+        Args:
+            selection (np.ndarray): The indices of the clusters to keep, in their new order.
+
+        Returns:
+            ClusterList: The selected clusters.
+        """
+        sizes = self.sizes[selection]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        sources = np.repeat(self.offsets[selection] - offsets[:-1], sizes)
+        return ClusterList(
+            self.members[sources + np.arange(offsets[-1])],
+            offsets,
+            self.ids[selection],
+        )
+
+
+def greedy_clusters(distance, indices, threshold, min_size):
+    """
+    Greedily assigns items to clusters of near duplicates from their kNN search.
+
+    Every item proposes a cluster made of its neighbours within the threshold. The proposals
+    are visited from the biggest to the smallest (ties in item order), each one dropping the
+    items already used by a previous cluster, and kept if at least `min_size` items remain.
+
+    The proposals are resolved in vectorized rounds instead of one by one: a proposal that
+    shares no item with any earlier undecided proposal gets the same outcome it would get in
+    the sequential walk, so all of them are accepted at once. When a round resolves only a
+    few proposals, the leading ones are walked sequentially to guarantee progress.
+
+    Args:
+        distance (np.ndarray): An (N, k) matrix of neighbour distances sorted per row.
+        indices (np.ndarray): An (N, k) matrix of the neighbour item indices.
+        threshold (float): The maximum distance between an item and its neighbours in a cluster.
+        min_size (int): The minimum number of items in a cluster.
+
+    Returns:
+        ClusterList: The clusters of item indices, the first member being the cluster main item,
+                     sorted by descending size (ties in creation order) and with their creation order as ids.
+    """
+    return _assign_clusters(
+        cutoff_lengths(distance, threshold),
+        lambda rows, columns: indices[rows, columns],
+        min_size,
+        indices.dtype,
+    )
+
+
+def greedy_graph_clusters(graph, threshold, min_size):
+    """
+    Greedily assigns items to clusters of near duplicates from a sparse neighbour graph.
+
+    Same assignment as `greedy_clusters`, the proposals being the graph rows within the threshold.
+
+    Args:
+        graph (NeighbourGraph): The neighbour graph, rows sorted by ascending distance.
+        threshold (float): The maximum distance between an item and its neighbours in a cluster.
+        min_size (int): The minimum number of items in a cluster.
+
+    Returns:
+        ClusterList: The clusters of item indices, as returned by `greedy_clusters`.
+    """
+    return _assign_clusters(
+        graph.cutoff_lengths(threshold), graph.gather, min_size, graph.indices.dtype
+    )
+
+
+def _assign_clusters(lengths, gather, min_size, dtype):
+    """
+    Resolves the cluster proposals of every item, see `greedy_clusters`.
+
+    Args:
+        lengths (np.ndarray): The number of neighbours within the threshold of every item.
+        gather (callable): Returns the neighbours at (rows, columns) positions of the proposals.
+        min_size (int): The minimum number of items in a cluster.
+        dtype (np.dtype): The dtype of the item indices.
+
+    Returns:
+        ClusterList: The clusters of item indices.
+    """
+    min_size = max(int(min_size), 1)
+    # proposals smaller than min_size can never make a cluster, and they are last in size order
+    order = np.argsort(-lengths, kind='stable')
+    order = order[: np.count_nonzero(lengths >= min_size)]
+
+    # flatten the proposals: one (position in visiting order, member) pair per entry
+    proposal_lengths = lengths[order]
+    positions = np.repeat(np.arange(len(order)), proposal_lengths)
+    columns = run_ranks(proposal_lengths)
+    members = gather(np.repeat(order, proposal_lengths), columns)
+
+    used = np.zeros(len(lengths), dtype=bool)
+    accepted_positions = []
+    accepted_members = []
+    accepted_sizes = []
+    while len(positions) > 0:
+        # drop used members, then the proposals left with too few members
+        unused = ~used[members]
+        positions, members = positions[unused], members[unused]
+        starts, counts = _runs(positions)
+        large_enough = np.repeat(counts >= min_size, counts)
+        positions, members = positions[large_enough], members[large_enough]
+        if len(positions) == 0:
+            break
+        starts, counts = _runs(positions)
+
+        # a proposal is safe when none of its members appears in an earlier proposal,
+        # only the members shared by several proposals need to be sorted to check it
+        conflict = np.zeros(len(members), dtype=bool)
+        shared = np.flatnonzero(np.bincount(members)[members] > 1)
+        if len(shared) > 0:
+            _, first_entry, inverse = np.unique(
+                members[shared], return_index=True, return_inverse=True
+            )
+            shared_positions = positions[shared]
+            conflict[shared] = (
+                shared_positions > shared_positions[first_entry][inverse.reshape(-1)]
+            )
+        safe = ~np.logical_or.reduceat(conflict, starts)
+        safe_entries = np.repeat(safe, counts)
+        used[members[safe_entries]] = True
+        accepted_positions.append(positions[starts[safe]])
+        accepted_members.append(members[safe_entries])
+        accepted_sizes.append(counts[safe])
+        positions, members = positions[~safe_entries], members[~safe_entries]
+        counts = counts[~safe]
+
+        # walk the leading undecided proposals one by one if the round was not productive
+        if np.count_nonzero(safe) * 10 < len(safe) and len(counts) > 0:
+            n_sequential = max(SEQUENTIAL_MIN_PROPOSALS, len(counts) // 10)
+            n_entries = int(counts[:n_sequential].sum())
+            offset = 0
+            for count in counts[:n_sequential].tolist():
+                proposal = members[offset : offset + count]
+                remaining = proposal[~used[proposal]]
+                if len(remaining) >= min_size:
+                    used[remaining] = True
+                    accepted_positions.append(positions[offset : offset + 1])
+                    accepted_members.append(remaining)
+                    accepted_sizes.append(np.array([len(remaining)]))
+                offset += count
+            positions, members = positions[n_entries:], members[n_entries:]
+
+    if not accepted_sizes:
+        return ClusterList(np.empty(0, dtype=dtype), np.zeros(1, dtype=np.int64))
+    sizes = np.concatenate(accepted_sizes).astype(np.int64)
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    # the cluster ids are the order in which the sequential walk would create them
+    positions = np.concatenate(accepted_positions)
+    clusters = ClusterList(
+        np.concatenate(accepted_members),
+        offsets,
+        np.searchsorted(np.sort(positions), positions),
+    )
+    return clusters.take(np.lexsort((positions, -sizes)))
@@ -0,0 +1,389 @@
+import sys
+import logging
+
+import numpy as np
+
+from modules.storage import FLOAT32_STORAGE, STORAGE_FLOAT32, DecodedVectors
+
+logger = logging.getLogger('[COLUMNS]')
+logging.basicConfig(level='INFO')
+
+
+class StringColumn:
+    """
+    An immutable column of strings stored as one UTF-8 buffer and the offsets of every string.
+
+    Attributes
+    ----------
+    data : bytes or np.ndarray
+        The concatenated UTF-8 encoded strings, as bytes or a uint8 (possibly memory-mapped) array.
+    offsets : np.ndarray
+        An array of len(column) + 1 offsets, string i is data[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, values):
+        encoded = [value.encode() for value in values]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.offsets[1:])
+        self.data = b''.join(encoded)
+
+    @classmethod
+    def from_buffers(cls, data, offsets):
+        """
+        Builds a column from already packed buffers.
+
+        Args:
+            data (bytes or np.ndarray): The concatenated UTF-8 encoded strings.
+            offsets (np.ndarray): The offsets of the strings in data.
+
+        Returns:
+            StringColumn: The column.
+        """
+        column = cls([])
+        column.data = data
+        column.offsets = offsets
+        return column
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self):
+        if isinstance(self.data, np.ndarray):
+            return self.data.nbytes + self.offsets.nbytes
+        return sys.getsizeof(self.data) + self.offsets.nbytes
+
+
+class ItemTable:
+    """
+    The metadata of the exported items of a dataset, stored once and shared by all its feature sets.
+
+    Items are appended while the export is parsed, then `freeze` packs them into compact columns.
+
+    Attributes
+    ----------
+    ids : StringColumn
+        The item ids.
+    names : StringColumn
+        The item names.
+    thumbnails : StringColumn
+        The item thumbnail urls.
+    annotated : np.ndarray
+        A boolean array, whether each item is annotated.
+    quality_scores : dict
+        The score name to float64 array of the item quality scores, NaN for the items without the score.
+
+    Methods
+    -------
+    add(item_id, name, thumbnail, annotated, quality_scores=None)
+        Appends an item if it is not in the table yet and returns its row.
+    freeze()
+        Packs the appended items into columns.
+    record(row)
+        Returns the item dictionary sent to the panel.
+    row_of(item_id)
+        Returns the row of an item id.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._pending = []
+        self.ids = StringColumn([])
+        self.names = StringColumn([])
+        self.thumbnails = StringColumn([])
+        self.annotated = np.zeros(0, dtype=bool)
+        self.quality_scores = {}
+
+    @classmethod
+    def from_columns(cls, ids, names, thumbnails, annotated, quality_scores=None):
+        """
+        Builds a table from already packed columns.
+
+        Args:
+            ids (StringColumn): The item ids.
+            names (StringColumn): The item names.
+            thumbnails (StringColumn): The item thumbnail urls.
+            annotated (np.ndarray): Whether each item is annotated.
+            quality_scores (dict, optional): The score name to per item scores mapping.
+
+        Returns:
+            ItemTable: The table.
+        """
+        items = cls()
+        items.ids = ids
+        items.names = names
+        items.thumbnails = thumbnails
+        items.annotated = annotated
+        items.quality_scores = dict(quality_scores or {})
+        items._rows = None
+        return items
+
+    def __len__(self):
+        return len(self.ids) + len(self._pending)
+
+    @property
+    def nbytes(self):
+        return (
+            self.ids.nbytes
+            + self.names.nbytes
+            + self.thumbnails.nbytes
+            + self.annotated.nbytes
+            + sum(scores.nbytes for scores in self.quality_scores.values())
+        )
+
+    def add(self, item_id, name, thumbnail, annotated, quality_scores=None):
+        """
+        Appends an item to the table, unless an item with the same id was already added.
+
+        Args:
+            item_id (str): The item id.
+            name (str): The item name.
+            thumbnail (str): The item thumbnail url.
+            annotated (bool): Whether the item is annotated.
+            quality_scores (dict, optional): The score name to value mapping of the item.
+
+        Returns:
+            int: The row of the item.
+        """
+        rows = self._row_index()
+        row = rows.get(item_id)
+        if row is None:
+            row = len(self)
+            rows[item_id] = row
+            self._pending.append(
+                (item_id, name or '', thumbnail or '', bool(annotated), quality_scores)
+            )
+        return row
+
+    def freeze(self):
+        """
+        Packs the appended items into the columns.
+        """
+        if not self._pending:
+            return
+        ids, names, thumbnails, annotated, quality_scores = zip(*self._pending)
+        n_packed = len(self.ids)
+        score_names = set(self.quality_scores)
+        for scores in quality_scores:
+            score_names.update(scores or ())
+        self.quality_scores = {
+            score: np.concatenate(
+                [
+                    self.quality_scores.get(score, np.full(n_packed, np.nan)),
+                    np.array(
+                        [(scores or {}).get(score, np.nan) for scores in quality_scores],
+                        dtype=np.float64,
+                    ),
+                ]
+            )
+            for score in sorted(score_names)
+        }
+        self.ids = StringColumn(list(self.ids) + list(ids))
+        self.names = StringColumn(list(self.names) + list(names))
+        self.thumbnails = StringColumn(list(self.thumbnails) + list(thumbnails))
+        self.annotated = np.concatenate(
+            [self.annotated, np.array(annotated, dtype=bool)]
+        )
+        self._pending = []
+        # the id lookup is rebuilt from the packed ids when it is needed again
+        self._rows = None
+
+    def _row_index(self):
+        if self._rows is None:
+            self._rows = {item_id: row for row, item_id in enumerate(self.ids)}
+        return self._rows
+
+    def row_of(self, item_id):
+        """
+        Looks up the row of an item.
+
+        Args:
+            item_id (str): The item id.
+
+        Returns:
+            int: The row of the item, or None if it is not in the table.
+        """
+        return self._row_index().get(item_id)
+
+    def record(self, row):
+        """
+        Builds the item dictionary returned to the panel.
+
+        Args:
+            row (int): The row of the item.
+
+        Returns:
+            dict: The item id, thumbnail, name and annotated flag.
+        """
+        return {
+            'itemId': self.ids[row],
+            'thumbnail': self.thumbnails[row],
+            'name': self.names[row],
+            'annotated': bool(self.annotated[row]),
+        }
+
+
+class FeatureSetColumns:
+    """
+    The exported vectors of a feature set, one row per item that has a vector in it.
+
+    Attributes
+    ----------
+    items : ItemTable
+        The item metadata of the dataset.
+    rows : np.ndarray
+        An int32 array with the ItemTable row of every vector.
+    vectors : np.ndarray
+        A contiguous (N, code size) matrix of the L2 normalized vectors encoded by `storage`,
+        the float32 vectors themselves unless they are compressed.
+    feature_set_id : str
+        The id of the feature set on the platform.
+    storage : VectorStorage
+        The encoding of the vectors.
+    decoded : np.ndarray or DecodedVectors
+        The float32 (N, dimension) vectors, decoded slice by slice when they are compressed.
+
+    Methods
+    -------
+    record(i)
+        Returns the item dictionary of the i-th vector.
+    """
+
+    def __init__(self, items, rows, vectors, feature_set_id=None, storage=None):
+        self.items = items
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.storage = storage or FLOAT32_STORAGE
+        if self.storage.name == STORAGE_FLOAT32:
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        else:
+            self.vectors = np.ascontiguousarray(vectors)
+        self.feature_set_id = feature_set_id
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.vectors.nbytes
+
+    @property
+    def decoded(self):
+        if self.storage.name == STORAGE_FLOAT32:
+            return self.vectors
+        return DecodedVectors(self.vectors, self.storage)
+
+    def record(self, i):
+        """
+        Builds the item dictionary returned to the panel for a vector of the feature set.
+
+        Args:
+            i (int): The index of the vector.
+
+        Returns:
+            dict: The item id, thumbnail, name and annotated flag.
+        """
+        return self.items.record(self.rows[i])
+
+
+def normalize_rows(vectors):
+    """
+    L2 normalizes the rows of a float32 matrix in place, zero rows are left unchanged.
+
+    Args:
+        vectors (np.ndarray): A float32 (N, dimension) matrix.
+
+    Returns:
+        np.ndarray: The same matrix.
+    """
+    norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors, dtype=np.float64))
+    norms[norms == 0] = 1
+    np.divide(vectors, norms[:, None], out=vectors, casting='unsafe')
+    return vectors
+
+
+class FeatureSetBuffer:
+    """
+    A growable buffer the vectors of a feature set are streamed into while the export is parsed.
+
+    The vectors are written straight into a float32 matrix whose capacity doubles when full,
+    instead of being collected as lists of Python floats.
+
+    Attributes
+    ----------
+    rows : np.ndarray
+        The int32 ItemTable row of every appended vector, up to the capacity.
+    vectors : np.ndarray
+        The float32 (capacity, dimension) matrix of the appended vectors, allocated on the first append.
+
+    Methods
+    -------
+    append(row, value)
+        Appends the vector of an item.
+    finish(items, feature_set_id=None)
+        Trims the buffer, normalizes the vectors in place and returns the FeatureSetColumns.
+    """
+
+    def __init__(self, capacity=1024):
+        self._size = 0
+        self.rows = np.empty(max(int(capacity), 1), dtype=np.int32)
+        self.vectors = None
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        # resize in place, the old buffer is not kept alongside the new one
+        self.rows.resize(capacity, refcheck=False)
+        self.vectors.resize((capacity, self.vectors.shape[1]), refcheck=False)
+
+    def append(self, row, value):
+        """
+        Appends the vector of an item.
+
+        Args:
+            row (int): The ItemTable row of the item.
+            value (list): The vector values.
+
+        Raises:
+            ValueError: If the vector does not have the dimension of the previous ones.
+        """
+        if self.vectors is None:
+            self.vectors = np.empty((len(self.rows), len(value)), dtype=np.float32)
+        elif self._size == len(self.rows):
+            self._grow(2 * len(self.rows))
+        self.rows[self._size] = row
+        self.vectors[self._size] = value
+        self._size += 1
+
+    def finish(self, items, feature_set_id=None):
+        """
+        Trims the buffer to its content and L2 normalizes the vectors in place.
+
+        The buffer must not be used afterwards, its arrays are handed to the feature set.
+
+        Args:
+            items (ItemTable): The item table the rows point to.
+            feature_set_id (str): The id of the feature set on the platform.
+
+        Returns:
+            FeatureSetColumns: The feature set.
+        """
+        if self.vectors is None:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+        else:
+            self._grow(self._size)
+        feature_set = FeatureSetColumns(
+            items,
+            self.rows,
+            normalize_rows(self.vectors),
+            feature_set_id=feature_set_id,
+        )
+        self.rows = self.vectors = None
+        return feature_set
@@ -0,0 +1,188 @@
+import logging
+
+import numpy as np
+
+from modules.clustering import run_ranks
+from modules.incremental import MISSING_DISTANCE, MISSING_INDEX
+
+logger = logging.getLogger('[DUPLICATES]')
+logging.basicConfig(level='INFO')
+
+# rows quantized, hashed or expanded at once, to bound the temporary matrices
+CHUNK_ROWS = 8192
+# the odd multipliers of the vector hash, fixed so the groups do not depend on the process
+_HASH_MULTIPLIERS = np.random.default_rng(0x5EED).integers(
+    1, 2**63, size=4096, dtype=np.uint64
+) | np.uint64(1)
+
+
+class DuplicateGroups:
+    """
+    The groups of items whose normalized vectors quantize to the same vector, only one
+    representative of every group being indexed and searched.
+
+    Attributes
+    ----------
+    representatives : np.ndarray
+        The item index of the representative of every group, its first item.
+    group_of : np.ndarray
+        The group of every item.
+    members : np.ndarray
+        The items of all the groups, one group after the other, each in item order.
+    offsets : np.ndarray
+        The len(groups) + 1 offsets of the groups in `members`.
+    rank : np.ndarray
+        The position of every item within its group.
+    """
+
+    def __init__(self, group_of):
+        self.group_of = group_of
+        self.members = np.argsort(group_of, kind='stable')
+        sizes = np.bincount(group_of)
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        self.representatives = self.members[self.offsets[:-1]]
+        self.rank = np.empty(len(group_of), dtype=np.int64)
+        self.rank[self.members] = np.arange(len(group_of)) - np.repeat(
+            self.offsets[:-1], sizes
+        )
+
+    def __len__(self):
+        return len(self.representatives)
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    @property
+    def duplicates(self):
+        """
+        The number of items that are not the representative of their group.
+        """
+        return len(self.group_of) - len(self)
+
+
+def _quantize(vectors, step):
+    return np.rint(vectors / step).astype(np.int32)
+
+
+def _hash(quantized):
+    hashes = np.zeros(len(quantized), dtype=np.uint64)
+    for j in range(quantized.shape[1]):
+        # uint64 arithmetic wraps around, the hash is the sum modulo 2**64
+        hashes += quantized[:, j].astype(np.uint64) * _HASH_MULTIPLIERS[
+            j % len(_HASH_MULTIPLIERS)
+        ]
+    return hashes
+
+
+def duplicate_groups(vectors, step):
+    """
+    Groups the vectors that round to the same multiple of a step in every dimension.
+
+    The quantized vectors are hashed in one pass. Vectors sharing a hash are compared with the
+    first vector of the hash, the rare ones that differ from it, a hash collision, are kept in
+    groups of their own.
+
+    Args:
+        vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+        step (float): The quantization step, the vectors of a group differ by less than it in every dimension.
+
+    Returns:
+        DuplicateGroups: The groups, numbered in the order of their first item.
+    """
+    hashes = np.empty(len(vectors), dtype=np.uint64)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = vectors[start : start + CHUNK_ROWS]
+        hashes[start : start + len(chunk)] = _hash(_quantize(chunk, step))
+    _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # the item every item is grouped with, checked against hash collisions
+    first_of = first[inverse]
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(vectors))
+        rows = np.flatnonzero(first_of[start:stop] != np.arange(start, stop)) + start
+        if len(rows) == 0:
+            continue
+        differ = np.any(
+            _quantize(vectors[rows], step)
+            != _quantize(vectors[first_of[rows]], step),
+            axis=1,
+        )
+        first_of[rows[differ]] = rows[differ]
+    # number the groups by their first item
+    _, group_of = np.unique(first_of, return_inverse=True)
+    return DuplicateGroups(group_of.reshape(-1).astype(np.int64))
+
+
+def expand_knn(groups, distance, indices, k):
+    """
+    Expands the kNN search of the group representatives into the kNN search of all the items.
+
+    The neighbours of an item are the items of the groups of its representative's neighbours,
+    in ascending distance, each at the distance of its representative, the item itself first.
+
+    Args:
+        groups (DuplicateGroups): The duplicate groups.
+        distance (np.ndarray): The (M, k') neighbour distances of the representatives.
+        indices (np.ndarray): The (M, k') neighbour groups of the representatives, -1 for no neighbour.
+        k (int): The number of neighbours of every item.
+
+    Returns:
+        tuple: The (N, k) float32 distances and int64 item indices, -1 for no neighbour.
+    """
+    n_groups = len(groups)
+    _self_first(distance, indices)
+    group_distance = np.full((n_groups, k), MISSING_DISTANCE, dtype=np.float32)
+    group_indices = np.full((n_groups, k), MISSING_INDEX, dtype=np.int64)
+    for start in range(0, n_groups, CHUNK_ROWS):
+        chunk_indices = indices[start : start + CHUNK_ROWS]
+        found = chunk_indices >= 0
+        sizes = np.where(found, groups.sizes[np.where(found, chunk_indices, 0)], 0)
+        # the members taken from every neighbour group, until the row has k of them
+        before = np.cumsum(sizes, axis=1) - sizes
+        taken = np.clip(k - before, 0, sizes).ravel()
+        row_lengths = taken.reshape(len(chunk_indices), -1).sum(axis=1)
+        neighbours = np.repeat(chunk_indices.ravel(), taken)
+        rows = np.repeat(np.arange(start, start + len(chunk_indices)), row_lengths)
+        columns = run_ranks(row_lengths)
+        group_distance[rows, columns] = np.repeat(
+            distance[start : start + CHUNK_ROWS].ravel(), taken
+        )
+        group_indices[rows, columns] = groups.members[
+            groups.offsets[neighbours] + run_ranks(taken)
+        ]
+
+    expanded_distance = group_distance[groups.group_of]
+    expanded_indices = group_indices[groups.group_of]
+    # the group of an item fills the first columns in rank order, the item is moved first
+    items = np.arange(len(groups.group_of))
+    swap = np.flatnonzero(groups.rank < k)
+    expanded_indices[swap, groups.rank[swap]] = expanded_indices[swap, 0]
+    expanded_indices[items, 0] = items
+    return expanded_distance, expanded_indices
+
+
+def _self_first(distance, indices):
+    """
+    Moves every representative first in its own search results, in place.
+
+    An approximate index, or a tie with a near identical representative, can list another
+    vector first. The representative then takes the first column at the smallest distance of
+    the row, and the vector it replaces takes its column, so the rows stay sorted.
+    """
+    rows = np.flatnonzero(indices[:, 0] != np.arange(len(indices)))
+    if len(rows) == 0:
+        return
+    row_indices = indices[rows]
+    position = np.argmax(row_indices == rows[:, None], axis=1)
+    found = row_indices[np.arange(len(rows)), position] == rows
+    swapped = rows[found]
+    indices[swapped, position[found]] = indices[swapped, 0]
+    # the representative was not found, the row is shifted to make room for it
+    shifted = rows[~found]
+    indices[shifted, 1:] = indices[shifted, :-1]
+    distance[shifted, 1:] = distance[shifted, :-1]
+    distance[shifted, 0] = 0
+    indices[rows, 0] = rows
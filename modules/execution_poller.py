@@ -0,0 +1,203 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dtlpy as dl
+
+logger = logging.getLogger('[EXECUTION POLLER]')
+logging.basicConfig(level='INFO')
+
+# the execution statuses of a running execution
+RUNNING_STATUSES = ('created', 'in-progress')
+
+
+class _Watch:
+    def __init__(self, key, project, execution_id, on_status, on_done):
+        self.key = key
+        self.project = project
+        self.execution_id = execution_id
+        self.on_status = on_status
+        self.on_done = on_done
+        self.started = time.time()
+
+
+class ExecutionPoller:
+    """
+    Waits for the platform executions of all the datasets in one thread.
+
+    Every interval the statuses of all the watched executions are fetched with one list request
+    per project, instead of one thread polling every execution. When an execution leaves the
+    running statuses, or times out, it stops being watched and its completion callback runs
+    exactly once, in a separate thread, so a follow-up export does not delay the other executions.
+
+    Attributes
+    ----------
+    interval : float
+        The seconds between two status fetches.
+    timeout : float
+        The seconds after which an execution is given up, 0 for no timeout.
+    batch_size : int
+        The maximum number of executions fetched by one list request.
+
+    Methods
+    -------
+    watch(key, project, execution_id, on_status, on_done)
+        Starts waiting for an execution, unless one with the same key is already watched.
+    pending()
+        Returns the keys of the watched executions.
+    stats()
+        Returns the counters.
+    """
+
+    def __init__(self, interval, timeout, batch_size=100, followup_workers=2):
+        self.interval = max(float(interval), 0.1)
+        self.timeout = float(timeout)
+        self.batch_size = max(int(batch_size), 1)
+        self.polls = 0
+        self.fetched = 0
+        self.errors = 0
+        self.completed = 0
+        self.timed_out = 0
+        self._watches = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._followups = ThreadPoolExecutor(
+            max_workers=max(int(followup_workers), 1),
+            thread_name_prefix='cleanup-execution-done',
+        )
+
+    def watch(self, key, project, execution_id, on_status, on_done):
+        """
+        Starts waiting for an execution.
+
+        Args:
+            key (tuple): The key deduplicating the executions, for example the dataset id and execution type.
+            project (dl.entities.Project): The project of the execution.
+            execution_id (str): The ID of the execution.
+            on_status (callable): Called in the poller thread with every fetched latest status.
+            on_done (callable): Called once with the final latest status, None on timeout.
+
+        Returns:
+            bool: False if an execution with the key is already watched.
+        """
+        with self._condition:
+            if key in self._watches:
+                return False
+            self._watches[key] = _Watch(key, project, execution_id, on_status, on_done)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name='cleanup-execution-poller', daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+        return True
+
+    def pending(self):
+        """
+        Returns the keys of the watched executions.
+
+        Returns:
+            list: The keys.
+        """
+        with self._condition:
+            return list(self._watches)
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                if not self._watches:
+                    self._thread = None
+                    return
+                watches = list(self._watches.values())
+            self._poll(watches)
+            with self._condition:
+                self._condition.wait(self.interval)
+
+    def _fetch(self, project, execution_ids):
+        statuses = {}
+        for start in range(0, len(execution_ids), self.batch_size):
+            batch = execution_ids[start : start + self.batch_size]
+            filters = dl.Filters(resource=dl.FiltersResource.EXECUTION)
+            filters.add(field='id', values=batch, operator=dl.FiltersOperations.IN)
+            filters.page_size = len(batch)
+            pages = project.executions.list(filters=filters)
+            for execution in pages.all():
+                statuses[execution.id] = execution.latest_status
+        for execution_id in execution_ids:
+            if execution_id not in statuses:
+                # not listed yet, fetched on its own
+                statuses[execution_id] = project.executions.get(
+                    execution_id=execution_id
+                ).latest_status
+        return statuses
+
+    def _poll(self, watches):
+        self.polls += 1
+        by_project = {}
+        for watch in watches:
+            by_project.setdefault(watch.project.id, []).append(watch)
+        for project_watches in by_project.values():
+            try:
+                statuses = self._fetch(
+                    project_watches[0].project,
+                    [watch.execution_id for watch in project_watches],
+                )
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Cannot fetch the execution statuses: %s", e)
+                statuses = {}
+            self.fetched += len(statuses)
+            for watch in project_watches:
+                status = statuses.get(watch.execution_id)
+                if status is not None:
+                    try:
+                        watch.on_status(status)
+                    except Exception:
+                        logger.exception("Status callback of %s failed", watch.key)
+                    if status['status'] not in RUNNING_STATUSES:
+                        self._finish(watch, status)
+                        continue
+                if 0 < self.timeout <= time.time() - watch.started:
+                    self.timed_out += 1
+                    self._finish(watch, None)
+
+    def _finish(self, watch, status):
+        with self._condition:
+            if self._watches.get(watch.key) is not watch:
+                return
+            del self._watches[watch.key]
+            if status is not None:
+                self.completed += 1
+        logger.info(
+            "Execution %s of %s is %s",
+            watch.execution_id,
+            watch.key,
+            'timed out' if status is None else status['status'],
+        )
+        self._followups.submit(self._done, watch, status)
+
+    @staticmethod
+    def _done(watch, status):
+        try:
+            watch.on_done(status)
+        except Exception:
+            logger.exception("Completion of execution %s failed", watch.execution_id)
+
+    def stats(self):
+        """
+        Returns the counters.
+
+        Returns:
+            dict: The watched executions, the polls, fetched statuses, fetch errors, completed and timed out executions.
+        """
+        with self._condition:
+            pending = len(self._watches)
+        return {
+            'pending': pending,
+            'polls': self.polls,
+            'fetched': self.fetched,
+            'errors': self.errors,
+            'completed': self.completed,
+            'timed_out': self.timed_out,
+        }
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.profiling import ACTIVE_PROFILER
+
+logger = logging.getLogger('[EXECUTORS]')
+logging.basicConfig(level='INFO')
+
+
+class PoolBusy(Exception):
+    """
+    Raised when a task is submitted to a pool whose queue is full.
+    """
+
+
+class PoolTimeout(TimeoutError):
+    """
+    Raised when a task did not complete within the timeout of its pool.
+    """
+
+
+class BoundedPool:
+    """
+    A thread pool the async routes offload blocking work to, with a bounded queue and a per task timeout.
+
+    A task submitted while `max_workers + max_queue` tasks are queued or running is rejected
+    right away, so a burst of slow requests cannot pile up behind each other. A task that
+    times out keeps its slot until it completes, its result is dropped.
+
+    Attributes
+    ----------
+    name : str
+        The name of the pool, used in the thread names and the logs.
+    max_workers : int
+        The number of threads.
+    max_queue : int
+        The number of tasks that can wait for a thread.
+    timeout : float
+        The number of seconds a route waits for a task, 0 for no timeout.
+
+    Methods
+    -------
+    run(function, *args, **kwargs)
+        Runs a function in the pool and waits for its result.
+    stats()
+        Returns the pool counters.
+    """
+
+    def __init__(self, name, max_workers, max_queue, timeout):
+        self.name = name
+        self.max_workers = max(int(max_workers), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.timeout = float(timeout)
+        self.submitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix=f'cleanup-{name}'
+        )
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Runs a function in the pool and waits for its result without blocking the event loop.
+
+        Args:
+            function (callable): The blocking function.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            PoolBusy: If the queue of the pool is full.
+            PoolTimeout: If the function did not complete within the timeout.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolBusy(f"The {self.name} pool is busy")
+            self._pending += 1
+            self.submitted += 1
+        call, call_args = function, args
+        profiler = ACTIVE_PROFILER.get()
+        if profiler is not None:
+            # the profiled request is profiled in the worker thread
+            call, call_args = profiler.runcall, (function,) + args
+        try:
+            future = self._executor.submit(call, *call_args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self.timeout if self.timeout > 0 else None
+            )
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            logger.warning(
+                "%s did not complete within %.1f[s] in the %s pool",
+                getattr(function, '__name__', function),
+                self.timeout,
+                self.name,
+            )
+            raise PoolTimeout(
+                f"The {self.name} task did not complete within {self.timeout}s"
+            ) from None
+
+    def stats(self):
+        """
+        Returns the pool counters.
+
+        Returns:
+            dict: The queued or running tasks, the submitted, rejected and timed out task counts and the limits.
+        """
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+            }
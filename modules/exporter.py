@@ -1,6 +1,7 @@
 import dtlpy as dl
 import numpy as np
 import threading
+import os
 import datetime
 import logging
 import json
@@ -8,13 +9,153 @@ import time
 import io
 import pytz
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dtlpy_exporter import ExportBase, ExportStatus
-from sklearn.preprocessing import normalize
-from faiss import IndexHNSWFlat, METRIC_ABS_INNER_PRODUCT
+
+from modules.ann import BACKEND_AUTO, BACKEND_HNSW, BACKENDS, select_backend
+from modules.anomaly import AnomalyScores, SCORE_NEAREST, anomaly_scores
+from modules.build import (
+    BuildProgress,
+    add_chunked,
+    range_search_chunked,
+    search_chunked,
+    set_worker_threads,
+    thread_budget,
+)
+from modules.cache import ResultCache
+from modules.clustering import CLUSTERING_LINKAGE
+from modules.columns import FeatureSetBuffer, FeatureSetColumns, ItemTable
+from modules.duplicates import duplicate_groups, expand_knn
+from modules.execution_poller import ExecutionPoller
+from modules.graph import GRAPH_KNN, GRAPH_RANGE
+from modules.incremental import diff_feature_sets, update_knn
+from modules.index_store import IndexStore, index_files
+from modules.leakage import cross_matches
+from modules.linkage import LinkageHierarchy, graph_edges, knn_edges
+from modules.memory import array_bytes, peak_rss_bytes
+from modules.metrics import Gauge, Histogram
+from modules.quality import QUALITY_TYPES, QualityScores, item_quality_scores
+from modules.sharding import sharded_knn
+from modules.storage import (
+    STORAGE_FLOAT32,
+    STORAGE_PCA,
+    storage_agreement,
+    vector_storage,
+)
 
 logger = logging.getLogger('[EXPORTER]')
 logging.basicConfig(level='INFO')
 
+RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get('CLEANUP_RESULT_CACHE_BYTES', 256 * 1024 * 1024)
+)
+# the cache of computed query results, shared by the datasets so its bound is global
+RESULTS_CACHE = ResultCache(max_bytes=RESULT_CACHE_MAX_BYTES)
+ANOMALY_SCORE = os.environ.get('CLEANUP_ANOMALY_SCORE', SCORE_NEAREST)
+ANOMALY_SCORE_K = int(os.environ.get('CLEANUP_ANOMALY_SCORE_K', 5))
+# empty to disable the on disk cache of the vectors, indexes and kNN graphs
+INDEX_DIR = os.environ.get(
+    'CLEANUP_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'dataset-cleanup-index')
+)
+# `knn` keeps a fixed number of neighbours per item, `range` every neighbour within GRAPH_MAX_DISTANCE
+NEIGHBOUR_GRAPH = os.environ.get('CLEANUP_NEIGHBOUR_GRAPH', GRAPH_KNN)
+# the largest similarity threshold served by the `range` graph and the linkage hierarchies
+GRAPH_MAX_DISTANCE = float(os.environ.get('CLEANUP_GRAPH_MAX_DISTANCE', 0.3))
+# the HNSW search depth of the range search, higher finds more of the members of big duplicate groups
+GRAPH_EF_SEARCH = int(os.environ.get('CLEANUP_GRAPH_EF_SEARCH', 256))
+# `auto` to choose the index backend by feature set size, or `flat`, `hnsw` or `ivfpq` to force one
+INDEX_BACKEND = os.environ.get('CLEANUP_INDEX_BACKEND', BACKEND_AUTO)
+# a JSON object of dataset id to index backend, overriding INDEX_BACKEND for these datasets
+INDEX_BACKEND_OVERRIDES = json.loads(
+    os.environ.get('CLEANUP_INDEX_BACKEND_OVERRIDES') or '{}'
+)
+# feature sets up to this size are searched exactly by the `auto` backend
+FLAT_MAX_ITEMS = int(os.environ.get('CLEANUP_FLAT_MAX_ITEMS', 20000))
+# feature sets from this size are product quantized by the `auto` backend
+IVFPQ_MIN_ITEMS = int(os.environ.get('CLEANUP_IVFPQ_MIN_ITEMS', 2000000))
+# `float32`, `float16`, `int8` or `pca`, the encoding the vectors are held, stored and indexed with
+VECTOR_STORAGE = os.environ.get('CLEANUP_VECTOR_STORAGE', STORAGE_FLOAT32)
+# a JSON object of dataset id to vector storage, overriding VECTOR_STORAGE for these datasets
+VECTOR_STORAGE_OVERRIDES = json.loads(
+    os.environ.get('CLEANUP_VECTOR_STORAGE_OVERRIDES') or '{}'
+)
+# the dimensions kept by the `pca` vector storage
+PCA_DIMENSIONS = int(os.environ.get('CLEANUP_PCA_DIMENSIONS', 128))
+# the items the compressed vectors are checked against the full precision ones on, 0 to skip the check
+STORAGE_CHECK_ITEMS = int(os.environ.get('CLEANUP_STORAGE_CHECK_ITEMS', 20000))
+# the parameters the kNN graph is built with, with the backend parameters part of the stored entries fingerprint
+INDEX_PARAMS = {'k': 150}
+# the neighbours searched for the range graph when the index has no range search
+RANGE_FALLBACK_K = INDEX_PARAMS['k']
+if NEIGHBOUR_GRAPH == GRAPH_RANGE:
+    # the dense kNN graph only serves the anomaly scores
+    INDEX_PARAMS.update(
+        {
+            'k': ANOMALY_SCORE_K + 1,
+            'graph': GRAPH_RANGE,
+            'radius': GRAPH_MAX_DISTANCE,
+            'rangeEfSearch': GRAPH_EF_SEARCH,
+        }
+    )
+# every vector is added to the index and searched once, and searched again for the range graph
+BUILD_PASSES = 3 if NEIGHBOUR_GRAPH == GRAPH_RANGE else 2
+# the threads used to index the feature sets, split between parallel builds and faiss, 0 for all the CPUs
+BUILD_THREADS = int(os.environ.get('CLEANUP_BUILD_THREADS', 0))
+# the maximum number of feature sets indexed at once, 0 for as many as the threads allow
+BUILD_WORKERS = int(os.environ.get('CLEANUP_BUILD_WORKERS', 0))
+# feature sets from this size are indexed and searched in shards by worker processes, 0 to never shard
+SHARD_MIN_ITEMS = int(os.environ.get('CLEANUP_SHARD_MIN_ITEMS', 3000000))
+# the worker processes of a sharded build, 0 for the threads of the feature set
+SHARD_PROCESSES = int(os.environ.get('CLEANUP_SHARD_PROCESSES', 0))
+# the shards of a sharded build, 0 for one per worker process
+SHARDS = int(os.environ.get('CLEANUP_SHARDS', 0))
+# where the vectors and results shared with the worker processes are written, empty for the temporary directory
+SHARD_DIR = os.environ.get('CLEANUP_SHARD_DIR') or None
+# the quantization step under which vectors are grouped as duplicates and indexed once, 0 to index every vector
+DUPLICATE_STEP = float(os.environ.get('CLEANUP_DUPLICATE_STEP', 1e-3))
+# the fraction of duplicate vectors from which only one vector per group is indexed
+DUPLICATE_MIN_FRACTION = float(os.environ.get('CLEANUP_DUPLICATE_MIN_FRACTION', 0.05))
+if DUPLICATE_STEP > 0 and NEIGHBOUR_GRAPH != GRAPH_RANGE:
+    INDEX_PARAMS['duplicateStep'] = DUPLICATE_STEP
+# above this fraction of added and removed vectors the kNN graph is rebuilt instead of updated
+INCREMENTAL_MAX_CHURN = float(os.environ.get('CLEANUP_INCREMENTAL_MAX_CHURN', 0.2))
+# above this fraction of removed vectors left in an updated index it is rebuilt
+INCREMENTAL_MAX_DEAD = float(os.environ.get('CLEANUP_INCREMENTAL_MAX_DEAD', 0.2))
+# the seconds between two fetches of the statuses of the running platform executions
+EXECUTION_POLL_INTERVAL = float(os.environ.get('CLEANUP_EXECUTION_POLL_INTERVAL', 5))
+# the seconds after which a platform execution is given up
+EXECUTION_TIMEOUT = float(os.environ.get('CLEANUP_EXECUTION_TIMEOUT', 60 * 60 * 2))
+
+# waits for the platform executions of all the datasets
+EXECUTION_POLLER = ExecutionPoller(
+    interval=EXECUTION_POLL_INTERVAL, timeout=EXECUTION_TIMEOUT
+)
+
+
+def pending_executions():
+    counts = {}
+    for _dataset_id, exec_type in EXECUTION_POLLER.pending():
+        counts[(exec_type,)] = counts.get((exec_type,), 0) + 1
+    return list(counts.items())
+
+
+PROCESS_PHASE_SECONDS = Histogram(
+    'cleanup_process_data_phase_seconds',
+    'Duration of the phases of the export processing, the build phases once per feature set.',
+    ['phase'],
+)
+QUALITY_PLATFORM_SECONDS = Histogram(
+    'cleanup_quality_platform_seconds',
+    'Latency of the quality score queries answered by the Dataloop platform.',
+    ['return_ids'],
+)
+EXECUTION_PENDING = Gauge(
+    'cleanup_executions_pending',
+    'Number of platform executions waited for by the execution poller.',
+    ['exec_type'],
+    callback=pending_executions,
+)
+
 
 class Exporter(ExportBase):
     """
@@ -24,8 +165,36 @@ class Exporter(ExportBase):
     ----------
     execution_running : dict
         A dictionary to track the status and progress of different execution types.
+    items : ItemTable
+        The metadata of the exported items, shared by all the feature sets.
     feature_sets_export : dict
-        A dictionary to store exported feature sets.
+        A dictionary of the exported feature sets as FeatureSetColumns.
+    graphs : dict
+        A dictionary of the per feature set NeighbourGraph, empty unless the `range` graph is built.
+    anomaly_scores : dict
+        A dictionary of the per feature set AnomalyScores, sorted from the most anomalous item.
+    hierarchies : dict
+        A dictionary of the per feature set LinkageHierarchy, the single linkage clusters of every threshold,
+        built by their first use after an export, see `hierarchy`.
+    quality_scores : dict
+        A dictionary of the per quality type QualityScores of the exported items, sorted by score.
+    results_cache : CacheScope
+        The entries of the dataset in the byte bounded LRU cache of computed query results
+        shared by all the datasets, cleared on every new export.
+    data_version : int
+        A counter incremented every time new feature sets are processed, used in cache keys.
+    index_store : IndexStore
+        The on disk cache of the vectors, indexes and kNN graphs, used to restore the dataset after a restart.
+    stored_feature_sets : dict
+        A dictionary of the StoredFeatureSet entries the current feature sets were loaded from.
+    index_backend : str
+        The index backend forced for this dataset, None to use the configured one.
+    vector_storage : str
+        The vector storage forced for this dataset, None to use the configured one.
+    index_info : dict
+        A dictionary of the per feature set index backend, parameters, build time and storage check.
+    resident : bool
+        Whether the feature sets are in memory, False once evicted until they are reloaded from the index store.
 
     Methods
     -------
@@ -36,11 +205,29 @@ class Exporter(ExportBase):
     install_start_exec(dpk_name, service_name, funtion_name, exec_type)
         Installs and starts the execution of a specified function.
     start_execution(exec_type)
-        Starts the execution of a specified type.
-    wait_for_execution(execution_id, exec_type)
-        Waits for the execution to complete and updates the status and progress.
-    quality_score(qtype, min_v, max_v, limit=0, pagination=100, return_ids=False)
+        Starts the execution of a specified type, unless it is already running.
+    quality_score(qtype, min_v, max_v, limit=0, pagination=0, return_ids=False)
         Filters items in the dataset based on quality scores and returns the count or item details.
+    quality_rows(qtype, min_v, max_v, limit=0, pagination=0)
+        Returns the item table rows of the items in a quality score range.
+    quality_histogram(qtype, bins=20)
+        Counts the items in quality score bins.
+    hierarchy(key)
+        Returns the single linkage hierarchy of a feature set, built on first use.
+    similarity_curve(key, bins=30)
+        Counts the similarity clusters and duplicates along the similarity slider.
+    search_index(key)
+        Returns the faiss index of a feature set, loaded from the index store.
+    cross_duplicates(key, target, threshold, k)
+        Finds the items with near duplicates in the same feature set of another dataset.
+    memory_usage()
+        Returns the heap and memory-mapped bytes of the exported state.
+    feature_set_memory_usage()
+        Returns the heap and memory-mapped bytes of every feature set.
+    evict()
+        Drops the exported state that can be reloaded from the index store.
+    reload()
+        Reloads the evicted state from the index store.
     """
 
     def __init__(self, dataset_id):
@@ -62,17 +249,729 @@ class Exporter(ExportBase):
             }
             # status
 
+            self.items = ItemTable()
+            self.feature_sets_export = {}
+            self.distance = {}
+            self.indices = {}
+            self.graphs = {}
+            self.anomaly_scores = {}
+            self.hierarchies = {}
+            self.quality_scores = {}
+            self.results_cache = RESULTS_CACHE.scope(dataset_id)
+            self.data_version = 0
+            self.index_store = IndexStore(INDEX_DIR)
+            self.stored_feature_sets = {}
+            self.index_backend = None
+            self.vector_storage = None
+            self.index_info = {}
+            self.resident = True
+            self._state_lock = threading.RLock()
+            self._hierarchy_lock = threading.Lock()
+            self._run_started = None
+            self._execution_lock = threading.Lock()
+            if self.index_store.enabled:
+                self.restore_from_store(dataset_id)
+
+    def set_feature_sets(
+        self, items, feature_sets_export, distance, indices, graphs=None
+    ):
+        """
+        Replaces the exported feature sets and their kNN graphs, invalidating the computed results.
+
+        Args:
+            items (ItemTable): The metadata of the exported items.
+            feature_sets_export (dict): The feature set name to FeatureSetColumns mapping.
+            distance (dict): The feature set name to (N, k) neighbour distances mapping.
+            indices (dict): The feature set name to (N, k) neighbour indices mapping.
+            graphs (dict, optional): The feature set name to NeighbourGraph mapping.
+        """
+        scores = {
+            key: AnomalyScores(
+                anomaly_scores(distance[key], method=ANOMALY_SCORE, k=ANOMALY_SCORE_K)
+            )
+            for key in feature_sets_export
+        }
+        # items stored before the quality scores were exported have no score columns
+        quality_scores = {
+            qtype: QualityScores(items.quality_scores[name])
+            for qtype, name in QUALITY_TYPES.items()
+            if name in items.quality_scores
+        }
+        with self._state_lock:
+            self.items = items
+            self.feature_sets_export = feature_sets_export
+            self.distance = distance
+            self.indices = indices
+            self.graphs = graphs or {}
+            self.anomaly_scores = scores
+            self.hierarchies = {}
+            self.quality_scores = quality_scores
+            # results computed from the previous distance/indices are no longer valid
+            self.data_version += 1
+            self.results_cache.clear()
+            self.resident = True
+
+    def restore_from_store(self, dataset_id):
+        """
+        Memory-maps the last processed feature sets of the dataset from the index store.
+
+        Args:
+            dataset_id (str): The ID of the dataset.
+
+        Returns:
+            bool: Whether the dataset was restored.
+        """
+        restored = self.index_store.restore(dataset_id)
+        if restored is None:
+            return False
+        items, stored = restored
+        self.stored_feature_sets = stored
+        self.index_info = {
+            key: entry.info for key, entry in stored.items() if entry.info is not None
+        }
+        self.set_feature_sets(
+            items,
+            {key: entry.feature_set for key, entry in stored.items()},
+            {key: entry.distance for key, entry in stored.items()},
+            {key: entry.indices for key, entry in stored.items()},
+            {
+                key: entry.graph
+                for key, entry in stored.items()
+                if entry.graph is not None
+            },
+        )
+        logger.info(
+            "Restored %d feature sets of dataset %s from %s",
+            len(stored),
+            dataset_id,
+            self.index_store.root,
+        )
+        return True
+
+    @staticmethod
+    def _item_arrays(items):
+        for name in ('ids', 'names', 'thumbnails'):
+            column = getattr(items, name)
+            if isinstance(column.data, np.ndarray):
+                yield column.data
+            else:
+                yield np.frombuffer(column.data, dtype=np.uint8)
+            yield column.offsets
+        yield items.annotated
+        yield from items.quality_scores.values()
+
+    def feature_set_memory_usage(self):
+        """
+        Measures the exported state of every feature set of the dataset.
+
+        The state is read without the state lock, which a reload holds while it restores the
+        dataset: its dictionaries are replaced, never changed in place, so their references are
+        a snapshot, and a feature set whose arrays are being replaced is not counted.
+
+        Returns:
+            dict: The feature set name to {'heap_bytes', 'mapped_bytes'} mapping of its vectors,
+                  neighbour graphs, anomaly scores and linkage hierarchy.
+        """
+        feature_sets = self.feature_sets_export
+        distance = self.distance
+        indices = self.indices
+        graphs = self.graphs
+        anomaly_scores = self.anomaly_scores
+        hierarchies = self.hierarchies
+        usage = {}
+        for key, feature_set in list(feature_sets.items()):
+            if key not in distance or key not in indices:
+                continue
+            arrays = [feature_set.rows, feature_set.vectors, distance[key], indices[key]]
+            graph = graphs.get(key)
+            if graph is not None:
+                arrays.extend((graph.offsets, graph.indices, graph.distance))
+            heap, mapped = array_bytes(arrays)
+            scores = anomaly_scores.get(key)
+            heap += scores.nbytes if scores is not None else 0
+            hierarchy = hierarchies.get(key)
+            heap += hierarchy.nbytes if hierarchy is not None else 0
+            usage[key] = {'heap_bytes': heap, 'mapped_bytes': mapped}
+        return usage
+
+    def memory_usage(self):
+        """
+        Measures the exported state of the dataset, without the state lock, see `feature_set_memory_usage`.
+
+        Returns:
+            dict: The 'heap_bytes' of the arrays, scores and cached results in memory, and the
+                  'mapped_bytes' of the arrays memory-mapped from the index store.
+        """
+        quality_scores = self.quality_scores
+        heap, mapped = array_bytes(self._item_arrays(self.items))
+        for usage in self.feature_set_memory_usage().values():
+            heap += usage['heap_bytes']
+            mapped += usage['mapped_bytes']
+        heap += sum(scores.nbytes for scores in quality_scores.values())
+        heap += self.results_cache.current_bytes
+        return {'heap_bytes': heap, 'mapped_bytes': mapped}
+
+    def evict(self):
+        """
+        Drops the feature sets, kNN graphs, scores and cached results, when they can be reloaded from the index store.
+
+        The eviction runs on the event loop, so it gives up rather than wait for the state
+        lock, held while the dataset is exported or reloaded.
+
+        Returns:
+            bool: Whether the state was evicted.
+        """
+        if not self._state_lock.acquire(blocking=False):
+            return False
+        try:
+            stored = set(self.stored_feature_sets)
+            if (
+                not self.resident
+                or not self.index_store.enabled
+                or not stored
+                or stored != set(self.feature_sets_export)
+            ):
+                return False
+            self.items = ItemTable()
             self.feature_sets_export = {}
             self.distance = {}
             self.indices = {}
+            self.graphs = {}
+            self.anomaly_scores = {}
+            self.hierarchies = {}
+            self.quality_scores = {}
+            self.stored_feature_sets = {}
+            self.results_cache.clear()
+            self.resident = False
+        finally:
+            self._state_lock.release()
+        return True
+
+    def reload(self):
+        """
+        Reloads the evicted state of the dataset from the index store.
+
+        The data version is kept, the reloaded state being the evicted one, so the similarity
+        page cursors stay valid.
+
+        Returns:
+            bool: Whether the state is resident.
+        """
+        with self._state_lock:
+            if self.resident:
+                return True
+            data_version = self.data_version
+            if not self.restore_from_store(self.dataset.id):
+                return False
+            self.data_version = data_version
+        return True
+
+    def hierarchy(self, key):
+        """
+        Returns the single linkage hierarchy of a feature set, built by its first use after an export.
+
+        Only the `linkage` clustering and the similarity curve use the hierarchies, so the
+        exports and reloads of the datasets queried with the greedy clustering do not build them.
+
+        Args:
+            key (str): The feature set name.
+
+        Returns:
+            LinkageHierarchy: The hierarchy, None if the feature set was not exported.
+        """
+        hierarchy = self.hierarchies.get(key)
+        if hierarchy is not None:
+            return hierarchy
+        with self._hierarchy_lock:
+            with self._state_lock:
+                hierarchy = self.hierarchies.get(key)
+                data_version = self.data_version
+                distance = self.distance.get(key)
+                indices = self.indices.get(key)
+                graph = self.graphs.get(key)
+            if hierarchy is not None or distance is None or indices is None:
+                return hierarchy
+            with PROCESS_PHASE_SECONDS.time(phase='hierarchy'):
+                hierarchy = self.build_hierarchy(distance, indices, graph)
+            with self._state_lock:
+                # the hierarchy of a replaced export is returned to its query, not kept
+                if self.resident and self.data_version == data_version:
+                    self.hierarchies = {**self.hierarchies, key: hierarchy}
+        return hierarchy
+
+    @staticmethod
+    def build_hierarchy(distance, indices, graph=None):
+        """
+        Builds the single linkage hierarchy of a feature set from its neighbours within GRAPH_MAX_DISTANCE.
+
+        Args:
+            distance (np.ndarray): The (N, k) neighbour distances.
+            indices (np.ndarray): The (N, k) neighbour indices.
+            graph (NeighbourGraph, optional): The range graph, used instead of the kNN search when built.
+
+        Returns:
+            LinkageHierarchy: The hierarchy.
+        """
+        if graph is not None:
+            edges = graph_edges(graph, GRAPH_MAX_DISTANCE)
+        else:
+            edges = knn_edges(distance, indices, GRAPH_MAX_DISTANCE)
+        return LinkageHierarchy.from_edges(len(distance), *edges)
+
+    def select_backend(self, n):
+        """
+        Chooses the index backend of a feature set of this dataset.
+
+        Args:
+            n (int): The number of vectors of the feature set.
+
+        Returns:
+            IndexBackend: The backend forced for the dataset, or chosen by size.
+        """
+        name = (
+            self.index_backend
+            or INDEX_BACKEND_OVERRIDES.get(self.dataset.id)
+            or INDEX_BACKEND
+        )
+        return select_backend(
+            n,
+            name,
+            flat_max_items=FLAT_MAX_ITEMS,
+            ivfpq_min_items=IVFPQ_MIN_ITEMS,
+        )
+
+    @staticmethod
+    def shard_plan(n, threads=0):
+        """
+        Chooses whether a feature set is indexed in shards, and by how many processes.
+
+        Args:
+            n (int): The number of vectors of the feature set.
+            threads (int): The threads of the feature set worker, 0 for all the CPUs.
+
+        Returns:
+            tuple: The number of shards, 0 to index the feature set in process, and of worker processes.
+        """
+        if SHARD_MIN_ITEMS <= 0 or n < SHARD_MIN_ITEMS:
+            return 0, 0
+        processes = SHARD_PROCESSES or threads or os.cpu_count() or 1
+        shards = SHARDS or processes
+        if shards < 2:
+            return 0, 0
+        return shards, min(processes, shards)
+
+    def select_storage(self):
+        """
+        Chooses the vector storage of the feature sets of this dataset.
+
+        Returns:
+            VectorStorage: The unfitted storage forced for the dataset, or the configured one.
+        """
+        name = (
+            self.vector_storage
+            or VECTOR_STORAGE_OVERRIDES.get(self.dataset.id)
+            or VECTOR_STORAGE
+        )
+        return vector_storage(name, pca_dimensions=PCA_DIMENSIONS)
+
+    def encode_feature_set(self, key, feature_set, storage):
+        """
+        Compresses the normalized vectors of a feature set, checking the neighbours of a sample first.
+
+        The storage of the previous export of the feature set is reused when it still fits the
+        vectors, so that the unchanged vectors keep their codes and the index can be updated.
+
+        Args:
+            key (str): The feature set name.
+            feature_set (FeatureSetColumns): The feature set of float32 vectors.
+            storage (VectorStorage): The unfitted storage.
+
+        Returns:
+            tuple: The feature set of encoded vectors, and the agreement of the compressed
+                   neighbours with the full precision ones, or None when not checked.
+        """
+        if storage.name == STORAGE_FLOAT32:
+            return feature_set, None
+        previous = self.stored_feature_sets.get(key)
+        fitted = storage.fit(
+            feature_set.vectors,
+            previous.feature_set.storage if previous is not None else None,
+        )
+        check = None
+        if STORAGE_CHECK_ITEMS > 0 and len(feature_set) > 0:
+            with PROCESS_PHASE_SECONDS.time(phase='storage_check'):
+                check = storage_agreement(
+                    feature_set.vectors, fitted, STORAGE_CHECK_ITEMS
+                )
+            logger.info("Storage %s of feature set %s: %s", fitted.name, key, check)
+        encoded = FeatureSetColumns(
+            feature_set.items,
+            feature_set.rows,
+            fitted.encode(feature_set.vectors),
+            feature_set_id=feature_set.feature_set_id,
+            storage=fitted,
+        )
+        return encoded, check
+
+    @staticmethod
+    def build_knn(vectors, backend, progress=None, quantizer=None):
+        """
+        Builds the index of normalized vectors and searches every vector against it.
+
+        Args:
+            vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+            backend (IndexBackend): The index backend.
+            progress (BuildProgress, optional): Advanced by every added and searched chunk.
+            quantizer (faiss.ScalarQuantizer, optional): The quantizer of compressed vectors.
+
+        Returns:
+            tuple: The index, and the (N, k) neighbour distances and indices.
+        """
+        large_k = min(len(vectors), INDEX_PARAMS['k'])
+        with PROCESS_PHASE_SECONDS.time(phase='index_build'):
+            index = backend.build(vectors, quantizer)
+            add_chunked(index, vectors, progress)
+        with PROCESS_PHASE_SECONDS.time(phase='knn_search'):
+            distances, indices = search_chunked(
+                index, vectors, large_k, progress, backend
+            )
+        return index, distances, indices
+
+    @staticmethod
+    def build_knn_sharded(
+        vectors, backend, shards, processes, progress=None, storage=None
+    ):
+        """
+        Builds and searches the index of a large feature set in shards, in worker processes,
+        see `sharded_knn`. The range graph is searched in the same pass when it is enabled.
+
+        Args:
+            vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors, or their DecodedVectors.
+            backend (IndexBackend): The index backend of every shard.
+            shards (int): The number of shards.
+            processes (int): The number of worker processes.
+            progress (BuildProgress, optional): Advanced by every built shard and searched block.
+            storage (VectorStorage, optional): The encoding of compressed vectors.
+
+        Returns:
+            tuple: The index of the shards, the (N, k) neighbour distances and indices and the
+                   NeighbourGraph within GRAPH_MAX_DISTANCE, or None in `knn` mode.
+        """
+        radius = depth = None
+        if NEIGHBOUR_GRAPH == GRAPH_RANGE:
+            # range results are exclusive of the radius, the panel thresholds are inclusive
+            radius = float(
+                np.nextafter(np.float32(GRAPH_MAX_DISTANCE), np.float32(np.inf))
+            )
+            depth = GRAPH_EF_SEARCH
+        with PROCESS_PHASE_SECONDS.time(phase='sharded_build'):
+            return sharded_knn(
+                vectors,
+                backend,
+                min(len(vectors), INDEX_PARAMS['k']),
+                shards,
+                processes,
+                storage=storage,
+                radius=radius,
+                range_depth=depth,
+                progress=progress,
+                directory=SHARD_DIR,
+            )
+
+    @staticmethod
+    def build_knn_deduplicated(
+        vectors, backend, progress=None, quantizer=None, sharding=None, storage=None
+    ):
+        """
+        Indexes and searches one vector per group of duplicates, when there are enough of them.
+
+        The vectors are grouped by their quantization to DUPLICATE_STEP. Only the first vector of
+        every group is indexed and searched, then the search is expanded back to every item, the
+        members of a neighbour group sharing its distance.
+
+        Args:
+            vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+            backend (IndexBackend): The index backend.
+            progress (BuildProgress, optional): Advanced by every added and searched chunk.
+            quantizer (faiss.ScalarQuantizer, optional): The quantizer of compressed vectors.
+            sharding (tuple, optional): The shards and worker processes of a sharded build, see `shard_plan`.
+            storage (VectorStorage, optional): The encoding of compressed vectors, for a sharded build.
+
+        Returns:
+            tuple: The index of the representatives, the (N, k) neighbour distances and indices
+                   and the DuplicateGroups, or None if the vectors have too few duplicates.
+        """
+        if DUPLICATE_STEP <= 0 or NEIGHBOUR_GRAPH == GRAPH_RANGE:
+            return None
+        with PROCESS_PHASE_SECONDS.time(phase='deduplicate'):
+            groups = duplicate_groups(vectors, DUPLICATE_STEP)
+        if groups.duplicates < DUPLICATE_MIN_FRACTION * len(vectors):
+            return None
+        representatives = vectors[groups.representatives]
+        if sharding is not None and sharding[0] > 1:
+            index, distance, indices, _ = Exporter.build_knn_sharded(
+                representatives, backend, *sharding, progress, storage
+            )
+        else:
+            index, distance, indices = Exporter.build_knn(
+                representatives, backend, progress, quantizer
+            )
+        if progress is not None:
+            progress.advance(BUILD_PASSES * groups.duplicates)
+        with PROCESS_PHASE_SECONDS.time(phase='deduplicate'):
+            distance, indices = expand_knn(
+                groups, distance, indices, min(len(vectors), INDEX_PARAMS['k'])
+            )
+        return index, distance, indices, groups
+
+    @staticmethod
+    def build_graph(index, vectors, backend, progress=None):
+        """
+        Range searches every vector against its index when the `range` neighbour graph is enabled.
+
+        Args:
+            index (faiss.Index): The index of the vectors.
+            vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+            backend (IndexBackend): The index backend.
+            progress (BuildProgress, optional): Advanced by every searched chunk.
+
+        Returns:
+            NeighbourGraph: The neighbours within GRAPH_MAX_DISTANCE, or None in `knn` mode.
+        """
+        if NEIGHBOUR_GRAPH != GRAPH_RANGE:
+            return None
+        # range results are exclusive of the radius, the panel thresholds are inclusive
+        radius = float(np.nextafter(np.float32(GRAPH_MAX_DISTANCE), np.float32(np.inf)))
+        backend.set_search_depth(index, GRAPH_EF_SEARCH)
+        try:
+            with PROCESS_PHASE_SECONDS.time(phase='range_search'):
+                return range_search_chunked(
+                    index, vectors, radius, RANGE_FALLBACK_K, progress, backend
+                )
+        finally:
+            backend.set_search_depth(index)
+
+    def update_knn_incremental(self, key, feature_set, backend):
+        """
+        Updates the stored index and kNN graph of a feature set with the changes of a new export.
+
+        Args:
+            key (str): The feature set name.
+            feature_set (FeatureSetColumns): The newly exported feature set.
+            backend (IndexBackend): The index backend chosen for the new export.
+
+        Returns:
+            tuple: The index, the index label of every vector and the (N, k) neighbour distances
+                   and indices, or None if the graph has to be rebuilt.
+        """
+        previous = self.stored_feature_sets.get(key)
+        # the range graph is always rebuilt, and approximate distances cannot be merged
+        if NEIGHBOUR_GRAPH == GRAPH_RANGE or backend.approximate_distances:
+            return None
+        if previous is None or previous.feature_set.feature_set_id != feature_set.feature_set_id:
+            return None
+        # entries stored before the backends were recorded are HNSW indexes
+        previous_backend = (previous.info or {}).get('backend', BACKEND_HNSW)
+        if previous_backend != backend.name:
+            return None
+        # the codes of a refitted storage differ from the indexed ones
+        if previous.feature_set.storage is not feature_set.storage:
+            return None
+        # the index of a deduplicated build only holds the representatives
+        if (previous.info or {}).get('duplicates'):
+            return None
+        # the shards of a sharded build are not updated one by one
+        if (previous.info or {}).get('shards'):
+            return None
+        # a different k changes every row of the graph
+        if previous.distance.shape[1] != min(len(feature_set), INDEX_PARAMS['k']):
+            return None
+        delta = diff_feature_sets(previous.feature_set, feature_set)
+        if delta.churn > INCREMENTAL_MAX_CHURN:
+            return None
+        index = self.index_store.load_index(previous.path, writable=True)
+        if index is None:
+            return None
+        n_dead = index.ntotal + len(delta.added) - len(feature_set)
+        if n_dead > INCREMENTAL_MAX_DEAD * len(feature_set):
+            return None
+
+        labels, distances, indices, refreshed = update_knn(
+            index,
+            previous.labels,
+            delta,
+            previous.distance,
+            previous.indices,
+            feature_set.decoded,
+        )
+        logger.info(
+            "Feature set %s updated incrementally: %d added, %d removed, %d of %d rows searched again",
+            key,
+            len(delta.added),
+            len(delta.removed),
+            refreshed,
+            len(feature_set),
+        )
+        return index, labels, distances, indices
+
+    def index_feature_set(self, items, key, feature_set, progress=None, threads=0):
+        """
+        Builds, updates or loads the neighbour graphs of a feature set, storing them when the store is enabled.
+
+        Args:
+            items (ItemTable): The metadata of the exported items.
+            key (str): The feature set name.
+            feature_set (FeatureSetColumns): The feature set.
+            progress (BuildProgress, optional): Advanced while the vectors are indexed and searched.
+            threads (int): The number of faiss threads of the calling worker, 0 to keep the default.
+
+        Returns:
+            tuple: The feature set, its (N, k) neighbour distances and indices and its NeighbourGraph
+                   or None, memory-mapped from the store when stored, the StoredFeatureSet or None,
+                   and the index backend, parameters and build time.
+        """
+        if threads > 0:
+            set_worker_threads(threads)
+        backend = self.select_backend(len(feature_set))
+        vectors = feature_set.decoded
+        quantizer = feature_set.storage.scalar_quantizer
+        sharding = self.shard_plan(len(feature_set), threads)
+        params = {
+            **backend.params(len(feature_set), vectors.shape[1]),
+            **INDEX_PARAMS,
+            **feature_set.storage.params(),
+        }
+        if sharding[0] > 1:
+            # an approximate index of shards finds other neighbours than one index
+            params['shards'] = sharding[0]
+        stored = None
+        if self.index_store.enabled:
+            fingerprint = self.index_store.fingerprint(items, feature_set, params)
+            stored = self.index_store.load(
+                self.dataset.id, items, feature_set.feature_set_id, fingerprint
+            )
+        if stored is not None:
+            logger.info("Feature set %s is unchanged, using the stored index", key)
+            if progress is not None:
+                progress.advance(BUILD_PASSES * len(feature_set))
+            # serve the memory-mapped copies, shared through the page cache
+            return (
+                stored.feature_set,
+                stored.distance,
+                stored.indices,
+                stored.graph,
+                stored,
+                stored.info,
+            )
+
+        start = time.time()
+        updated = None
+        # the shards are rebuilt, a single index is updated
+        if self.index_store.enabled and sharding[0] <= 1:
+            updated = self.update_knn_incremental(key, feature_set, backend)
+            if updated is not None:
+                PROCESS_PHASE_SECONDS.observe(
+                    time.time() - start, phase='incremental_update'
+                )
+        duplicates = 0
+        if updated is None:
+            deduplicated = self.build_knn_deduplicated(
+                vectors, backend, progress, quantizer, sharding, feature_set.storage
+            )
+            if deduplicated is not None:
+                index, distance, indices, groups = deduplicated
+                # every item is indexed under the label of its group
+                labels = groups.group_of
+                duplicates = groups.duplicates
+                graph = None
+            elif sharding[0] > 1:
+                index, distance, indices, graph = self.build_knn_sharded(
+                    vectors, backend, *sharding, progress, feature_set.storage
+                )
+                labels = None
+            else:
+                index, distance, indices = self.build_knn(
+                    vectors, backend, progress, quantizer
+                )
+                graph = self.build_graph(index, vectors, backend, progress)
+                labels = None
+        else:
+            index, labels, distance, indices = updated
+            graph = None
+            if progress is not None:
+                progress.advance(BUILD_PASSES * len(feature_set))
+        info = {
+            'backend': backend.name,
+            'storage': feature_set.storage.name,
+            'params': params,
+            'items': len(feature_set),
+            'build_seconds': round(time.time() - start, 3),
+            'incremental': updated is not None,
+            'duplicates': duplicates,
+            'shards': sharding[0] if updated is None else 0,
+        }
+        logger.info(
+            "Indexed feature set %s of %d items (%d duplicates) with %s in %d shards in %.1f[s]",
+            key,
+            len(feature_set),
+            duplicates,
+            backend.name,
+            max(info['shards'], 1),
+            info['build_seconds'],
+        )
+        if not self.index_store.enabled:
+            return feature_set, distance, indices, graph, None, info
+
+        store_start = time.perf_counter()
+        try:
+            self.index_store.save(
+                self.dataset.id,
+                feature_set,
+                fingerprint,
+                distance,
+                indices,
+                index,
+                labels=labels,
+                graph=graph,
+                info=info,
+            )
+        except OSError as e:
+            logger.warning("Cannot store feature set %s: %s", key, e)
+            return feature_set, distance, indices, graph, None, info
+        stored = self.index_store.load(
+            self.dataset.id, items, feature_set.feature_set_id, fingerprint
+        )
+        PROCESS_PHASE_SECONDS.observe(time.perf_counter() - store_start, phase='store')
+        if stored is None:
+            return feature_set, distance, indices, graph, None, info
+        return (
+            stored.feature_set,
+            stored.distance,
+            stored.indices,
+            stored.graph,
+            stored,
+            info,
+        )
+
+    def run_whole_process(self, *args, **kwargs):
+        """
+        Downloads and processes the export of the dataset, timing the download for the metrics.
+        """
+        self._run_started = time.perf_counter()
+        try:
+            return super().run_whole_process(*args, **kwargs)
+        finally:
+            self._run_started = None
 
     def process_data(self, **kwargs):
         """
         Processes the data by extracting feature sets and organizing them into a dictionary.
 
-        This method iterates over the `download_data` attribute, extracts relevant information,
-        and organizes it into a dictionary where the keys are feature set names and the values
-        are lists of dictionaries containing item details.
+        This method consumes the `download_data` attribute record by record, releasing every
+        record once parsed, and streams the vectors into per feature set float32 buffers. The
+        result is a dictionary where the keys are feature set names and the values are
+        FeatureSetColumns holding the normalized vectors and the rows of their items in the
+        shared ItemTable.
 
         Args:
             **kwargs: Arbitrary keyword arguments.
@@ -82,69 +981,150 @@ class Exporter(ExportBase):
                        and sets the status to 'error'.
 
         Attributes:
+            items (ItemTable): The metadata of the exported items.
             feature_sets_export (dict): A dictionary where keys are feature set names and values
-                                        are lists of dictionaries containing item details.
+                                        are FeatureSetColumns.
             progress (int): An integer representing the progress of the data processing.
             status (str): A string representing the status of the data processing.
         """
+        start = time.perf_counter()
+        if self._run_started is not None:
+            PROCESS_PHASE_SECONDS.observe(start - self._run_started, phase='download')
         try:
             feature_sets = {
                 fs.id: fs.name for fs in self.dataset.project.feature_sets.list().all()
             }
 
-            feature_sets_export = {}
+            parse_start = time.perf_counter()
+            items = ItemTable()
+            feature_set_ids = {}
+            buffers = {}
 
-            total_files = len(self.download_data)
-            for i, data in enumerate(self.download_data):
-                name = data.get('name', '')
-                thumbnail = data.get('thumbnail', '')
-                annotated = data.get('annotated', False)
+            # the records are released as soon as they are parsed
+            download_data, self.download_data = self.download_data, []
+            total_files = len(download_data)
+            for i in range(total_files):
+                data, download_data[i] = download_data[i], None
+                quality_scores = item_quality_scores(data)
+                if quality_scores:
+                    # scored items are listed by the quality queries, with or without vectors
+                    items.add(
+                        data.get('id'),
+                        data.get('name', ''),
+                        data.get('thumbnail', ''),
+                        data.get('annotated', False),
+                        quality_scores,
+                    )
                 for feature_vec in data.get('itemVectors', []):
                     fs_id = feature_vec.get('featureSetId')
-                    value = feature_vec.get('value')
-                    item_id = data.get('id')
-
                     key = feature_sets.get(fs_id, fs_id)
+                    feature_set_ids[key] = fs_id
+
+                    # item metadata is stored once, whatever the number of feature sets
+                    row = items.add(
+                        data.get('id'),
+                        data.get('name', ''),
+                        data.get('thumbnail', ''),
+                        data.get('annotated', False),
+                    )
+                    if key not in buffers:
+                        buffers[key] = FeatureSetBuffer(capacity=total_files)
+                    buffers[key].append(row, feature_vec.get('value'))
+                self.progress = round(round((i + 1) / total_files * 20, 0) + 50)
+            del download_data
+            # a score no exported item has stays unknown, its queries are answered by the platform
+            items.freeze()
+            PROCESS_PHASE_SECONDS.observe(time.perf_counter() - parse_start, phase='parse')
+
+            feature_sets_export = {}
+            with PROCESS_PHASE_SECONDS.time(phase='normalize'):
+                for key in list(buffers):
+                    feature_sets_export[key] = buffers.pop(key).finish(
+                        items, feature_set_id=feature_set_ids[key]
+                    )
+            storage = self.select_storage()
+            storage_checks = {}
+            with PROCESS_PHASE_SECONDS.time(phase='encode'):
+                for key in list(feature_sets_export):
+                    feature_sets_export[key], storage_checks[key] = (
+                        self.encode_feature_set(key, feature_sets_export[key], storage)
+                    )
+            logger.info(
+                "Parsed %d items and %d feature sets, peak RSS %.1f MB",
+                len(items),
+                len(feature_sets_export),
+                peak_rss_bytes() / 1024**2,
+            )
+
+            distance = {}
+            indices = {}
+            graphs = {}
+            index_info = {}
+            stored_entries = {}
+            stored_feature_sets = {}
+            progress = BuildProgress(
+                BUILD_PASSES * sum(len(fs) for fs in feature_sets_export.values()),
+                callback=lambda fraction: setattr(
+                    self, 'progress', round(70 + 25 * fraction)
+                ),
+            )
+            workers, threads = thread_budget(
+                BUILD_THREADS, len(feature_sets_export), BUILD_WORKERS
+            )
+            logger.info(
+                "Indexing %d feature sets with %d workers of %d threads",
+                len(feature_sets_export),
+                workers,
+                threads,
+            )
+            with ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='cleanup-build'
+            ) as pool:
+                futures = {
+                    key: pool.submit(
+                        self.index_feature_set, items, key, feature_set, progress, threads
+                    )
+                    for key, feature_set in feature_sets_export.items()
+                }
+                for key, future in futures.items():
+                    (
+                        feature_set,
+                        distance[key],
+                        indices[key],
+                        graph,
+                        stored,
+                        index_info[key],
+                    ) = future.result()
+                    feature_sets_export[key] = feature_set
+                    if storage_checks[key] is not None:
+                        index_info[key] = {
+                            **index_info[key],
+                            'storage_check': storage_checks[key],
+                        }
+                    if graph is not None:
+                        graphs[key] = graph
+                    if stored is not None:
+                        stored_entries[key] = {
+                            'id': feature_set.feature_set_id,
+                            'fingerprint': stored.fingerprint,
+                        }
+                        stored_feature_sets[key] = stored
 
-                    if key not in feature_sets_export:
-                        feature_sets_export[key] = [
-                            {
-                                'itemId': item_id,
-                                'value': value,
-                                'name': name,
-                                'thumbnail': thumbnail,
-                                'annotated': annotated,
-                            }
-                        ]
-                    else:
-                        feature_sets_export[key].append(
-                            {
-                                'itemId': item_id,
-                                'value': value,
-                                'name': name,
-                                'thumbnail': thumbnail,
-                                'annotated': annotated,
-                            }
-                        )
-                    self.progress = round(round((i + 1) / total_files * 40, 0) + 50)
-
-            for key, value in feature_sets_export.items():
-
-                values = np.array([item['value'] for item in feature_sets_export[key]])
-                normalized_data = normalize(values, norm='l2')
-                large_k = min(len(normalized_data), 150)
-                dimension = normalized_data.shape[1]
-                hnsw_index = IndexHNSWFlat(dimension, 32)
-                hnsw_index.metric_type = METRIC_ABS_INNER_PRODUCT
-                hnsw_index.hnsw.efSearch = 50
-                hnsw_index.add(normalized_data)
-                distances, indices = hnsw_index.search(normalized_data, k=large_k)
-                self.distance[key] = distances
-                self.indices[key] = indices
+            if stored_entries and len(stored_entries) == len(feature_sets_export):
+                try:
+                    self.index_store.save_manifest(self.dataset.id, items, stored_entries)
+                except OSError as e:
+                    logger.warning("Cannot store the manifest: %s", e)
 
             self.progress = 95
 
-            self.feature_sets_export = feature_sets_export
+            self.stored_feature_sets = stored_feature_sets
+            self.index_info = index_info
+            with PROCESS_PHASE_SECONDS.time(phase='scores'):
+                self.set_feature_sets(
+                    items, feature_sets_export, distance, indices, graphs
+                )
+            PROCESS_PHASE_SECONDS.observe(time.perf_counter() - start, phase='total')
 
         except Exception as e:
             logger.error("Error while loading feature sets: %s", e)
@@ -171,7 +1151,8 @@ class Exporter(ExportBase):
 
     def install_start_exec(self, dpk_name, service_name, funtion_name, exec_type):
         """
-        Installs and starts the execution of a specified function within a service.
+        Installs and starts the execution of a specified function within a service,
+        and hands it to the shared execution poller.
 
         Args:
             dpk_name (str): The name of the DPK (Data Package) to be installed.
@@ -194,112 +1175,104 @@ class Exporter(ExportBase):
             service_id=service.id,
             execution_input={'dataset': {'dataset_id': self.dataset.id}, 'query': None},
         )
-        thread = threading.Thread(
-            target=self.wait_for_execution,
-            kwargs={"execution_id": execution.id, "exec_type": exec_type},
+        self.execution_running[exec_type]['execution_id'] = execution.id
+        EXECUTION_POLLER.watch(
+            key=(self.dataset.id, exec_type),
+            project=project,
+            execution_id=execution.id,
+            on_status=lambda status: self.update_execution_status(exec_type, status),
+            on_done=lambda status: self.complete_execution(
+                execution.id, exec_type, status
+            ),
         )
-        thread.daemon = True
-        thread.start()
 
     def start_execution(self, exec_type):
         """
         Starts the execution process for the given execution type.
 
         This method updates the execution status and progress for the specified
-        execution type and initiates the corresponding execution process.
+        execution type and initiates the corresponding execution process. A start
+        request while an execution of the type is running for the dataset is ignored.
 
         Args:
             exec_type (str): The type of execution to start. Supported values are
                              'clip' and 'quality-score-generator'.
 
+        Returns:
+            bool: False if an execution of the type was already running.
+
         Raises:
             KeyError: If the provided exec_type is not found in the execution_running dictionary.
         """
-        self.execution_running[exec_type]['status'] = 'running'
-        self.execution_running[exec_type]['progress'] = 0
-        self.execution_running[exec_type]['full_status'] = 'created'
+        with self._execution_lock:
+            if self.execution_running[exec_type]['status'] == 'running':
+                logger.info(
+                    "Execution %s of dataset %s is already running",
+                    exec_type,
+                    self.dataset.id,
+                )
+                return False
+            self.execution_running[exec_type]['status'] = 'running'
+            self.execution_running[exec_type]['progress'] = 0
+            self.execution_running[exec_type]['full_status'] = 'created'
 
-        if exec_type == 'clip':
-            self.install_start_exec(
-                'clip-image-search', 'clip-extraction', 'extract_dataset', 'clip'
-            )
-        elif exec_type == 'quality-score-generator':
-            self.install_start_exec(
-                'quality-score-generator-app',
-                'quality-scores-generator',
-                'dataset_scores_generator',
-                'quality-score-generator',
-            )
+        try:
+            if exec_type == 'clip':
+                self.install_start_exec(
+                    'clip-image-search', 'clip-extraction', 'extract_dataset', 'clip'
+                )
+            elif exec_type == 'quality-score-generator':
+                self.install_start_exec(
+                    'quality-score-generator-app',
+                    'quality-scores-generator',
+                    'dataset_scores_generator',
+                    'quality-score-generator',
+                )
+        except Exception:
+            self.execution_running[exec_type]['status'] = 'error'
+            raise
+        return True
+
+    def update_execution_status(self, exec_type, latest_status):
+        """
+        Updates the progress of a running execution, called by the execution poller.
+
+        Args:
+            exec_type (str): The type of the execution.
+            latest_status (dict): The latest status of the execution.
+        """
+        self.execution_running[exec_type]['progress'] = latest_status.get(
+            'percentComplete', 0
+        )
+        self.execution_running[exec_type]['full_status'] = latest_status['status']
 
-    def wait_for_execution(self, execution_id, exec_type):
+    def complete_execution(self, execution_id, exec_type, latest_status):
         """
-        Waits for the execution of a given execution ID to complete.
+        Finishes an execution, called once by the execution poller when it completed or timed out.
 
-        This method polls the execution status at regular intervals until the execution
-        completes, times out, or encounters an error. It updates the execution status
-        and progress in the `execution_running` dictionary.
+        A successful execution is followed by a new export of the dataset, to process what it generated.
 
         Args:
-            execution_id (str): The ID of the execution to wait for.
-            exec_type (str): The type of execution being waited on.
+            execution_id (str): The ID of the execution.
+            exec_type (str): The type of the execution.
+            latest_status (dict): The final status of the execution, None if it timed out.
 
         Raises:
-            TimeoutError: If the execution does not complete within the specified timeout.
-            dl.exceptions.PlatformException: If the execution does not complete successfully.
-            Exception: If any other error occurs during the wait.
+            TimeoutError: If the execution did not complete within the timeout.
+            dl.exceptions.PlatformException: If the execution did not complete successfully.
 
         Updates:
-            self.execution_running[exec_type]['progress']: The progress percentage of the execution.
-            self.execution_running[exec_type]['full_status']: The full status of the execution.
             self.execution_running[exec_type]['status']: The final status of the execution.
             self.status: The status of the export process.
             self.progress: The progress of the export process.
         """
-
         try:
-            project = dl.projects.get(project_id=self.dataset.project.id)
-            timeout = 60 * 60 * 2
-            max_sleep_time = 10
-            backoff_factor = 1
-            elapsed = 0
-            start = time.time()
-            if timeout is None or timeout <= 0:
-                timeout = np.inf
-
-            num_tries = 1
-            while elapsed < timeout:
-                latest_status = project.executions.get(
-                    execution_id=execution_id
-                ).latest_status
-                self.execution_running[exec_type]['progress'] = latest_status.get(
-                    'percentComplete', 0
-                )
-                self.execution_running[exec_type]['full_status'] = latest_status[
-                    'status'
-                ]
-                if latest_status['status'] not in ['in-progress', 'created']:
-                    self.execution_running[exec_type]['status'] = latest_status[
-                        'status'
-                    ]
-                    break
-                elapsed = time.time() - start
-                sleep_time = np.min(
-                    [timeout - elapsed, backoff_factor * (2**num_tries), max_sleep_time]
-                )
-                num_tries += 1
-                logger.debug(
-                    "Execution %s is running for %s[s] and now Going to sleep %s[s]",
-                    execution_id,
-                    elapsed,
-                    sleep_time,
-                )
-                time.sleep(sleep_time)
-
-            if elapsed >= timeout:
+            if latest_status is None:
                 raise TimeoutError(
                     f"execution wait() got timeout. id: {execution_id}, status: {self.execution_running[exec_type]['status']}, progress {self.execution_running[exec_type]['progress']}%"
                 )
-            if self.execution_running[exec_type]['status'] != 'success':
+            if latest_status['status'] != 'success':
+                self.execution_running[exec_type]['status'] = latest_status['status']
                 raise dl.exceptions.PlatformException(
                     error='424', message=f"Execution {execution_id}"
                 )
@@ -315,21 +1288,25 @@ class Exporter(ExportBase):
             raise
 
     def quality_score(
-        self, qtype, min_v, max_v, limit=0, pagination=100, return_ids=False
+        self, qtype, min_v, max_v, limit=0, pagination=0, return_ids=False
     ):
         """
         Calculate the quality score of items in the dataset based on specified criteria.
 
+        The scores captured from the export are sorted once, so the counts and pages are answered
+        in memory. Datasets restored from a store written without the scores are queried on the platform.
+
         Parameters:
         - qtype (str): The type of quality score to filter by. Supported values are 'Darkness/Brightness' and 'Blurriness/Sharpness'.
-        - min_v (float): The minimum value for the quality score filter.
-        - max_v (float): The maximum value for the quality score filter.
-        - limit (int, optional): The maximum number of items to return. Default is 0 (no limit).
-        - pagination (int, optional): The number of items to return per page. Default is 100.
+        - min_v (float): The minimum value for the quality score filter, exclusive.
+        - max_v (float): The maximum value for the quality score filter, exclusive.
+        - limit (int, optional): The number of items per page. Default is 0 (all of them).
+        - pagination (int, optional): The index of the page to return. Default is 0.
         - return_ids (bool, optional): Whether to return item IDs and metadata. Default is False.
 
         Returns:
-        - tuple: If return_ids is True, returns a tuple containing the count of items and a list of dictionaries with item metadata.
+        - tuple: If return_ids is True, returns a tuple containing the count of items and a list of dictionaries with item metadata,
+             by ascending score.
              If return_ids is False, returns the count of items.
 
         Raises:
@@ -339,19 +1316,208 @@ class Exporter(ExportBase):
         - If the specified quality type is not supported, an error is logged and the function returns 0 or an empty list based on return_ids.
         """
 
-        dataset = self.dataset
-        items_count = 0
-        if qtype == 'Darkness/Brightness':
-            metadata_field = 'metadata.user.quality_scores.darkness_score'
-        elif qtype == 'Blurriness/Sharpness':
-            metadata_field = 'metadata.user.quality_scores.blurriness_score'
-        else:
+        if qtype not in QUALITY_TYPES:
             logger.error("Quality type %s not supported", qtype)
             if return_ids:
                 return 0, []
             else:
                 return 0
 
+        scores = self.quality_scores.get(qtype)
+        if scores is None:
+            with QUALITY_PLATFORM_SECONDS.time(return_ids=str(bool(return_ids)).lower()):
+                return self.platform_quality_score(
+                    qtype, min_v, max_v, limit, pagination, return_ids
+                )
+        if not return_ids:
+            return scores.count(min_v, max_v)
+        total, rows = scores.between(
+            min_v, max_v, offset=pagination * max(limit, 0), limit=limit
+        )
+        ids = [self.items.record(row) for row in rows.tolist()]
+        return total, ids
+
+    def quality_rows(self, qtype, min_v, max_v, limit=0, pagination=0):
+        """
+        Retrieves a page of the item table rows of the items in a quality score range, by ascending score.
+
+        Args:
+            qtype (str): The quality type.
+            min_v (float): The minimum score, exclusive.
+            max_v (float): The maximum score, exclusive.
+            limit (int): The number of items per page, 0 for all of them.
+            pagination (int): The index of the page.
+
+        Returns:
+            tuple: The number of items in the range and the rows of the page, or None when the
+                   scores were not exported and are queried on the platform.
+        """
+        scores = self.quality_scores.get(qtype)
+        if scores is None:
+            return None
+        return scores.between(min_v, max_v, offset=pagination * max(limit, 0), limit=limit)
+
+    def quality_histogram(self, qtype, bins=20):
+        """
+        Counts the exported items in equal width quality score bins between 0 and 1, for the panel slider.
+
+        Args:
+            qtype (str): The quality type, 'Darkness/Brightness' or 'Blurriness/Sharpness'.
+            bins (int): The number of bins.
+
+        Returns:
+            dict: The bin 'counts', the bin 'edges' and the 'total' number of scored items,
+                  or None if the type is not supported or no scores were exported.
+        """
+        scores = self.quality_scores.get(qtype)
+        if scores is None:
+            return None
+        counts, edges = scores.histogram(bins)
+        return {'counts': counts.tolist(), 'edges': edges.tolist(), 'total': len(scores)}
+
+    def similarity_curve(self, key, bins=30):
+        """
+        Counts the single linkage clusters and duplicates at equally spaced similarity thresholds
+        between 0 and GRAPH_MAX_DISTANCE, for the panel slider.
+
+        The counts are those of the `linkage` clustering. With the default `greedy` clustering the
+        panel shows other clusters: a linkage cluster chains the items connected within the
+        threshold, which the greedy clustering splits, so the curve shows the trend of the slider
+        rather than its exact counts.
+
+        Args:
+            key (str): The feature set name.
+            bins (int): The number of intervals between the thresholds.
+
+        Returns:
+            dict: The 'thresholds', the number of 'clusters' of at least two items and of 'duplicates',
+                  the clustered items that are not the first of their cluster, at every threshold, and
+                  the 'total' number of items, or None if the feature set was not exported.
+        """
+        hierarchy = self.hierarchy(key)
+        if hierarchy is None:
+            return None
+        thresholds = np.linspace(0.0, GRAPH_MAX_DISTANCE, max(int(bins), 1) + 1)
+        clusters, duplicates = hierarchy.curve(thresholds)
+        return {
+            'thresholds': thresholds.tolist(),
+            'clusters': clusters.tolist(),
+            'duplicates': duplicates.tolist(),
+            'total': len(hierarchy),
+            'clustering': CLUSTERING_LINKAGE,
+        }
+
+    def search_index(self, key):
+        """
+        Returns the faiss index of a feature set to search other vectors against.
+
+        The index built by the last export is read from the index store, memory-mapped when
+        the index type allows it. It is only built again, from the vectors, when it was not stored.
+        It is kept in the results cache until the next export.
+
+        Args:
+            key (str): The feature set name.
+
+        Returns:
+            tuple: The index, the index label of every vector and the IndexBackend it was built with.
+        """
+        cache_key = ('SearchIndex', self.data_version, key)
+        cached = self.results_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        feature_set = self.feature_sets_export[key]
+        stored = self.stored_feature_sets.get(key)
+        index = None
+        if stored is not None:
+            index = self.index_store.load_index(stored.path)
+        if index is not None:
+            labels = stored.labels
+            # entries stored before the backends were recorded are HNSW indexes
+            backend = BACKENDS[(stored.info or {}).get('backend', BACKEND_HNSW)]
+            nbytes = sum(os.path.getsize(path) for path in index_files(stored.path))
+        else:
+            logger.info("Feature set %s has no stored index, indexing it again", key)
+            backend = self.select_backend(len(feature_set))
+            index = backend.build(
+                feature_set.decoded, feature_set.storage.scalar_quantizer
+            )
+            add_chunked(index, feature_set.decoded)
+            labels = np.arange(len(feature_set), dtype=np.int64)
+            nbytes = feature_set.vectors.nbytes
+        entry = (index, labels, backend)
+        self.results_cache.put(cache_key, entry, nbytes)
+        return entry
+
+    def cross_duplicates(self, key, target, threshold, k):
+        """
+        Finds the items of a feature set that have near duplicates in the same feature set of
+        another dataset, for example the test items leaked into a train dataset.
+
+        The vectors of this dataset are searched in chunks against the stored index of the
+        target, neither dataset is exported again.
+
+        Args:
+            key (str): The feature set name, in both datasets.
+            target (Exporter): The exporter of the dataset searched against, possibly this one.
+            threshold (float): The maximum distance of a near duplicate.
+            k (int): The maximum number of near duplicates of every item.
+
+        Returns:
+            CrossMatches: The items with near duplicates, by ascending distance of their nearest one.
+
+        Raises:
+            KeyError: If a dataset has no such feature set.
+            ValueError: If the vectors of the two feature sets cannot be compared.
+        """
+        source_set = self.feature_sets_export[key]
+        target_set = target.feature_sets_export[key]
+        source_storage, target_storage = source_set.storage, target_set.storage
+        if source_set.decoded.shape[1] != target_set.decoded.shape[1] or (
+            STORAGE_PCA in (source_storage.name, target_storage.name)
+            and not (
+                source_storage.name == target_storage.name
+                and np.array_equal(source_storage.mean, target_storage.mean)
+                and np.array_equal(
+                    source_storage.components, target_storage.components
+                )
+            )
+        ):
+            raise ValueError(
+                f"The {key} vectors of the two datasets are not in the same space"
+            )
+        index, labels, backend = target.search_index(key)
+        start = time.perf_counter()
+        matches = cross_matches(
+            index,
+            labels,
+            backend,
+            source_set.decoded,
+            target_set.decoded,
+            threshold,
+            k,
+            exclude_self=target is self,
+        )
+        logger.info(
+            "Searched %d items of %s against %d items of %s in %.1f[s]: %d with near duplicates",
+            len(source_set),
+            self.dataset.id,
+            len(target_set),
+            target.dataset.id,
+            time.perf_counter() - start,
+            len(matches),
+        )
+        return matches
+
+    def platform_quality_score(
+        self, qtype, min_v, max_v, limit=0, pagination=0, return_ids=False
+    ):
+        """
+        Filters the items of the dataset on the platform by quality score, see `quality_score`.
+        """
+        dataset = self.dataset
+        items_count = 0
+        metadata_field = f'metadata.user.quality_scores.{QUALITY_TYPES[qtype]}'
+
         filters = dl.Filters()
         filters.add(
             field=metadata_field,
@@ -373,7 +1539,10 @@ class Exporter(ExportBase):
                     }
                     for item in items
                 ]
-                return len(ids), ids
+                total = len(ids)
+                if limit > 0:
+                    ids = ids[pagination * limit : (pagination + 1) * limit]
+                return total, ids
             else:
                 items = dataset.items.list(filters=filters)
                 items_count = items.items_count
@@ -0,0 +1,135 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('[GRAPH]')
+logging.basicConfig(level='INFO')
+
+# the neighbour graph modes, a fixed number of neighbours per item or every neighbour within a radius
+GRAPH_KNN = 'knn'
+GRAPH_RANGE = 'range'
+
+
+class NeighbourGraph:
+    """
+    A sparse neighbour graph in CSR layout, keeping only the edges within a maximum distance.
+
+    Attributes
+    ----------
+    offsets : np.ndarray
+        An int64 array of N + 1 offsets, the edges of item i are at offsets[i]:offsets[i + 1].
+    indices : np.ndarray
+        The int32 neighbour item index of every edge.
+    distance : np.ndarray
+        The float32 distance of every edge, sorted by ascending distance within every row.
+
+    Methods
+    -------
+    from_rows(lengths, indices, distance, first_row=0)
+        Builds a graph from the unsorted edges of consecutive rows.
+    concatenate(graphs)
+        Stacks the graphs of consecutive chunks of items.
+    cutoff_lengths(threshold)
+        Counts the neighbours within a threshold of every item.
+    gather(rows, columns)
+        Returns the neighbour at a column of a row.
+    """
+
+    def __init__(self, offsets, indices, distance):
+        self.offsets = offsets
+        self.indices = indices
+        self.distance = distance
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.indices.nbytes + self.distance.nbytes
+
+    @classmethod
+    def from_rows(cls, lengths, indices, distance, first_row=0):
+        """
+        Builds a graph from edges grouped by row, sorting every row by ascending distance.
+
+        The item itself comes first among the edges at the same distance, the exact duplicates
+        of an item are at distance zero too, as in the kNN rows, then the edges are ordered by
+        neighbour whatever order the search returned them in.
+
+        Args:
+            lengths (np.ndarray): The number of edges of every row.
+            indices (np.ndarray): The neighbour of every edge, one row after the other.
+            distance (np.ndarray): The distance of every edge.
+            first_row (int): The item index of the first row, when the rows are a chunk of the items.
+
+        Returns:
+            NeighbourGraph: The graph.
+        """
+        # faiss returns the range search limits as uint64
+        lengths = np.asarray(lengths, dtype=np.int64)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        indices = np.asarray(indices)
+        order = np.lexsort((indices, indices != rows + first_row, distance, rows))
+        return cls(
+            offsets,
+            np.asarray(indices, dtype=np.int32)[order],
+            np.asarray(distance, dtype=np.float32)[order],
+        )
+
+    @classmethod
+    def concatenate(cls, graphs):
+        """
+        Stacks the rows of several graphs built over consecutive chunks of items.
+
+        Args:
+            graphs (list): The NeighbourGraph of every chunk, in item order.
+
+        Returns:
+            NeighbourGraph: The graph of all the items.
+        """
+        if not graphs:
+            return cls(
+                np.zeros(1, dtype=np.int64),
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.float32),
+            )
+        lengths = np.concatenate([np.diff(graph.offsets) for graph in graphs])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(
+            offsets,
+            np.concatenate([graph.indices for graph in graphs]),
+            np.concatenate([graph.distance for graph in graphs]),
+        )
+
+    def cutoff_lengths(self, threshold):
+        """
+        Counts, for every item, the neighbours within the threshold.
+
+        Rows are sorted by ascending distance, so the count is the length of the row prefix
+        within the threshold.
+
+        Args:
+            threshold (float): The maximum distance of a neighbour to be counted.
+
+        Returns:
+            np.ndarray: An (N,) int64 array with the number of neighbours within the threshold.
+        """
+        within = np.zeros(len(self.distance) + 1, dtype=np.int64)
+        np.cumsum(self.distance <= threshold, out=within[1:])
+        return within[self.offsets[1:]] - within[self.offsets[:-1]]
+
+    def gather(self, rows, columns):
+        """
+        Looks up neighbours by row and position in the row.
+
+        Args:
+            rows (np.ndarray): The item indices.
+            columns (np.ndarray): The position of the neighbour in every row.
+
+        Returns:
+            np.ndarray: The neighbour item indices.
+        """
+        return self.indices[self.offsets[rows] + columns]
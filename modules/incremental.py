@@ -0,0 +1,209 @@
+import logging
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger('[INCREMENTAL]')
+logging.basicConfig(level='INFO')
+
+# rows compared or searched at once, to bound the temporary matrices
+CHUNK_ROWS = 65536
+# distance and index of a missing neighbour, as returned by faiss
+MISSING_DISTANCE = np.finfo(np.float32).max
+MISSING_INDEX = -1
+# added vectors the other rows are compared to exactly, more are indexed in a HNSW graph
+ADDED_EXACT_MAX = 16384
+
+
+class FeatureSetDelta:
+    """
+    How the vectors of a feature set changed between two exports.
+
+    A vector is unchanged when an item with the same id had the exact same vector in the
+    previous export, a changed vector counts as removed and added.
+
+    Attributes
+    ----------
+    new_to_old : np.ndarray
+        For every new position, the old position of the same unchanged vector, or -1 if it was added.
+    old_to_new : np.ndarray
+        For every old position, the new position of the same unchanged vector, or -1 if it was removed.
+    added : np.ndarray
+        The new positions of the added vectors.
+    removed : np.ndarray
+        The old positions of the removed vectors.
+    """
+
+    def __init__(self, new_to_old, n_old):
+        self.new_to_old = new_to_old
+        unchanged = np.flatnonzero(new_to_old >= 0)
+        self.old_to_new = np.full(n_old, -1, dtype=np.int64)
+        self.old_to_new[new_to_old[unchanged]] = unchanged
+        self.added = np.flatnonzero(new_to_old < 0)
+        self.removed = np.flatnonzero(self.old_to_new < 0)
+
+    @property
+    def churn(self):
+        """
+        The number of added and removed vectors relative to the size of the new export.
+        """
+        return (len(self.added) + len(self.removed)) / max(len(self.new_to_old), 1)
+
+
+def diff_feature_sets(old, new):
+    """
+    Matches the vectors of a feature set between two exports.
+
+    Args:
+        old (FeatureSetColumns): The feature set of the previous export.
+        new (FeatureSetColumns): The feature set of the new export.
+
+    Returns:
+        FeatureSetDelta: The delta between the exports.
+    """
+    old_positions = {old.items.ids[row]: i for i, row in enumerate(old.rows.tolist())}
+    candidates = np.fromiter(
+        (old_positions.get(new.items.ids[row], -1) for row in new.rows.tolist()),
+        dtype=np.int64,
+        count=len(new),
+    )
+    new_to_old = np.full(len(new), -1, dtype=np.int64)
+    matched = np.flatnonzero(candidates >= 0)
+    for start in range(0, len(matched), CHUNK_ROWS):
+        chunk = matched[start : start + CHUNK_ROWS]
+        same = np.all(old.vectors[candidates[chunk]] == new.vectors[chunk], axis=1)
+        new_to_old[chunk[same]] = candidates[chunk[same]]
+    return FeatureSetDelta(new_to_old, len(old))
+
+
+def _search(index, label_to_position, vectors, k):
+    """
+    Searches vectors against an index holding removed vectors, keeping the k nearest live ones.
+
+    The rows with fewer than k live neighbours among the candidates, because removed vectors
+    were closer, are searched again with twice the candidates until they are full.
+    """
+    n_live = np.count_nonzero(label_to_position >= 0)
+    n_dead = index.ntotal - n_live
+    expected = min(k, n_live)
+    search_k = min(index.ntotal, k + min(n_dead, k))
+    distance = np.full((len(vectors), k), MISSING_DISTANCE, dtype=np.float32)
+    indices = np.full((len(vectors), k), MISSING_INDEX, dtype=np.int64)
+    pending = np.arange(len(vectors))
+    while len(pending) > 0:
+        short = []
+        for start in range(0, len(pending), CHUNK_ROWS):
+            rows = pending[start : start + CHUNK_ROWS]
+            found_distance, labels = index.search(
+                np.ascontiguousarray(vectors[rows]), search_k
+            )
+            positions = np.where(
+                labels >= 0, label_to_position[np.maximum(labels, 0)], -1
+            )
+            # move the live neighbours first, keeping their distance order
+            order = np.argsort(positions < 0, axis=1, kind='stable')[:, :k]
+            positions = np.take_along_axis(positions, order, axis=1)
+            found_distance = np.take_along_axis(found_distance, order, axis=1)
+            live = positions >= 0
+            width = positions.shape[1]
+            distance[rows, :width] = np.where(live, found_distance, MISSING_DISTANCE)
+            indices[rows, :width] = np.where(live, positions, MISSING_INDEX)
+            short.append(rows[np.count_nonzero(live, axis=1) < expected])
+        if search_k >= index.ntotal:
+            break
+        pending = np.concatenate(short)
+        search_k = min(index.ntotal, 2 * search_k)
+    return distance, indices
+
+
+def _nearest_distance(targets, vectors):
+    """
+    Returns the squared L2 distance from every vector to its nearest target.
+    """
+    if len(targets) > ADDED_EXACT_MAX:
+        index = faiss.IndexHNSWFlat(targets.shape[1], 32)
+    else:
+        index = faiss.IndexFlatL2(targets.shape[1])
+    index.add(np.ascontiguousarray(targets, dtype=np.float32))
+    nearest = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = np.ascontiguousarray(
+            vectors[start : start + CHUNK_ROWS], dtype=np.float32
+        )
+        nearest[start : start + len(chunk)] = index.search(chunk, 1)[0][:, 0]
+    return nearest
+
+
+def update_knn(index, old_labels, delta, old_distance, old_indices, vectors):
+    """
+    Updates an index and the kNN graph of a feature set with the delta of a new export.
+
+    The added vectors are appended to the index, the removed ones stay in it but are filtered
+    out of the results. Only the rows of the added items, of the items that had a removed
+    neighbour and of the items an added vector is closer to than their current farthest
+    neighbour are searched again, the other rows are copied from the previous graph.
+
+    Args:
+        index (faiss.Index): The writable index of the previous export, updated in place.
+        old_labels (np.ndarray): The index label of every vector of the previous export.
+        delta (FeatureSetDelta): The delta between the exports.
+        old_distance (np.ndarray): The (N_old, k) neighbour distances of the previous export.
+        old_indices (np.ndarray): The (N_old, k) neighbour indices of the previous export.
+        vectors (np.ndarray): The (N_new, dimension) normalized vectors of the new export.
+
+    Returns:
+        tuple: The index label of every new vector, the (N_new, k) neighbour distances and indices,
+               and the number of refreshed rows.
+    """
+    k = old_distance.shape[1]
+    n_new = len(vectors)
+    first_label = index.ntotal
+    if len(delta.added) > 0:
+        index.add(np.ascontiguousarray(vectors[delta.added]))
+
+    unchanged = np.flatnonzero(delta.new_to_old >= 0)
+    labels = np.empty(n_new, dtype=np.int64)
+    labels[unchanged] = old_labels[delta.new_to_old[unchanged]]
+    labels[delta.added] = first_label + np.arange(len(delta.added))
+    label_to_position = np.full(index.ntotal, -1, dtype=np.int64)
+    label_to_position[labels] = np.arange(n_new)
+
+    # the added items, and the items that lost a neighbour
+    refresh = np.zeros(n_new, dtype=bool)
+    refresh[delta.added] = True
+    for start in range(0, len(unchanged), CHUNK_ROWS):
+        rows = unchanged[start : start + CHUNK_ROWS]
+        neighbours = old_indices[delta.new_to_old[rows]]
+        lost = (neighbours >= 0) & (delta.old_to_new[np.maximum(neighbours, 0)] < 0)
+        refresh[rows[lost.any(axis=1)]] = True
+
+    added_distance, added_indices = _search(
+        index, label_to_position, vectors[delta.added], k
+    )
+    # the items an added vector got closer to than their current farthest neighbour, which
+    # are not always among the neighbours of the added vector
+    if len(delta.added) > 0:
+        nearest = _nearest_distance(vectors[delta.added], vectors[unchanged])
+        farthest = old_distance[delta.new_to_old[unchanged], k - 1]
+        refresh[unchanged[nearest < farthest]] = True
+
+    distance = np.empty((n_new, k), dtype=np.float32)
+    indices = np.empty((n_new, k), dtype=np.int64)
+    kept = unchanged[~refresh[unchanged]]
+    for start in range(0, len(kept), CHUNK_ROWS):
+        rows = kept[start : start + CHUNK_ROWS]
+        old_rows = delta.new_to_old[rows]
+        neighbours = old_indices[old_rows]
+        distance[rows] = old_distance[old_rows]
+        indices[rows] = np.where(
+            neighbours >= 0, delta.old_to_new[np.maximum(neighbours, 0)], MISSING_INDEX
+        )
+    distance[delta.added] = added_distance
+    indices[delta.added] = added_indices
+
+    refreshed = np.flatnonzero(refresh)
+    others = refreshed[delta.new_to_old[refreshed] >= 0]
+    distance[others], indices[others] = _search(
+        index, label_to_position, vectors[others], k
+    )
+    return labels, distance, indices, len(refreshed)
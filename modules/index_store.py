@@ -0,0 +1,454 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import faiss
+import numpy as np
+
+from modules.columns import FeatureSetColumns, ItemTable, StringColumn
+from modules.graph import NeighbourGraph
+from modules.storage import STORAGE_FLOAT32, storage_from_state
+
+logger = logging.getLogger('[INDEX STORE]')
+logging.basicConfig(level='INFO')
+
+MANIFEST_FILE = 'manifest.json'
+INDEX_FILE = 'index.faiss'
+# the indexes of the shards of a sharded build, instead of INDEX_FILE
+INDEX_SHARD_FILE = 'index.{}.faiss'
+INFO_FILE = 'info.json'
+# the fitted encoding of compressed vectors, absent for float32 vectors
+STORAGE_FILE = 'storage.npz'
+ITEM_COLUMNS = ('ids', 'names', 'thumbnails')
+GRAPH_ARRAYS = ('offsets', 'indices', 'distance')
+# the item quality scores are stored as quality.<score name>.npy next to the item columns
+QUALITY_PREFIX = 'quality.'
+
+
+def _atomic_dir(path):
+    """
+    Creates a temporary directory next to `path` to be renamed into it once fully written.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+
+
+def index_files(path):
+    """
+    Lists the faiss index files of a stored feature set.
+
+    Args:
+        path (str): The directory of the stored feature set.
+
+    Returns:
+        list: The path of its index, or of the index of every shard in order, empty if it has none.
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    if os.path.isfile(index_path):
+        return [index_path]
+    paths = []
+    while os.path.isfile(os.path.join(path, INDEX_SHARD_FILE.format(len(paths)))):
+        paths.append(os.path.join(path, INDEX_SHARD_FILE.format(len(paths))))
+    return paths
+
+
+def _read_index(path, writable=False):
+    if writable:
+        return faiss.read_index(path)
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # not every index type can be memory-mapped
+        return faiss.read_index(path)
+
+
+def _publish_dir(tmp_path, path):
+    if os.path.isdir(path):
+        # another export already stored the same content
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    os.replace(tmp_path, path)
+
+
+class StoredFeatureSet:
+    """
+    A feature set read back from the store, all the arrays are memory-mapped read only.
+
+    Attributes
+    ----------
+    feature_set : FeatureSetColumns
+        The item rows and normalized vectors.
+    distance : np.ndarray
+        The (N, k) neighbour distances.
+    indices : np.ndarray
+        The (N, k) neighbour indices.
+    path : str
+        The directory of the stored feature set, holding the faiss index.
+    fingerprint : str
+        The content fingerprint of the feature set.
+    labels : np.ndarray
+        The faiss index label of every vector, the identity unless the index was updated incrementally.
+    graph : NeighbourGraph
+        The sparse neighbour graph within the maximum distance, None if only the kNN graph was stored.
+    info : dict
+        The index backend, parameters and build time of the entry, None if not recorded.
+    """
+
+    def __init__(
+        self,
+        feature_set,
+        distance,
+        indices,
+        path,
+        fingerprint,
+        labels,
+        graph=None,
+        info=None,
+    ):
+        self.feature_set = feature_set
+        self.distance = distance
+        self.indices = indices
+        self.path = path
+        self.fingerprint = fingerprint
+        self.labels = labels
+        self.graph = graph
+        self.info = info
+
+
+class IndexStore:
+    """
+    A local on disk cache of the exported vectors, faiss indexes and kNN graphs.
+
+    Entries live under `<root>/<dataset id>/<feature set id>/<fingerprint>/`, the fingerprint
+    being a hash of the feature set content and of the index parameters, so an entry is valid
+    as long as its directory exists. A per dataset manifest points at the latest entries and
+    item table, for the dataset to be restored after a restart without any export.
+
+    Methods
+    -------
+    fingerprint(items, feature_set, params)
+        Computes the content fingerprint of a feature set.
+    save(dataset_id, feature_set, fingerprint, distance, indices, index, labels=None, graph=None, info=None)
+        Writes a feature set and its kNN graph and index.
+    load(dataset_id, items, feature_set_id, fingerprint)
+        Memory-maps a stored feature set, or returns None.
+    load_index(path, writable=False)
+        Reads a stored faiss index, memory-mapping it when read only and the index type allows it.
+    save_manifest(dataset_id, items, entries)
+        Writes the item table and the latest entries of a dataset.
+    restore(dataset_id)
+        Memory-maps the latest stored state of a dataset, or returns None.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def _feature_set_dir(self, dataset_id, feature_set_id, fingerprint):
+        return os.path.join(self.root, dataset_id, str(feature_set_id), fingerprint)
+
+    def _items_dir(self, dataset_id, fingerprint):
+        return os.path.join(self.root, dataset_id, 'items', fingerprint)
+
+    @staticmethod
+    def _items_fingerprint(items):
+        digest = hashlib.blake2b(digest_size=16)
+        for name in ITEM_COLUMNS:
+            column = getattr(items, name)
+            digest.update(column.offsets.tobytes())
+            digest.update(column.data)
+        digest.update(items.annotated.tobytes())
+        for name, scores in sorted(items.quality_scores.items()):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(scores).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def fingerprint(items, feature_set, params):
+        """
+        Computes the content fingerprint of a feature set.
+
+        Args:
+            items (ItemTable): The item table the feature set rows point to.
+            feature_set (FeatureSetColumns): The feature set.
+            params (dict): The parameters the kNN graph is built with.
+
+        Returns:
+            str: A hex digest of the item ids, vectors and parameters.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        digest.update(items.ids.offsets.tobytes())
+        digest.update(items.ids.data)
+        digest.update(feature_set.rows.tobytes())
+        digest.update(np.ascontiguousarray(feature_set.vectors).data)
+        return digest.hexdigest()
+
+    def save(
+        self,
+        dataset_id,
+        feature_set,
+        fingerprint,
+        distance,
+        indices,
+        index,
+        labels=None,
+        graph=None,
+        info=None,
+    ):
+        """
+        Writes a feature set, its kNN graph and its faiss index, unless already stored.
+
+        Older entries of the same feature set are removed.
+
+        Args:
+            dataset_id (str): The dataset id.
+            feature_set (FeatureSetColumns): The feature set.
+            fingerprint (str): The content fingerprint of the feature set.
+            distance (np.ndarray): The (N, k) neighbour distances.
+            indices (np.ndarray): The (N, k) neighbour indices.
+            index (faiss.Index): The faiss index of the vectors, None to skip it. The shards of a
+                                 faiss.IndexShards are stored one file each.
+            labels (np.ndarray, optional): The index label of every vector, when not the identity.
+            graph (NeighbourGraph, optional): The sparse neighbour graph of the vectors.
+            info (dict, optional): The index backend, parameters and build time, JSON serializable.
+        """
+        path = self._feature_set_dir(dataset_id, feature_set.feature_set_id, fingerprint)
+        if os.path.isdir(path):
+            return
+        tmp_path = _atomic_dir(path)
+        try:
+            np.save(os.path.join(tmp_path, 'rows.npy'), feature_set.rows)
+            np.save(os.path.join(tmp_path, 'vectors.npy'), feature_set.vectors)
+            if feature_set.storage.name != STORAGE_FLOAT32:
+                np.savez(
+                    os.path.join(tmp_path, STORAGE_FILE), **feature_set.storage.state()
+                )
+            np.save(os.path.join(tmp_path, 'distance.npy'), distance)
+            np.save(os.path.join(tmp_path, 'indices.npy'), indices)
+            if labels is not None:
+                np.save(os.path.join(tmp_path, 'labels.npy'), labels)
+            if graph is not None:
+                for name in GRAPH_ARRAYS:
+                    np.save(
+                        os.path.join(tmp_path, f'graph.{name}.npy'), getattr(graph, name)
+                    )
+            if isinstance(index, faiss.IndexShards):
+                for shard in range(index.count()):
+                    faiss.write_index(
+                        index.at(shard),
+                        os.path.join(tmp_path, INDEX_SHARD_FILE.format(shard)),
+                    )
+            elif index is not None:
+                faiss.write_index(index, os.path.join(tmp_path, INDEX_FILE))
+            if info is not None:
+                with open(os.path.join(tmp_path, INFO_FILE), 'w') as f:
+                    json.dump(info, f)
+            _publish_dir(tmp_path, path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        parent = os.path.dirname(path)
+        for name in os.listdir(parent):
+            if name != fingerprint and not name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        logger.info("Stored feature set %s of dataset %s", feature_set.feature_set_id, dataset_id)
+
+    def load(self, dataset_id, items, feature_set_id, fingerprint):
+        """
+        Memory-maps a stored feature set.
+
+        Args:
+            dataset_id (str): The dataset id.
+            items (ItemTable): The item table the stored rows point to.
+            feature_set_id (str): The feature set id.
+            fingerprint (str): The content fingerprint of the feature set.
+
+        Returns:
+            StoredFeatureSet: The stored feature set, or None if it is not in the store.
+        """
+        path = self._feature_set_dir(dataset_id, feature_set_id, fingerprint)
+        if not os.path.isdir(path):
+            return None
+        try:
+            storage = None
+            storage_path = os.path.join(path, STORAGE_FILE)
+            if os.path.isfile(storage_path):
+                with np.load(storage_path) as state:
+                    storage = storage_from_state(dict(state))
+            feature_set = FeatureSetColumns(
+                items,
+                np.load(os.path.join(path, 'rows.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+                feature_set_id=feature_set_id,
+                storage=storage,
+            )
+            labels_path = os.path.join(path, 'labels.npy')
+            if os.path.isfile(labels_path):
+                labels = np.load(labels_path, mmap_mode='r')
+            else:
+                labels = np.arange(len(feature_set), dtype=np.int64)
+            graph = None
+            if os.path.isfile(os.path.join(path, 'graph.offsets.npy')):
+                graph = NeighbourGraph(
+                    *(
+                        np.load(os.path.join(path, f'graph.{name}.npy'), mmap_mode='r')
+                        for name in GRAPH_ARRAYS
+                    )
+                )
+            info = None
+            info_path = os.path.join(path, INFO_FILE)
+            if os.path.isfile(info_path):
+                with open(info_path) as f:
+                    info = json.load(f)
+            return StoredFeatureSet(
+                feature_set,
+                np.load(os.path.join(path, 'distance.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'indices.npy'), mmap_mode='r'),
+                path,
+                fingerprint,
+                labels,
+                graph,
+                info,
+            )
+        except (OSError, ValueError) as e:
+            logger.warning("Dropping unreadable stored feature set %s: %s", path, e)
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+    @staticmethod
+    def load_index(path, writable=False):
+        """
+        Reads the faiss index of a stored feature set.
+
+        Args:
+            path (str): The directory of the stored feature set.
+            writable (bool): Whether the index is going to be updated, then it is read in memory.
+
+        Returns:
+            faiss.Index: The index, a faiss.IndexShards of the shards of a sharded build, or None
+                         if it was not stored.
+        """
+        paths = index_files(path)
+        if not paths:
+            return None
+        if os.path.basename(paths[0]) == INDEX_FILE:
+            return _read_index(paths[0], writable)
+        shards = [_read_index(shard_path, writable) for shard_path in paths]
+        index = faiss.IndexShards(shards[0].d, False, True)
+        for shard in shards:
+            index.add_shard(shard)
+        # the shards return ascending squared L2 distances whatever their metric flag
+        index.metric_type = faiss.METRIC_L2
+        return index
+
+    def save_manifest(self, dataset_id, items, entries):
+        """
+        Writes the item table of a dataset and the manifest of its latest feature sets.
+
+        Args:
+            dataset_id (str): The dataset id.
+            items (ItemTable): The item table of the dataset.
+            entries (dict): The feature set name to {'id': feature set id, 'fingerprint': str} mapping.
+        """
+        items_fingerprint = self._items_fingerprint(items)
+        path = self._items_dir(dataset_id, items_fingerprint)
+        if not os.path.isdir(path):
+            tmp_path = _atomic_dir(path)
+            try:
+                for name in ITEM_COLUMNS:
+                    column = getattr(items, name)
+                    np.save(
+                        os.path.join(tmp_path, f'{name}.data.npy'),
+                        np.frombuffer(column.data, dtype=np.uint8),
+                    )
+                    np.save(
+                        os.path.join(tmp_path, f'{name}.offsets.npy'), column.offsets
+                    )
+                np.save(os.path.join(tmp_path, 'annotated.npy'), items.annotated)
+                for name, scores in items.quality_scores.items():
+                    np.save(
+                        os.path.join(tmp_path, f'{QUALITY_PREFIX}{name}.npy'), scores
+                    )
+                _publish_dir(tmp_path, path)
+            except Exception:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+
+        manifest = {
+            'items': items_fingerprint,
+            'feature_sets': entries,
+            'saved_at': time.time(),
+        }
+        manifest_path = os.path.join(self.root, dataset_id, MANIFEST_FILE)
+        try:
+            with open(manifest_path + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_path + '.tmp', manifest_path)
+        except Exception:
+            if os.path.exists(manifest_path + '.tmp'):
+                os.remove(manifest_path + '.tmp')
+            raise
+
+        parent = os.path.dirname(path)
+        for name in os.listdir(parent):
+            if name != items_fingerprint and not name.startswith('.tmp-'):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+    def restore(self, dataset_id):
+        """
+        Memory-maps the latest stored item table and feature sets of a dataset.
+
+        Args:
+            dataset_id (str): The dataset id.
+
+        Returns:
+            tuple: The ItemTable and a dictionary of feature set name to StoredFeatureSet,
+                   or None if nothing complete is stored for the dataset.
+        """
+        manifest_path = os.path.join(self.root, dataset_id, MANIFEST_FILE)
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            path = self._items_dir(dataset_id, manifest['items'])
+            columns = {
+                name: StringColumn.from_buffers(
+                    np.load(os.path.join(path, f'{name}.data.npy'), mmap_mode='r'),
+                    np.load(os.path.join(path, f'{name}.offsets.npy'), mmap_mode='r'),
+                )
+                for name in ITEM_COLUMNS
+            }
+            quality_scores = {
+                name[len(QUALITY_PREFIX) : -len('.npy')]: np.load(
+                    os.path.join(path, name), mmap_mode='r'
+                )
+                for name in os.listdir(path)
+                if name.startswith(QUALITY_PREFIX)
+            }
+            items = ItemTable.from_columns(
+                annotated=np.load(os.path.join(path, 'annotated.npy'), mmap_mode='r'),
+                quality_scores=quality_scores,
+                **columns,
+            )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Cannot restore dataset %s from the store: %s", dataset_id, e)
+            return None
+
+        stored = {}
+        for key, entry in manifest['feature_sets'].items():
+            feature_set = self.load(dataset_id, items, entry['id'], entry['fingerprint'])
+            if feature_set is None:
+                return None
+            stored[key] = feature_set
+        return items, stored
@@ -0,0 +1,158 @@
+import logging
+
+import numpy as np
+
+from modules.clustering import run_ranks
+
+logger = logging.getLogger('[LEAKAGE]')
+logging.basicConfig(level='INFO')
+
+# source vectors searched against the target index at once
+CHUNK_ROWS = 4096
+
+
+class CrossMatches:
+    """
+    The items of a source feature set that have near duplicates in a target feature set.
+
+    Only the pairs within the threshold are kept, so the memory grows with the number of
+    matches, never with the product of the two dataset sizes.
+
+    Attributes
+    ----------
+    sources : np.ndarray
+        The source item indices with at least one match, by ascending distance of their nearest match.
+    offsets : np.ndarray
+        The len(sources) + 1 offsets of the matches of every source item in `targets`.
+    targets : np.ndarray
+        The target item indices of the matches, by ascending distance within every source item.
+    distance : np.ndarray
+        The float32 distance of every match.
+
+    Methods
+    -------
+    matches(i)
+        Returns the target items and distances of the i-th source item.
+    """
+
+    def __init__(self, sources, offsets, targets, distance):
+        self.sources = sources
+        self.offsets = offsets
+        self.targets = targets
+        self.distance = distance
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def nbytes(self):
+        return (
+            self.sources.nbytes
+            + self.offsets.nbytes
+            + self.targets.nbytes
+            + self.distance.nbytes
+        )
+
+    def matches(self, i):
+        """
+        Returns the matches of a source item.
+
+        Args:
+            i (int): The position of the source item in `sources`.
+
+        Returns:
+            tuple: The target item indices and their distances.
+        """
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.targets[start:stop], self.distance[start:stop]
+
+
+class _LabelRows:
+    """
+    Reads the vectors of index labels, for the backends that re-rank their candidates.
+    """
+
+    def __init__(self, vectors, rows):
+        self.vectors = vectors
+        self.rows = rows
+
+    def __getitem__(self, labels):
+        return self.vectors[self.rows[labels]]
+
+
+def cross_matches(
+    index, labels, backend, queries, target_vectors, threshold, k, exclude_self=False
+):
+    """
+    Searches the source vectors against the index of a target feature set, keeping the matches within a threshold.
+
+    The source vectors are searched chunk by chunk. The index labels are mapped back to the
+    target items: removed vectors kept in an incrementally updated index are dropped, and a
+    label shared by a group of duplicates matches every item of the group. The nearest k
+    matches of every source item are kept, after the groups are expanded.
+
+    Args:
+        index (faiss.Index): The index of the target feature set.
+        labels (np.ndarray): The index label of every target item.
+        backend (IndexBackend): The backend the index was built with.
+        queries (np.ndarray): The float32 (N, dimension) source vectors, or their DecodedVectors.
+        target_vectors (np.ndarray): The float32 (M, dimension) target vectors, or their DecodedVectors.
+        threshold (float): The maximum distance of a match.
+        k (int): The maximum number of matches of every source item.
+        exclude_self (bool): Whether the source and target are the same feature set, an item
+                             then does not match itself and one more neighbour is searched.
+
+    Returns:
+        CrossMatches: The matches.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    label_order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[label_order]
+    # the first target item of every label, to re-rank against
+    first_rows = np.zeros(max(index.ntotal, len(labels), 1), dtype=np.int64)
+    first_rows[labels[::-1]] = np.arange(len(labels))[::-1]
+    label_vectors = _LabelRows(target_vectors, first_rows)
+    search_k = min(k + 1 if exclude_self else k, index.ntotal)
+
+    sources, targets, distances = [], [], []
+    if search_k > 0:
+        for start in range(0, len(queries), CHUNK_ROWS):
+            chunk = np.ascontiguousarray(queries[start : start + CHUNK_ROWS])
+            distance, found = backend.search(index, chunk, search_k, label_vectors)
+            rows, columns = np.nonzero((found >= 0) & (distance <= threshold))
+            found_labels = found[rows, columns]
+            lo = np.searchsorted(sorted_labels, found_labels, side='left')
+            sizes = np.searchsorted(sorted_labels, found_labels, side='right') - lo
+            sources.append(np.repeat(rows + start, sizes))
+            targets.append(label_order[np.repeat(lo, sizes) + run_ranks(sizes)])
+            distances.append(np.repeat(distance[rows, columns], sizes))
+    source = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+    target = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+    distance = (
+        np.concatenate(distances).astype(np.float32)
+        if distances
+        else np.empty(0, dtype=np.float32)
+    )
+    if exclude_self:
+        keep = source != target
+        source, target, distance = source[keep], target[keep], distance[keep]
+
+    # the matches of every source item by ascending distance, the items by their nearest match
+    order = np.lexsort((target, distance, source))
+    source, target, distance = source[order], target[order], distance[order]
+    is_first = np.ones(len(source), dtype=bool)
+    is_first[1:] = source[1:] != source[:-1]
+    starts = np.flatnonzero(is_first)
+    sizes = np.diff(np.append(starts, len(source)))
+    # a label expanded to its group of duplicates can give more than k matches
+    if len(sizes) and sizes.max() > k:
+        keep = run_ranks(sizes) < k
+        source, target, distance = source[keep], target[keep], distance[keep]
+        sizes = np.minimum(sizes, k)
+        starts = np.cumsum(sizes) - sizes
+    by_nearest = np.lexsort((source[starts], distance[starts]))
+    starts, sizes = starts[by_nearest], sizes[by_nearest]
+    rows = np.repeat(starts, sizes) + run_ranks(sizes)
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return CrossMatches(source[starts], offsets, target[rows], distance[rows])
@@ -0,0 +1,246 @@
+import logging
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+
+from modules.clustering import ClusterList, run_ranks
+
+logger = logging.getLogger('[LINKAGE]')
+logging.basicConfig(level='INFO')
+
+
+def knn_edges(distance, indices, max_distance):
+    """
+    Collects the edges of a kNN search within a maximum distance.
+
+    Args:
+        distance (np.ndarray): An (N, k) matrix of neighbour distances.
+        indices (np.ndarray): An (N, k) matrix of the neighbour item indices, -1 for no neighbour.
+        max_distance (float): The maximum distance of an edge.
+
+    Returns:
+        tuple: The first item, second item and float32 distance of every edge.
+    """
+    rows, columns = np.nonzero(distance <= max_distance)
+    neighbours = indices[rows, columns].astype(np.int64)
+    keep = (neighbours >= 0) & (neighbours != rows)
+    return rows[keep], neighbours[keep], distance[rows[keep], columns[keep]]
+
+
+def graph_edges(graph, max_distance):
+    """
+    Collects the edges of a sparse neighbour graph within a maximum distance.
+
+    Args:
+        graph (NeighbourGraph): The neighbour graph.
+        max_distance (float): The maximum distance of an edge.
+
+    Returns:
+        tuple: The first item, second item and float32 distance of every edge.
+    """
+    rows = np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+    keep = (graph.distance <= max_distance) & (graph.indices != rows)
+    return rows[keep], graph.indices[keep].astype(np.int64), graph.distance[keep]
+
+
+class LinkageHierarchy:
+    """
+    The single linkage hierarchy of the items of a feature set, answering the similarity
+    clusters of any threshold without going over the neighbour matrices.
+
+    The items are laid out in the leaf order of the hierarchy, where every single linkage
+    cluster, at every threshold, is a contiguous run. The distance at which two consecutive
+    items join is kept, sorted, so the clusters of a threshold are the runs of the joins within
+    it, found in time proportional to the clustered items.
+
+    Attributes
+    ----------
+    order : np.ndarray
+        The (N,) item indices in leaf order, the items with a neighbour within the maximum distance first.
+    gaps : np.ndarray
+        The (N - 1,) float32 distance at which every item joins the next one in leaf order, inf if never.
+    link_order : np.ndarray
+        The positions of the joins sorted by ascending distance.
+    sorted_gaps : np.ndarray
+        The distance of the joins in `link_order`.
+    sorted_pair_gaps : np.ndarray
+        The sorted distances at which two consecutive joins are both made, to count the clusters.
+
+    Methods
+    -------
+    from_edges(n, first, second, distance)
+        Builds the hierarchy of a neighbour graph.
+    clusters(threshold, min_size)
+        Returns the clusters of a threshold.
+    curve(thresholds)
+        Counts the clusters and duplicates of several thresholds.
+    """
+
+    def __init__(self, order, gaps):
+        self.order = order
+        self.gaps = gaps
+        self.link_order = np.argsort(gaps, kind='stable').astype(np.int32)
+        self.sorted_gaps = gaps[self.link_order]
+        self.sorted_pair_gaps = np.sort(np.maximum(gaps[:-1], gaps[1:]))
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def nbytes(self):
+        return (
+            self.order.nbytes
+            + self.gaps.nbytes
+            + self.link_order.nbytes
+            + self.sorted_gaps.nbytes
+            + self.sorted_pair_gaps.nbytes
+        )
+
+    @classmethod
+    def from_edges(cls, n, first, second, distance):
+        """
+        Builds the hierarchy from the edges of a neighbour graph.
+
+        The minimum spanning forest of the edges is computed by scipy, then its edges are merged
+        by ascending distance, concatenating the leaf order of the merged clusters. Only the items
+        with an edge are visited one by one.
+
+        Args:
+            n (int): The number of items.
+            first (np.ndarray): The first item of every edge.
+            second (np.ndarray): The second item of every edge.
+            distance (np.ndarray): The distance of every edge.
+
+        Returns:
+            LinkageHierarchy: The hierarchy.
+        """
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        if len(first) > 0:
+            # the edges are grouped by first item, a pair listed from both items is kept twice,
+            # scipy treats the graph as undirected and drops zero weights, so every weight is shifted
+            by_first = np.argsort(first, kind='stable')
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(first, minlength=n), out=offsets[1:])
+            forest = minimum_spanning_tree(
+                csr_matrix(
+                    (
+                        np.asarray(distance, dtype=np.float64)[by_first] + 1.0,
+                        second[by_first],
+                        offsets,
+                    ),
+                    shape=(n, n),
+                )
+            ).tocoo()
+            tree_low = np.minimum(forest.row, forest.col).astype(np.int64)
+            tree_high = np.maximum(forest.row, forest.col).astype(np.int64)
+            tree_distance = (forest.data - 1.0).astype(np.float32)
+        else:
+            tree_low = tree_high = np.empty(0, dtype=np.int64)
+            tree_distance = np.empty(0, dtype=np.float32)
+        merge_order = np.lexsort((tree_high, tree_low, tree_distance))
+
+        parent, size, tail, following, gap_after = {}, {}, {}, {}, {}
+
+        def find(item):
+            root = parent.setdefault(item, item)
+            while root != parent[root]:
+                parent[root] = parent[parent[root]]
+                root = parent[root]
+            return root
+
+        for low, high, height in zip(
+            tree_low[merge_order].tolist(),
+            tree_high[merge_order].tolist(),
+            tree_distance[merge_order].tolist(),
+        ):
+            a, b = find(low), find(high)
+            if size.get(a, 1) < size.get(b, 1):
+                a, b = b, a
+            # the leaf order of the merged cluster is the order of a then the order of b
+            a_tail, b_tail = tail.get(a, a), tail.get(b, b)
+            following[a_tail] = b
+            gap_after[a_tail] = height
+            parent[b] = a
+            size[a] = size.get(a, 1) + size.get(b, 1)
+            tail[a] = b_tail
+
+        order = []
+        gaps = []
+        for item in parent:
+            if parent[item] != item:
+                continue
+            order.append(item)
+            while item in following:
+                gaps.append(gap_after[item])
+                item = following[item]
+                order.append(item)
+            gaps.append(np.inf)
+        clustered = np.array(order, dtype=np.int64)
+        singles = np.ones(n, dtype=bool)
+        singles[clustered] = False
+        order = np.concatenate([clustered, np.flatnonzero(singles)]).astype(np.int32)
+        all_gaps = np.full(max(n - 1, 0), np.inf, dtype=np.float32)
+        if gaps:
+            # the gap after the last clustered item stays inf
+            all_gaps[: len(gaps) - 1] = gaps[:-1]
+        return cls(order, all_gaps)
+
+    def _runs(self, threshold):
+        links = np.sort(
+            self.link_order[: np.searchsorted(self.sorted_gaps, threshold, side='right')]
+        )
+        if len(links) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        is_start = np.ones(len(links), dtype=bool)
+        np.not_equal(links[1:], links[:-1] + 1, out=is_start[1:])
+        starts = np.flatnonzero(is_start)
+        # a run of r joins starting at leaf p is the cluster of leaves p to p + r
+        sizes = np.diff(np.append(starts, len(links))) + 1
+        return links[starts].astype(np.int64), sizes
+
+    def clusters(self, threshold, min_size):
+        """
+        Retrieves the single linkage clusters of a threshold: the groups of items connected by
+        neighbours within it.
+
+        Args:
+            threshold (float): The maximum distance between neighbours in a cluster.
+            min_size (int): The minimum number of items in a cluster.
+
+        Returns:
+            ClusterList: The clusters of item indices, sorted by descending size (ties in leaf order),
+                         the first member of every cluster being the first in leaf order.
+        """
+        starts, sizes = self._runs(threshold)
+        if min_size <= 1:
+            # the items joined to nothing are clusters of one
+            joined = np.zeros(len(self.order), dtype=bool)
+            joined[np.repeat(starts, sizes) + run_ranks(sizes)] = True
+            singles = np.flatnonzero(~joined)
+            starts = np.concatenate([starts, singles])
+            sizes = np.concatenate([sizes, np.ones(len(singles), dtype=np.int64)])
+        keep = sizes >= min_size
+        starts, sizes = starts[keep], sizes[keep]
+        by_size = np.lexsort((starts, -sizes))
+        starts, sizes = starts[by_size], sizes[by_size]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return ClusterList(self.order[np.repeat(starts, sizes) + run_ranks(sizes)], offsets)
+
+    def curve(self, thresholds):
+        """
+        Counts the clusters of at least two items and the duplicates of several thresholds.
+
+        Args:
+            thresholds (np.ndarray): The thresholds.
+
+        Returns:
+            tuple: The number of clusters and the number of duplicates, the clustered items
+                   that are not the first of their cluster, at every threshold.
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        duplicates = np.searchsorted(self.sorted_gaps, thresholds, side='right')
+        chained = np.searchsorted(self.sorted_pair_gaps, thresholds, side='right')
+        return duplicates - chained, duplicates
@@ -0,0 +1,101 @@
+import os
+import sys
+import mmap
+import logging
+import resource
+
+import numpy as np
+
+logger = logging.getLogger('[MEMORY]')
+logging.basicConfig(level='INFO')
+
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident set size of the process.
+
+    Returns:
+        int: The peak RSS in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss_bytes():
+    """
+    Returns the current resident set size of the process, or the peak where it cannot be read.
+
+    Returns:
+        int: The RSS in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def memory_limit_bytes():
+    """
+    Returns the memory available to the process, the cgroup limit of its container if any.
+
+    Returns:
+        int: The limit in bytes, 0 if it cannot be read.
+    """
+    for path in (
+        '/sys/fs/cgroup/memory.max',
+        '/sys/fs/cgroup/memory/memory.limit_in_bytes',
+    ):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # 'max' or a huge number when the container is not limited
+        if value.isdigit() and int(value) < 2**60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def is_memory_mapped(array):
+    """
+    Tells whether an array is backed by a memory-mapped file.
+
+    The views numpy returns of a memory-mapped array, np.asarray or np.ascontiguousarray of
+    an aligned one for instance, are plain arrays whose base is the np.memmap.
+
+    Args:
+        array (np.ndarray): The array.
+
+    Returns:
+        bool: Whether the array or one of its bases is a np.memmap or a mmap.mmap.
+    """
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def array_bytes(arrays):
+    """
+    Splits the size of arrays between the process heap and memory-mapped files.
+
+    Args:
+        arrays (iterable): The numpy arrays.
+
+    Returns:
+        tuple: The heap bytes and the memory-mapped bytes.
+    """
+    heap = 0
+    mapped = 0
+    for array in arrays:
+        if is_memory_mapped(array):
+            mapped += array.nbytes
+        else:
+            heap += array.nbytes
+    return heap, mapped
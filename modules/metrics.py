@@ -0,0 +1,250 @@
+import math
+import time
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger('[METRICS]')
+logging.basicConfig(level='INFO')
+
+# upper bounds in seconds of the latency histogram buckets, from a cached query to a large export
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    The metrics of the service, rendered in the Prometheus text exposition format.
+
+    Methods
+    -------
+    register(metric)
+        Adds a metric to the registry.
+    render()
+        Returns the text exposition of all the metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Renders all the metrics.
+
+        Returns:
+            str: The Prometheus text exposition.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                logger.warning("Cannot collect metric %s: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Histogram:
+    """
+    A Prometheus histogram, one set of cumulative buckets per combination of label values.
+
+    Attributes
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple
+        The names of the labels every observation is given.
+    buckets : tuple
+        The increasing upper bounds of the buckets.
+
+    Methods
+    -------
+    observe(value, **labels)
+        Counts an observation.
+    time(**labels)
+        A context manager observing the seconds spent in its block.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, value, **labels):
+        """
+        Counts an observation.
+
+        Args:
+            value (float): The observed value.
+            **labels: The value of every label of the metric.
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            series = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._series.items()
+            }
+        lines = []
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames, key, [('le', _number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_number(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """
+    A Prometheus gauge, either set by the code or read from a callback when the metrics are rendered.
+
+    Attributes
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple
+        The names of the labels of the values.
+    metric_type : str
+        `gauge`, or `counter` for the monotonic values read from a callback.
+
+    Methods
+    -------
+    set(value, **labels)
+        Sets a value.
+    inc(amount=1, **labels)
+        Increments a value.
+    dec(amount=1, **labels)
+        Decrements a value.
+    """
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        callback=None,
+        metric_type='gauge',
+        registry=REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+        # returns a list of (label values tuple, value) when the metrics are rendered
+        self._callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        if self._callback is not None:
+            values = list(self._callback())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [
+            f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+            for key, value in sorted(values)
+        ]
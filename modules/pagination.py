@@ -0,0 +1,61 @@
+import json
+import base64
+import hashlib
+
+
+def query_fingerprint(*params):
+    """
+    Computes a short fingerprint of the parameters a page was requested with.
+
+    Args:
+        *params: The query parameters, any JSON serializable values.
+
+    Returns:
+        str: A hex digest identifying the query.
+    """
+    digest = hashlib.blake2b(json.dumps(params).encode(), digest_size=8)
+    return digest.hexdigest()
+
+
+def encode_cursor(offset, fingerprint):
+    """
+    Builds an opaque cursor pointing at an offset of a query result.
+
+    Args:
+        offset (int): The index of the first entry of the next page.
+        fingerprint (str): The fingerprint of the query, see `query_fingerprint`.
+
+    Returns:
+        str: A URL safe cursor.
+    """
+    payload = json.dumps({'o': int(offset), 'q': fingerprint}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fingerprint):
+    """
+    Reads the offset back from a cursor built by `encode_cursor`.
+
+    An empty cursor points at the first page.
+
+    Args:
+        cursor (str): The cursor received from the client.
+        fingerprint (str): The fingerprint of the query the cursor is used with.
+
+    Returns:
+        int: The offset of the first entry of the page.
+
+    Raises:
+        ValueError: If the cursor is malformed, or was built for another query or an older export.
+    """
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        offset, cursor_fingerprint = int(payload['o']), payload['q']
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Malformed cursor: {cursor}") from e
+    if cursor_fingerprint != fingerprint or offset < 0:
+        raise ValueError("Cursor does not match the query or the data was exported again")
+    return offset
@@ -0,0 +1,31 @@
+import io
+import pstats
+import logging
+import contextvars
+
+logger = logging.getLogger('[PROFILING]')
+logging.basicConfig(level='INFO')
+
+# the cProfile.Profile of the request being profiled, the pools run its blocking work under it
+ACTIVE_PROFILER = contextvars.ContextVar('cleanup_profiler', default=None)
+
+
+def profile_summary(profiler, rows=30):
+    """
+    Formats the functions a profiler spent the most cumulative time in.
+
+    Args:
+        profiler (cProfile.Profile): The profiler.
+        rows (int): The number of functions to list.
+
+    Returns:
+        str: The pstats report, empty if nothing was profiled.
+    """
+    stream = io.StringIO()
+    try:
+        stats = pstats.Stats(profiler, stream=stream)
+    except TypeError:
+        # nothing ran under the profiler
+        return ''
+    stats.sort_stats('cumulative').print_stats(rows)
+    return stream.getvalue()
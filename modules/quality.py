@@ -0,0 +1,123 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('[QUALITY]')
+logging.basicConfig(level='INFO')
+
+# the quality score of every panel quality type, as written in the item metadata by the quality score generator
+QUALITY_TYPES = {
+    'Darkness/Brightness': 'darkness_score',
+    'Blurriness/Sharpness': 'blurriness_score',
+}
+
+
+def item_quality_scores(record):
+    """
+    Reads the quality scores of an exported item record.
+
+    Args:
+        record (dict): The exported item.
+
+    Returns:
+        dict: The score name to value mapping, empty if the item was not scored.
+    """
+    metadata = record.get('metadata') or {}
+    scores = (metadata.get('user') or {}).get('quality_scores') or {}
+    return {
+        name: float(scores[name])
+        for name in QUALITY_TYPES.values()
+        if isinstance(scores.get(name), (int, float))
+    }
+
+
+class QualityScores:
+    """
+    The items of a dataset sorted by one quality score, to answer the range queries of the panel slider.
+
+    Attributes
+    ----------
+    rows : np.ndarray
+        The item rows sorted by ascending score, ties in row order.
+    sorted_scores : np.ndarray
+        The float64 scores of the items in `rows`.
+
+    Methods
+    -------
+    count(min_v, max_v)
+        Counts the items scored strictly between two values.
+    between(min_v, max_v, offset=0, limit=0)
+        Returns the number of items scored strictly between two values and a page of them.
+    histogram(bins=20, min_v=0.0, max_v=1.0)
+        Counts the items in equal width score bins.
+    """
+
+    def __init__(self, scores):
+        # the items without a score have a NaN score
+        scores = np.asarray(scores, dtype=np.float64)
+        scored = np.flatnonzero(~np.isnan(scores))
+        order = np.argsort(scores[scored], kind='stable')
+        self.rows = scored[order]
+        self.sorted_scores = scores[self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.sorted_scores.nbytes
+
+    def _span(self, min_v, max_v):
+        # the platform filters are strict greater and less than
+        start = int(np.searchsorted(self.sorted_scores, min_v, side='right'))
+        stop = int(np.searchsorted(self.sorted_scores, max_v, side='left'))
+        return start, max(start, stop)
+
+    def count(self, min_v, max_v):
+        """
+        Counts the items with a score strictly between two values.
+
+        Args:
+            min_v (float): The lower bound, exclusive.
+            max_v (float): The upper bound, exclusive.
+
+        Returns:
+            int: The number of items.
+        """
+        start, stop = self._span(min_v, max_v)
+        return stop - start
+
+    def between(self, min_v, max_v, offset=0, limit=0):
+        """
+        Retrieves the items with a score strictly between two values, by ascending score.
+
+        Args:
+            min_v (float): The lower bound, exclusive.
+            max_v (float): The upper bound, exclusive.
+            offset (int): The number of items to skip.
+            limit (int): The maximum number of items to return, 0 for no limit.
+
+        Returns:
+            tuple: The total number of items in the range and the rows of the requested items.
+        """
+        start, stop = self._span(min_v, max_v)
+        first = min(start + max(offset, 0), stop)
+        last = stop if limit <= 0 else min(stop, first + limit)
+        return stop - start, self.rows[first:last]
+
+    def histogram(self, bins=20, min_v=0.0, max_v=1.0):
+        """
+        Counts the items in equal width score bins, the last bin including its upper edge.
+
+        Args:
+            bins (int): The number of bins.
+            min_v (float): The lower edge of the first bin.
+            max_v (float): The upper edge of the last bin.
+
+        Returns:
+            tuple: The (bins,) int64 counts and the (bins + 1,) float64 edges.
+        """
+        edges = np.linspace(min_v, max_v, max(int(bins), 1) + 1)
+        positions = np.searchsorted(self.sorted_scores, edges, side='left')
+        positions[-1] = np.searchsorted(self.sorted_scores, edges[-1], side='right')
+        return np.diff(positions).astype(np.int64), edges
@@ -0,0 +1,164 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('[RESIDENCY]')
+logging.basicConfig(level='INFO')
+
+
+class ResidencyManager:
+    """
+    Keeps the in memory state of the exporters of all the datasets within a global memory budget.
+
+    Datasets are kept in least recently used order. When the bytes of the resident datasets go
+    over the budget, the least recently used ones that no request is using are evicted: their
+    vectors, kNN graphs and scores are dropped, to be reloaded from the index store by the next
+    request. Datasets without a complete stored copy, and the most recently used one, are not evicted.
+
+    Attributes
+    ----------
+    max_bytes : int
+        The memory budget in bytes, 0 for no budget.
+
+    Methods
+    -------
+    track(dataset_id, exporter)
+        Starts accounting for the memory of an exporter.
+    acquire(dataset_id)
+        Marks a dataset used by a request, it is not evicted until released.
+    release(dataset_id)
+        Marks the end of a request on a dataset and enforces the budget.
+    exporters()
+        Returns the tracked datasets and their exporters.
+    record_reload(dataset_id)
+        Counts a reload of an evicted dataset.
+    stats()
+        Returns the resident bytes of every dataset and the eviction counters.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max(int(max_bytes), 0)
+        self._exporters = OrderedDict()
+        self._usage = {}
+        self._pins = {}
+        self._evictions = {}
+        self._reloads = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def track(self, dataset_id, exporter):
+        """
+        Starts accounting for the memory of the exporter of a dataset.
+
+        Args:
+            dataset_id (str): The ID of the dataset.
+            exporter (Exporter): The exporter of the dataset.
+        """
+        with self._lock:
+            if dataset_id not in self._exporters:
+                self._exporters[dataset_id] = exporter
+                self._pins[dataset_id] = 0
+                self._evictions[dataset_id] = 0
+                self._reloads[dataset_id] = 0
+                self._usage[dataset_id] = exporter.memory_usage()
+                self._last_used[dataset_id] = time.time()
+
+    def acquire(self, dataset_id):
+        """
+        Marks a dataset as used by a request and the most recently used, it is not evicted until released.
+
+        Args:
+            dataset_id (str): The ID of a tracked dataset.
+        """
+        with self._lock:
+            self._pins[dataset_id] += 1
+            self._exporters.move_to_end(dataset_id)
+            self._last_used[dataset_id] = time.time()
+
+    def release(self, dataset_id):
+        """
+        Marks the end of a request on a dataset, measures it again and evicts datasets over the budget.
+
+        Args:
+            dataset_id (str): The ID of an acquired dataset.
+        """
+        with self._lock:
+            self._pins[dataset_id] -= 1
+            self._usage[dataset_id] = self._exporters[dataset_id].memory_usage()
+            self._enforce()
+
+    def exporters(self):
+        """
+        Returns the tracked datasets, from the least recently used.
+
+        Returns:
+            list: The (dataset id, exporter) pairs.
+        """
+        with self._lock:
+            return list(self._exporters.items())
+
+    def record_reload(self, dataset_id):
+        with self._lock:
+            self._reloads[dataset_id] += 1
+
+    @staticmethod
+    def _total(usage):
+        return usage['heap_bytes'] + usage['mapped_bytes']
+
+    def _enforce(self):
+        if self.max_bytes <= 0:
+            return
+        total = sum(self._total(usage) for usage in self._usage.values())
+        # the most recently used dataset stays resident, even alone over the budget
+        for dataset_id, exporter in list(self._exporters.items())[:-1]:
+            if total <= self.max_bytes:
+                break
+            if self._pins[dataset_id] > 0 or not exporter.resident:
+                continue
+            before = self._total(self._usage[dataset_id])
+            if exporter.evict():
+                self._evictions[dataset_id] += 1
+                self._usage[dataset_id] = exporter.memory_usage()
+                freed = before - self._total(self._usage[dataset_id])
+                total -= freed
+                logger.info(
+                    "Evicted dataset %s, freeing %.1f MB of a %.1f MB budget",
+                    dataset_id,
+                    freed / 1024**2,
+                    self.max_bytes / 1024**2,
+                )
+        if total > self.max_bytes:
+            logger.warning(
+                "%.1f MB resident over the %.1f MB budget, the other datasets are in use or not stored",
+                total / 1024**2,
+                self.max_bytes / 1024**2,
+            )
+
+    def stats(self):
+        """
+        Measures the datasets and returns their resident bytes, from the least recently used.
+
+        Returns:
+            dict: The budget, the total resident bytes and, per dataset, the heap and memory-mapped
+                  bytes, whether it is resident, its requests in progress, evictions, reloads and last use.
+        """
+        with self._lock:
+            datasets = {}
+            for dataset_id, exporter in self._exporters.items():
+                self._usage[dataset_id] = exporter.memory_usage()
+                datasets[dataset_id] = {
+                    **self._usage[dataset_id],
+                    'resident': exporter.resident,
+                    'requests': self._pins[dataset_id],
+                    'evictions': self._evictions[dataset_id],
+                    'reloads': self._reloads[dataset_id],
+                    'last_used': self._last_used[dataset_id],
+                }
+            return {
+                'max_bytes': self.max_bytes,
+                'resident_bytes': sum(
+                    self._total(usage) for usage in self._usage.values()
+                ),
+                'datasets': datasets,
+            }
@@ -0,0 +1,354 @@
+import os
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import faiss
+import numpy as np
+
+from modules.build import CHUNK_ROWS, set_worker_threads
+from modules.graph import NeighbourGraph
+from modules.storage import FLOAT32_STORAGE, DecodedVectors, storage_from_state
+
+logger = logging.getLogger('[SHARDING]')
+logging.basicConfig(level='INFO')
+
+# rows searched against every shard by one task, a few tasks per process balance the load
+QUERY_BLOCK_ROWS = 4 * CHUNK_ROWS
+VECTORS_FILE = 'vectors.npy'
+SHARD_INDEX_FILE = 'shard.{}.faiss'
+
+# the shared vectors and shard indexes opened by a worker process, by path
+_opened = {}
+
+
+def shard_bounds(n, shards):
+    """
+    Splits the rows of a feature set into contiguous shards of near equal sizes.
+
+    Args:
+        n (int): The number of rows.
+        shards (int): The number of shards.
+
+    Returns:
+        np.ndarray: The shards + 1 row offsets of the shards.
+    """
+    return np.linspace(0, n, max(int(shards), 1) + 1).astype(np.int64)
+
+
+class _Rows:
+    """
+    A contiguous range of rows of the shared vectors, read by local row or index label.
+
+    It is the matrix a shard index is trained on, and the vectors the backends that re-rank
+    their candidates read.
+    """
+
+    def __init__(self, vectors, start, stop):
+        self.vectors = vectors
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def shape(self):
+        return len(self), self.vectors.shape[1]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            start, stop, _ = rows.indices(len(self))
+            return self.vectors[self.start + start : self.start + stop]
+        return self.vectors[np.asarray(rows) + self.start]
+
+
+def _init_worker(threads):
+    set_worker_threads(threads)
+
+
+def _shared_vectors(directory, vectors_state):
+    path = os.path.join(directory, VECTORS_FILE)
+    if path not in _opened:
+        codes = np.load(path, mmap_mode='r')
+        storage = storage_from_state(vectors_state)
+        _opened[path] = (
+            codes if storage is FLOAT32_STORAGE else DecodedVectors(codes, storage)
+        )
+    return _opened[path]
+
+
+def _shard_index(directory, shard):
+    path = os.path.join(directory, SHARD_INDEX_FILE.format(shard))
+    if path not in _opened:
+        try:
+            _opened[path] = faiss.read_index(
+                path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+        except RuntimeError:
+            # not every index type can be memory-mapped
+            _opened[path] = faiss.read_index(path)
+    return _opened[path]
+
+
+def _build_shard(
+    directory, vectors_state, quantizer_state, backend, shard, start, stop
+):
+    """
+    Builds the index of a shard in a worker process and writes it next to the shared vectors.
+    """
+    rows = _Rows(_shared_vectors(directory, vectors_state), start, stop)
+    quantizer = None
+    if quantizer_state is not None:
+        quantizer = storage_from_state(quantizer_state).scalar_quantizer
+    index = backend.build(rows, quantizer)
+    for chunk_start in range(0, len(rows), CHUNK_ROWS):
+        index.add(
+            np.ascontiguousarray(
+                rows[chunk_start : chunk_start + CHUNK_ROWS], dtype=np.float32
+            )
+        )
+    faiss.write_index(index, os.path.join(directory, SHARD_INDEX_FILE.format(shard)))
+    return len(rows)
+
+
+def _search_shard(index, backend, queries, rows, k):
+    if backend.approximate_distances:
+        return backend.search(index, queries, k, rows)
+    return index.search(queries, k)
+
+
+def _range_search_shard(index, backend, queries, rows, radius, fallback_k):
+    """
+    Range searches the queries against a shard, or searches fallback_k neighbours and keeps
+    the ones within the radius when the index cannot be range searched.
+
+    Returns:
+        tuple: The number of neighbours of every query, and their local labels and distances.
+    """
+    if not backend.approximate_distances:
+        try:
+            limits, distance, labels = index.range_search(queries, radius)
+            return np.diff(limits).astype(np.int64), labels, distance
+        except RuntimeError:
+            pass
+    distance, labels = _search_shard(
+        index, backend, queries, rows, min(fallback_k, index.ntotal)
+    )
+    within = (distance < radius) & (labels >= 0)
+    return np.count_nonzero(within, axis=1), labels[within], distance[within]
+
+
+def _search_block(
+    directory, vectors_state, backend, bounds, k, radius, depth, start, stop
+):
+    """
+    Searches a block of rows against every shard in a worker process, merges the nearest
+    neighbours of the shards and writes them into the shared kNN matrices, and the block of
+    the range graph into its own file.
+    """
+    vectors = _shared_vectors(directory, vectors_state)
+    queries = np.ascontiguousarray(vectors[start:stop], dtype=np.float32)
+    distances, labels = [], []
+    lengths, edge_rows, edge_labels, edge_distances = 0, [], [], []
+    for shard in range(len(bounds) - 1):
+        index = _shard_index(directory, shard)
+        rows = _Rows(vectors, bounds[shard], bounds[shard + 1])
+        distance, label = _search_shard(
+            index, backend, queries, rows, min(k, index.ntotal)
+        )
+        found = label >= 0
+        distances.append(np.where(found, distance, np.inf).astype(np.float32))
+        labels.append(np.where(found, label + bounds[shard], -1))
+        if radius is not None:
+            backend.set_search_depth(index, depth)
+            try:
+                shard_lengths, label, distance = _range_search_shard(
+                    index, backend, queries, rows, radius, k
+                )
+            finally:
+                backend.set_search_depth(index)
+            lengths = lengths + shard_lengths
+            edge_rows.append(np.repeat(np.arange(stop - start), shard_lengths))
+            edge_labels.append(label + bounds[shard])
+            edge_distances.append(distance)
+
+    distance = np.concatenate(distances, axis=1)
+    label = np.concatenate(labels, axis=1)
+    order = np.argsort(distance, axis=1, kind='stable')[:, :k]
+    distance = np.take_along_axis(distance, order, axis=1)
+    label = np.take_along_axis(label, order, axis=1)
+    # as faiss pads the rows of a search with fewer results than asked
+    distance[label < 0] = np.finfo(np.float32).max
+    for name, block in (('distance', distance), ('indices', label)):
+        shared = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r+')
+        shared[start:stop] = block
+        shared.flush()
+
+    if radius is not None:
+        # the edges of the shards are grouped by row, from_rows sorts every row by distance
+        by_row = np.argsort(np.concatenate(edge_rows), kind='stable')
+        graph = NeighbourGraph.from_rows(
+            lengths,
+            np.concatenate(edge_labels)[by_row],
+            np.concatenate(edge_distances)[by_row],
+            first_row=start,
+        )
+        np.savez(
+            os.path.join(directory, f'graph.{start}.npz'),
+            offsets=graph.offsets,
+            indices=graph.indices,
+            distance=graph.distance,
+        )
+    return stop - start
+
+
+def _run(pool, tasks, progress=None, passes=1):
+    futures = {pool.submit(*task) for task in tasks}
+    try:
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                rows = future.result()
+                if progress is not None:
+                    progress.advance(passes * rows)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+def sharded_knn(
+    vectors,
+    backend,
+    k,
+    shards,
+    processes,
+    storage=None,
+    radius=None,
+    range_depth=None,
+    progress=None,
+    directory=None,
+):
+    """
+    Builds and searches the index of a feature set in shards, in worker processes.
+
+    The vectors, or their codes, are written once to a file every worker memory-maps, instead
+    of being pickled to it. Every shard index is built by a worker over a contiguous range of
+    rows and written next to the vectors. Then the workers search blocks of rows against all
+    the shard indexes, memory-mapped when the index type allows it, keep the k nearest
+    neighbours of the shards and write them into the result matrices, memory-mapped as well.
+
+    Args:
+        vectors (np.ndarray): The float32 (N, dimension) normalized vectors, or their DecodedVectors.
+        backend (IndexBackend): The index backend of every shard.
+        k (int): The number of neighbours of every vector.
+        shards (int): The number of shards.
+        processes (int): The number of worker processes, they share the CPUs as faiss threads.
+        storage (VectorStorage, optional): The encoding of the feature set, the shard indexes
+                                           store its codes when it has a scalar quantizer.
+        radius (float, optional): The exclusive radius of the range graph, None for no graph.
+        range_depth (int, optional): The search depth of the range search, see `IndexBackend.set_search_depth`.
+        progress (BuildProgress, optional): Advanced by every built shard and searched block.
+        directory (str, optional): Where the temporary directory of the shared files is created.
+
+    Returns:
+        tuple: The faiss.IndexShards of the shard indexes, with successive labels, the (N, k)
+               neighbour distances and indices, and the NeighbourGraph within the radius or None.
+    """
+    n = len(vectors)
+    bounds = shard_bounds(n, min(shards, n))
+    processes = max(1, min(int(processes), len(bounds) - 1))
+    if isinstance(vectors, DecodedVectors):
+        codes, vectors_state = vectors.codes, vectors.storage.state()
+    else:
+        codes, vectors_state = vectors, FLOAT32_STORAGE.state()
+    quantizer_state = None
+    if storage is not None and storage.scalar_quantizer is not None:
+        quantizer_state = storage.state()
+
+    tmp = tempfile.mkdtemp(prefix='cleanup-shards-', dir=directory)
+    try:
+        shared = np.lib.format.open_memmap(
+            os.path.join(tmp, VECTORS_FILE), 'w+', codes.dtype, codes.shape
+        )
+        for start in range(0, n, CHUNK_ROWS):
+            shared[start : start + CHUNK_ROWS] = codes[start : start + CHUNK_ROWS]
+        shared.flush()
+        del shared
+        for name, dtype in (('distance', np.float32), ('indices', np.int64)):
+            np.lib.format.open_memmap(
+                os.path.join(tmp, f'{name}.npy'), 'w+', dtype, (n, k)
+            ).flush()
+
+        logger.info(
+            "Indexing %d vectors in %d shards with %d processes",
+            n,
+            len(bounds) - 1,
+            processes,
+        )
+        # spawned, the workers do not inherit the faiss threads and locks of the service
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(max(1, (os.cpu_count() or 1) // processes),),
+        ) as pool:
+            tasks = [
+                (
+                    _build_shard,
+                    tmp,
+                    vectors_state,
+                    quantizer_state,
+                    backend,
+                    shard,
+                    bounds[shard],
+                    bounds[shard + 1],
+                )
+                for shard in range(len(bounds) - 1)
+            ]
+            _run(pool, tasks, progress)
+            tasks = [
+                (
+                    _search_block,
+                    tmp,
+                    vectors_state,
+                    backend,
+                    bounds,
+                    k,
+                    radius,
+                    range_depth,
+                    start,
+                    min(start + QUERY_BLOCK_ROWS, n),
+                )
+                for start in range(0, n, QUERY_BLOCK_ROWS)
+            ]
+            _run(pool, tasks, progress, passes=1 if radius is None else 2)
+
+        distance = np.load(os.path.join(tmp, 'distance.npy'))
+        indices = np.load(os.path.join(tmp, 'indices.npy'))
+        graph = None
+        if radius is not None:
+            graphs = []
+            for start in range(0, n, QUERY_BLOCK_ROWS):
+                with np.load(os.path.join(tmp, f'graph.{start}.npz')) as block:
+                    graphs.append(
+                        NeighbourGraph(
+                            block['offsets'], block['indices'], block['distance']
+                        )
+                    )
+            graph = NeighbourGraph.concatenate(graphs)
+        shard_indexes = [
+            faiss.read_index(os.path.join(tmp, SHARD_INDEX_FILE.format(shard)))
+            for shard in range(len(bounds) - 1)
+        ]
+        index = faiss.IndexShards(vectors.shape[1], False, True)
+        for shard_index in shard_indexes:
+            index.add_shard(shard_index)
+        # the shards return ascending squared L2 distances whatever their metric flag
+        index.metric_type = faiss.METRIC_L2
+        return index, distance, indices, graph
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
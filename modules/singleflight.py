@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('[SINGLE FLIGHT]')
+logging.basicConfig(level='INFO')
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent requests: while a computation is in flight, the requests with
+    the same key wait for it and share its result instead of computing it again.
+
+    The shared computation is shielded, a client that goes away does not cancel it for the others.
+
+    Attributes
+    ----------
+    executed : int
+        The number of computations run.
+    coalesced : int
+        The number of requests served by the computation of an earlier identical request.
+
+    Methods
+    -------
+    run(key, function, *args, **kwargs)
+        Runs a coroutine function, or joins its in-flight run with the same key.
+    stats()
+        Returns the counters.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # marks the exception retrieved when every waiter went away
+            task.exception()
+
+    async def run(self, key, function, *args, **kwargs):
+        """
+        Runs a coroutine function, or waits for the in-flight run of an identical request.
+
+        Args:
+            key (tuple): The normalized parameters of the request, identical requests have equal keys.
+            function (callable): The coroutine function computing the result.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            The result of the function, shared by all the requests with the key.
+        """
+        task = self._calls.get(key)
+        if task is not None and not task.done():
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """
+        Returns the counters.
+
+        Returns:
+            dict: The computations run, the requests coalesced and the computations in flight.
+        """
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls),
+        }
@@ -0,0 +1,429 @@
+import abc
+import logging
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger('[STORAGE]')
+logging.basicConfig(level='INFO')
+
+STORAGE_FLOAT32 = 'float32'
+STORAGE_FLOAT16 = 'float16'
+STORAGE_INT8 = 'int8'
+STORAGE_PCA = 'pca'
+# rows encoded at once, to bound the temporary matrices
+CHUNK_ROWS = 8192
+# the rows the PCA projection is fitted on
+PCA_SAMPLE_ROWS = 100000
+# the neighbours of every query compared by the agreement check
+CHECK_NEIGHBOURS = 50
+# the similarity thresholds the agreement check compares the neighbours within
+CHECK_THRESHOLDS = (0.05, 0.1, 0.2)
+
+
+class VectorStorage(abc.ABC):
+    """
+    The base class of the encodings the normalized vectors of a feature set are held, stored and indexed with.
+
+    The vectors are encoded once, after they are normalized, and only the codes are kept. They
+    are decoded chunk by chunk to float32 when they are indexed or searched, so the distances of
+    the neighbour graphs are distances between the decoded vectors.
+
+    Attributes
+    ----------
+    name : str
+        The name of the encoding, as used in the configuration.
+    scalar_quantizer : faiss.ScalarQuantizer
+        The quantizer producing the same codes, the faiss index then holds them instead of
+        float32 vectors, None to index the decoded vectors.
+
+    Methods
+    -------
+    params()
+        Returns the parameters of the encoding, part of the stored entries fingerprint.
+    fit(vectors, previous=None)
+        Returns the encoding fitted to the vectors.
+    encode(vectors)
+        Encodes float32 vectors.
+    decode(codes)
+        Decodes codes to float32 vectors.
+    state()
+        Returns the arrays the fitted encoding is stored with.
+    """
+
+    name = None
+    scalar_quantizer = None
+
+    def params(self):
+        return {'storage': self.name}
+
+    def fit(self, vectors, previous=None):
+        """
+        Fits the encoding to the vectors of a feature set.
+
+        Args:
+            vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+            previous (VectorStorage, optional): The encoding of the previous export, reused when it
+                                                fits the vectors, so unchanged vectors keep their codes.
+
+        Returns:
+            VectorStorage: The fitted encoding.
+        """
+        return self
+
+    @abc.abstractmethod
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def decode(self, codes):
+        raise NotImplementedError
+
+    def state(self):
+        return {'name': np.array(self.name)}
+
+
+class Float32Storage(VectorStorage):
+    """
+    The full precision vectors, the codes are the vectors.
+    """
+
+    name = STORAGE_FLOAT32
+
+    def params(self):
+        # entries stored before the encodings were added are float32
+        return {}
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+
+class Float16Storage(VectorStorage):
+    """
+    The vectors rounded to half precision, half the memory of float32.
+    """
+
+    name = STORAGE_FLOAT16
+
+    def __init__(self, dimension=None):
+        self.dimension = dimension
+        if dimension is not None:
+            self.scalar_quantizer = faiss.ScalarQuantizer(
+                dimension, faiss.ScalarQuantizer.QT_fp16
+            )
+
+    def fit(self, vectors, previous=None):
+        if isinstance(previous, Float16Storage) and previous.dimension == vectors.shape[1]:
+            return previous
+        return Float16Storage(vectors.shape[1])
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def state(self):
+        return {**super().state(), 'dimension': np.array(self.dimension)}
+
+
+class Int8Storage(VectorStorage):
+    """
+    The vectors scalar quantized to 8 bits per dimension, a quarter of the memory of float32.
+
+    Every dimension is quantized uniformly between its minimum and maximum over the feature
+    set, as faiss' 8 bit scalar quantizer does, so the index stores the very same codes.
+    """
+
+    name = STORAGE_INT8
+
+    def __init__(self, vmin=None, vdiff=None):
+        self.vmin = vmin
+        self.vdiff = vdiff
+        if vmin is not None:
+            self.scalar_quantizer = faiss.ScalarQuantizer(
+                len(vmin), faiss.ScalarQuantizer.QT_8bit
+            )
+            faiss.copy_array_to_vector(
+                np.concatenate([vmin, vdiff]).astype(np.float32),
+                self.scalar_quantizer.trained,
+            )
+
+    def fit(self, vectors, previous=None):
+        vmin = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+        vmax = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = vectors[start : start + CHUNK_ROWS]
+            np.minimum(vmin, chunk.min(axis=0), out=vmin)
+            np.maximum(vmax, chunk.max(axis=0), out=vmax)
+        if len(vectors) == 0:
+            vmin[:] = vmax[:] = 0
+        if (
+            isinstance(previous, Int8Storage)
+            and len(previous.vmin) == len(vmin)
+            and np.all(previous.vmin <= vmin)
+            # up to the rounding of the stored range, faiss clips the values out of it
+            and np.all(previous.vmin + previous.vdiff >= vmax - np.float32(1e-6))
+        ):
+            return previous
+        # a constant dimension still needs a non zero range
+        return Int8Storage(vmin, np.maximum(vmax - vmin, np.float32(1e-6)))
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), len(self.vmin)), dtype=np.uint8)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = np.ascontiguousarray(
+                vectors[start : start + CHUNK_ROWS], dtype=np.float32
+            )
+            codes[start : start + len(chunk)] = self.scalar_quantizer.compute_codes(
+                chunk
+            )
+        return codes
+
+    def decode(self, codes):
+        flat = np.ascontiguousarray(codes, dtype=np.uint8).reshape(-1, codes.shape[-1])
+        return self.scalar_quantizer.decode(flat).reshape(codes.shape)
+
+    def state(self):
+        return {**super().state(), 'vmin': self.vmin, 'vdiff': self.vdiff}
+
+
+class PCAStorage(VectorStorage):
+    """
+    The vectors projected on their principal components, keeping fewer float32 dimensions.
+
+    The projection is fitted on a sample of the feature set. Distances between the projected
+    vectors are at most the distances between the full vectors, the difference being the part of
+    the vectors outside the kept components.
+    """
+
+    name = STORAGE_PCA
+
+    def __init__(self, dimensions, mean=None, components=None):
+        self.dimensions = int(dimensions)
+        self.mean = mean
+        self.components = components
+
+    def params(self):
+        return {'storage': self.name, 'pcaDimensions': self.dimensions}
+
+    def fit(self, vectors, previous=None):
+        if (
+            isinstance(previous, PCAStorage)
+            and previous.dimensions == self.dimensions
+            and len(previous.mean) == vectors.shape[1]
+        ):
+            return previous
+        n, dimension = vectors.shape
+        sample = np.sort(
+            np.random.RandomState(0).choice(n, min(n, PCA_SAMPLE_ROWS), replace=False)
+        )
+        sample = np.asarray(vectors[sample], dtype=np.float64)
+        mean = sample.mean(axis=0) if n > 0 else np.zeros(dimension)
+        centered = sample - mean
+        # the eigenvectors of the covariance, by descending eigenvalue
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        kept = np.argsort(eigenvalues)[::-1][: min(self.dimensions, dimension)]
+        components = eigenvectors[:, kept].T
+        explained = eigenvalues[kept].sum() / max(eigenvalues.sum(), 1e-12)
+        logger.info(
+            "PCA keeps %d of %d dimensions, %.1f%% of the variance",
+            len(kept),
+            dimension,
+            100 * explained,
+        )
+        return PCAStorage(
+            self.dimensions, mean.astype(np.float32), components.astype(np.float32)
+        )
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), len(self.components)), dtype=np.float32)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = vectors[start : start + CHUNK_ROWS]
+            codes[start : start + len(chunk)] = (chunk - self.mean) @ self.components.T
+        return codes
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def state(self):
+        return {
+            **super().state(),
+            'dimensions': np.array(self.dimensions),
+            'mean': self.mean,
+            'components': self.components,
+        }
+
+
+FLOAT32_STORAGE = Float32Storage()
+STORAGE_NAMES = (STORAGE_FLOAT32, STORAGE_FLOAT16, STORAGE_INT8, STORAGE_PCA)
+
+
+def vector_storage(name, pca_dimensions=128):
+    """
+    Creates an unfitted vector encoding.
+
+    Args:
+        name (str): `float32`, `float16`, `int8` or `pca`.
+        pca_dimensions (int): The dimensions kept by the `pca` encoding.
+
+    Returns:
+        VectorStorage: The encoding.
+
+    Raises:
+        ValueError: If the encoding is not supported.
+    """
+    if name == STORAGE_FLOAT32:
+        return FLOAT32_STORAGE
+    if name == STORAGE_FLOAT16:
+        return Float16Storage()
+    if name == STORAGE_INT8:
+        return Int8Storage()
+    if name == STORAGE_PCA:
+        return PCAStorage(pca_dimensions)
+    raise ValueError(f"Vector storage {name} not supported")
+
+
+def storage_from_state(state):
+    """
+    Restores a fitted encoding from the arrays returned by its `state()`.
+
+    Args:
+        state (dict): The arrays of the encoding.
+
+    Returns:
+        VectorStorage: The encoding.
+    """
+    name = str(state['name'])
+    if name == STORAGE_FLOAT16:
+        return Float16Storage(int(state['dimension']))
+    if name == STORAGE_INT8:
+        return Int8Storage(state['vmin'], state['vdiff'])
+    if name == STORAGE_PCA:
+        return PCAStorage(int(state['dimensions']), state['mean'], state['components'])
+    return FLOAT32_STORAGE
+
+
+class DecodedVectors:
+    """
+    A read only view decoding the codes of a feature set on access, so that the indexing and
+    search code reads compressed vectors as a float32 matrix, slice by slice.
+
+    Attributes
+    ----------
+    codes : np.ndarray
+        The (N, code size) codes.
+    storage : VectorStorage
+        The fitted encoding of the codes.
+    """
+
+    def __init__(self, codes, storage):
+        self.codes = codes
+        self.storage = storage
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return len(self.codes), self.storage.decode(self.codes[:1]).shape[1]
+
+    def __getitem__(self, key):
+        return self.storage.decode(self.codes[key])
+
+
+def _flat_knn(vectors, queries, k):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)
+
+
+def _pair_distances(vectors, queries, candidates, chunk_rows=64):
+    distances = np.empty(candidates.shape, dtype=np.float32)
+    for start in range(0, len(queries), chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        differences = vectors[candidates[rows]] - queries[rows, None, :]
+        distances[rows] = np.einsum('ijk,ijk->ij', differences, differences)
+    return distances
+
+
+def storage_agreement(vectors, storage, max_items, queries=1000, seed=0):
+    """
+    Compares the neighbours of the full precision vectors with the neighbours of their codes, on a sample.
+
+    The items of the sample are searched exactly against the sample, once with the full vectors
+    and once with the decoded codes, and the results are compared the way the panel uses them:
+    the nearest neighbours, the neighbours within the similarity thresholds, which decide the
+    clusters, and the items whose nearest neighbour is the farthest, which are the anomalies.
+
+    Args:
+        vectors (np.ndarray): A float32 (N, dimension) matrix of L2 normalized vectors.
+        storage (VectorStorage): The fitted encoding.
+        max_items (int): The size of the sample searched against.
+        queries (int): The number of items of the sample searched.
+        seed (int): The seed of the sample.
+
+    Returns:
+        dict: The sample size, the mean recall of the 10 nearest neighbours, the Jaccard similarity
+              of the neighbours within every threshold, the overlap of the 5% most anomalous queries
+              and the mean and max absolute error of the compared distances.
+    """
+    rng = np.random.RandomState(seed)
+    sample = np.sort(rng.choice(len(vectors), min(len(vectors), max_items), replace=False))
+    full = np.ascontiguousarray(vectors[sample], dtype=np.float32)
+    decoded = np.ascontiguousarray(storage.decode(storage.encode(full)))
+    query_rows = np.sort(rng.choice(len(full), min(len(full), queries), replace=False))
+    k = min(len(full), CHECK_NEIGHBOURS)
+    if k < 2:
+        return {'items': len(full), 'queries': len(query_rows)}
+    full_distance, full_indices = _flat_knn(full, full[query_rows], k)
+    _, decoded_indices = _flat_knn(decoded, decoded[query_rows], k)
+
+    top = min(k, 10)
+    recall = (
+        (full_indices[:, :top, None] == decoded_indices[:, None, :top]).any(axis=2).sum()
+        / full_indices[:, :top].size
+    )
+
+    # every candidate found by either search is compared at its distance under both
+    candidates = np.sort(np.concatenate([full_indices, decoded_indices], axis=1), axis=1)
+    unique = np.ones(candidates.shape, dtype=bool)
+    unique[:, 1:] = candidates[:, 1:] != candidates[:, :-1]
+    unique &= (candidates >= 0) & (candidates != query_rows[:, None])
+    candidates = np.maximum(candidates, 0)
+    full_pairs = _pair_distances(full, full[query_rows], candidates)
+    decoded_pairs = _pair_distances(decoded, decoded[query_rows], candidates)
+    jaccard = {}
+    for threshold in CHECK_THRESHOLDS:
+        within_full = unique & (full_pairs <= threshold)
+        within_decoded = unique & (decoded_pairs <= threshold)
+        union = np.sum(within_full | within_decoded)
+        jaccard[str(threshold)] = (
+            float(np.sum(within_full & within_decoded) / union) if union else 1.0
+        )
+
+    # the nearest neighbour of a query other than itself, as scored by the `nearest` anomaly score
+    full_nearest = np.where(unique, full_pairs, np.inf).min(axis=1)
+    decoded_nearest = np.where(unique, decoded_pairs, np.inf).min(axis=1)
+    n_anomalies = max(1, int(round(0.05 * len(query_rows))))
+    anomalies = len(
+        np.intersect1d(
+            np.argsort(-full_nearest, kind='stable')[:n_anomalies],
+            np.argsort(-decoded_nearest, kind='stable')[:n_anomalies],
+        )
+    )
+    error = np.abs(full_pairs - decoded_pairs)[unique]
+    return {
+        'items': len(full),
+        'queries': len(query_rows),
+        'recall_at_10': round(float(recall), 4),
+        'similarity_jaccard': {
+            threshold: round(value, 4) for threshold, value in jaccard.items()
+        },
+        'anomaly_overlap': round(anomalies / n_anomalies, 4),
+        'distance_error_mean': round(float(error.mean()) if len(error) else 0.0, 6),
+        'distance_error_max': round(float(error.max()) if len(error) else 0.0, 6),
+    }
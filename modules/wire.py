@@ -0,0 +1,143 @@
+import gzip
+import json
+import logging
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('[WIRE]')
+logging.basicConfig(level='INFO')
+
+FORMAT_FULL = 'full'
+FORMAT_COMPACT = 'compact'
+FORMATS = (FORMAT_FULL, FORMAT_COMPACT)
+# responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_json(value):
+    """
+    Serializes a response without indentation, with orjson when it is installed.
+
+    Numpy arrays and scalars are serialized as lists and numbers.
+
+    Args:
+        value: The JSON serializable response, possibly holding numpy arrays.
+
+    Returns:
+        bytes: The UTF-8 JSON document.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY
+        )
+    return json.dumps(
+        value, default=_default, separators=(',', ':'), ensure_ascii=False
+    ).encode()
+
+
+def content_encoding(accept_encoding):
+    """
+    Chooses the compression of a response from the Accept-Encoding header of its request.
+
+    Args:
+        accept_encoding (str): The header, None if absent.
+
+    Returns:
+        str: `br` when brotli is installed and accepted, else `gzip` when accepted, else None.
+    """
+    accepted = {
+        token.split(';')[0].strip().lower()
+        for token in (accept_encoding or '').split(',')
+    }
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    """
+    Compresses a response body.
+
+    Args:
+        body (bytes): The body.
+        encoding (str): `br`, `gzip` or None, see `content_encoding`.
+
+    Returns:
+        tuple: The body and its Content-Encoding, None when it was left uncompressed.
+    """
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), encoding
+
+
+def compact_clusters(clusters, feature_set, start, stop):
+    """
+    Lays out a range of clusters as two integer arrays of item table rows.
+
+    Args:
+        clusters (ClusterList): The clusters of the query.
+        feature_set (FeatureSetColumns): The exported feature set the cluster members point to.
+        start (int): The index of the first cluster.
+        stop (int): The index after the last cluster.
+
+    Returns:
+        dict: The 'ids' of the clusters, the 'items', the item table row of every member, cluster
+              after cluster, the main item first, and the 'offsets' of every cluster in them, from 0.
+    """
+    first, last = clusters.offsets[start], clusters.offsets[stop]
+    return {
+        'ids': clusters.ids[start:stop],
+        'items': feature_set.rows[clusters.members[first:last]],
+        'offsets': clusters.offsets[start : stop + 1] - first,
+    }
+
+
+def item_table_page(items, start, limit):
+    """
+    Lays out a range of the item table as columns.
+
+    Args:
+        items (ItemTable): The item table of the dataset.
+        start (int): The first row.
+        limit (int): The number of rows, 0 for all the following ones.
+
+    Returns:
+        dict: The 'start' row, the 'total' number of rows and the 'ids', 'names', 'thumbnails'
+              and 'annotated' columns of the rows.
+    """
+    start = min(max(start, 0), len(items))
+    stop = len(items) if limit <= 0 else min(start + limit, len(items))
+    rows = range(start, stop)
+    return {
+        'start': start,
+        'total': len(items),
+        'ids': [items.ids[row] for row in rows],
+        'names': [items.names[row] for row in rows],
+        'thumbnails': [items.thumbnails[row] for row in rows],
+        'annotated': items.annotated[start:stop].astype(bool),
+    }
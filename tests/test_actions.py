@@ -0,0 +1,226 @@
+import os
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeDataset, FakeItems, SyntheticExport, offline_exporter
+from modules.actions import (
+    ACTION_DELETE,
+    ACTION_MOVE,
+    ACTION_TAG,
+    TAG_METADATA,
+    ActionRunner,
+)
+
+N_ITEMS = 60
+
+
+def item_id(row):
+    return f'item-{row:08d}'
+
+
+def wait(job, timeout=30):
+    deadline = time.time() + timeout
+    while job.finished is None:
+        assert time.time() < deadline, f"Job {job.id} did not finish"
+        time.sleep(0.01)
+    return job
+
+
+@pytest.fixture
+def export():
+    return SyntheticExport(N_ITEMS, dimension=8, seed=0)
+
+
+@pytest.fixture
+def dataset(export):
+    return FakeDataset('actions-dataset', export)
+
+
+@pytest.fixture
+def runner():
+    return ActionRunner(batch_size=25, item_workers=4)
+
+
+def test_bulk_tag_is_one_call_per_batch(dataset, runner):
+    rows = list(range(N_ITEMS))
+    job = wait(
+        runner.submit(
+            dataset, ACTION_TAG, [item_id(row) for row in rows], {'tag': 'duplicate'}
+        )
+    )
+    items = dataset.items
+    assert job.status == 'success'
+    assert job.done == N_ITEMS
+    assert job.bulk_calls == 3
+    assert job.item_calls == 0
+    assert items.calls == {'bulk_update': 3}
+    assert all(
+        items.user_metadata[row] == {TAG_METADATA: {'duplicate': True}} for row in rows
+    )
+
+
+def test_repeated_ids_are_applied_once(dataset, runner):
+    item_ids = [item_id(1), item_id(2), item_id(1)]
+    job = wait(runner.submit(dataset, ACTION_DELETE, item_ids))
+    assert job.status == 'success'
+    assert len(job) == 2
+    assert dataset.items.deleted.sum() == 2
+
+
+def test_missing_items_of_a_batch_are_failures(dataset, runner):
+    items = dataset.items
+    items.deleted[[2, 30]] = True
+    rows = list(range(N_ITEMS))
+    job = wait(runner.submit(dataset, ACTION_DELETE, [item_id(row) for row in rows]))
+    assert job.status == 'partial'
+    assert job.done == N_ITEMS - 2
+    assert set(job.failures) == {item_id(2), item_id(30)}
+    assert job.bulk_calls == 3
+    assert job.item_calls == 2
+    assert items.deleted.all()
+
+
+def test_batch_without_items_is_not_called(dataset, runner):
+    items = dataset.items
+    items.deleted[:] = True
+    job = wait(runner.submit(dataset, ACTION_TAG, [item_id(0)], {'tag': 'dup'}))
+    assert job.status == 'failed'
+    assert set(job.failures) == {item_id(0)}
+    assert 'bulk_update' not in items.calls
+    assert items.user_metadata == {}
+
+
+def test_rejected_bulk_call_falls_back_to_item_calls(export, dataset, runner):
+    dataset.items = FakeItems(export, bulk_limit=10)
+    rows = list(range(40))
+    job = wait(runner.submit(dataset, ACTION_DELETE, [item_id(row) for row in rows]))
+    items = dataset.items
+    assert job.status == 'success'
+    assert job.done == len(rows)
+    assert job.bulk_calls == 2
+    assert job.item_calls == len(rows)
+    assert items.calls['delete'] == len(rows)
+    assert items.deleted[rows].all() and not items.deleted[len(rows) :].any()
+    assert runner.stats()['bulk_failures'] == 2
+
+
+def test_failed_items_are_reported(export, dataset, runner):
+    failing = {3, 7, 30}
+    dataset.items = FakeItems(export, bulk_limit=0, failing=failing)
+    rows = list(range(40))
+    job = wait(
+        runner.submit(
+            dataset, ACTION_MOVE, [item_id(row) for row in rows], {'directory': '/dups'}
+        )
+    )
+    state = job.state()
+    assert state['status'] == 'partial'
+    assert state['done'] == len(rows) - len(failing)
+    assert state['failed'] == len(failing)
+    assert state['progress'] == 100
+    assert {failure['itemId'] for failure in state['failures']} == {
+        item_id(row) for row in failing
+    }
+    assert all('Injected failure' in failure['error'] for failure in state['failures'])
+    assert len(job.state(max_failures=1)['failures']) == 1
+    assert set(dataset.items.directories) == set(rows) - failing
+
+
+def test_every_item_failing_fails_the_job(export, dataset, runner):
+    dataset.items = FakeItems(export, bulk_limit=0, failing={0, 1})
+    job = wait(runner.submit(dataset, ACTION_DELETE, [item_id(0), item_id(1)]))
+    assert job.status == 'failed'
+    assert job.done == 0
+
+
+def test_move_to_another_dataset_clones_then_deletes(dataset, runner):
+    rows = [4, 5, 6]
+    job = wait(
+        runner.submit(
+            dataset,
+            ACTION_MOVE,
+            [item_id(row) for row in rows],
+            {'directory': '/train', 'target_dataset_id': 'other-dataset'},
+        )
+    )
+    items = dataset.items
+    assert job.status == 'success'
+    assert job.bulk_calls == 0
+    assert job.item_calls == len(rows)
+    assert items.clones == {
+        row: ('other-dataset', f'/train/image-{row:08d}.jpg') for row in rows
+    }
+    assert items.deleted[rows].all()
+    assert items.deleted.sum() == len(rows)
+
+
+@pytest.mark.parametrize(
+    'action, params',
+    [('explode', {}), (ACTION_MOVE, {}), (ACTION_TAG, {'tag': ''})],
+)
+def test_invalid_actions_are_rejected(dataset, runner, action, params):
+    with pytest.raises(ValueError):
+        runner.submit(dataset, action, [item_id(0)], params)
+    assert runner.jobs() == []
+
+
+def test_tag_metadata(dataset, runner):
+    wait(runner.submit(dataset, ACTION_TAG, [item_id(9)], {'tag': 'leak'}))
+    item = dataset.items.get(item_id=item_id(9))
+    assert item.metadata['user'][TAG_METADATA] == {'leak': True}
+
+
+@pytest.fixture
+def app_exporter(export, tmp_path):
+    pytest.importorskip('dtlpy_exporter')
+    os.environ.setdefault('CLEANUP_INDEX_DIR', str(tmp_path))
+    import app
+    from modules.exporter import Exporter
+
+    with offline_exporter(Exporter, 'actions-app-dataset', export) as exporter:
+        exporter.process_data()
+        yield app, exporter
+
+
+def test_keep_main_leaves_the_main_items_out(app_exporter):
+    app, exporter = app_exporter
+    clusters = app.similarity_clusters(exporter, 'clip', 0.05, 2)
+    assert len(clusters) > 0
+    selection = {
+        'datasetId': exporter.dataset.id,
+        'action': ACTION_TAG,
+        'featureSetName': 'clip',
+        'similarity': 0.05,
+        'clusterIds': clusters.ids[:3].tolist(),
+        'dataVersion': exporter.data_version,
+    }
+    feature_set = exporter.feature_sets_export['clip']
+    main_ids = {exporter.items.ids[feature_set.rows[clusters[i][0]]] for i in range(3)}
+    member_count = sum(len(clusters[i]) for i in range(3))
+
+    kept = app.selected_item_ids(exporter, app.ActionRequest(**selection))
+    assert len(kept) == member_count - 3
+    assert main_ids.isdisjoint(kept)
+
+    everything = app.selected_item_ids(
+        exporter, app.ActionRequest(**selection, keepMain=False)
+    )
+    assert len(everything) == member_count
+    assert main_ids <= set(everything)
+
+
+def test_selection_from_another_export_is_rejected(app_exporter):
+    app, exporter = app_exporter
+    selection = {
+        'datasetId': exporter.dataset.id,
+        'action': ACTION_DELETE,
+        'featureSetName': 'clip',
+        'similarity': 0.05,
+        'clusterIds': [0],
+    }
+    assert app.selection_error(exporter, app.ActionRequest(**selection))[0] == 400
+    stale = app.ActionRequest(**selection, dataVersion=exporter.data_version - 1)
+    assert app.selection_error(exporter, stale)[0] == 409
+    current = app.ActionRequest(**selection, dataVersion=exporter.data_version)
+    assert app.selection_error(exporter, current) is None
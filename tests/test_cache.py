@@ -0,0 +1,50 @@
+from modules.cache import ResultCache
+
+
+def test_datasets_share_the_bound():
+    cache = ResultCache(max_bytes=100)
+    first, second = cache.scope('dataset-1'), cache.scope('dataset-2')
+    for i in range(3):
+        first.put(('clusters', i), i, nbytes=30)
+    second.put(('clusters', 0), 'b', nbytes=30)
+    assert cache.current_bytes == 90
+    assert first.current_bytes == 60 and second.current_bytes == 30
+    assert first.get(('clusters', 0)) is None
+    assert first.get(('clusters', 2)) == 2
+    assert second.get(('clusters', 0)) == 'b'
+    assert first.stats()['evictions'] == 1 and second.stats()['evictions'] == 0
+    assert first.stats()['total_bytes'] == 90
+
+
+def test_least_recently_used_entry_is_evicted_across_datasets():
+    cache = ResultCache(max_bytes=100)
+    first, second = cache.scope('dataset-1'), cache.scope('dataset-2')
+    first.put('a', 'a', nbytes=50)
+    second.put('a', 'b', nbytes=50)
+    assert first.get('a') == 'a'
+    second.put('c', 'c', nbytes=50)
+    assert second.get('a') is None
+    assert first.get('a') == 'a'
+
+
+def test_clearing_a_dataset_keeps_the_others():
+    cache = ResultCache(max_bytes=100)
+    first, second = cache.scope('dataset-1'), cache.scope('dataset-2')
+    first.put('a', 1, nbytes=10)
+    second.put('a', 2, nbytes=20)
+    first.put('a', 3, nbytes=15)
+    first.clear()
+    assert first.get('a') is None
+    assert second.get('a') == 2
+    assert first.current_bytes == 0
+    assert cache.current_bytes == second.current_bytes == 20
+    assert cache.stats()['entries'] == 1
+    cache.clear()
+    assert second.stats()['entries'] == 0 and cache.current_bytes == 0
+
+
+def test_values_bigger_than_the_cache_are_not_stored():
+    cache = ResultCache(max_bytes=10)
+    cache.put('a', 'a', nbytes=11)
+    assert cache.get('a') is None
+    assert ResultCache(max_bytes=0).scope('dataset').get('a', 'missing') == 'missing'
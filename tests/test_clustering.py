@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from modules import clustering
+from modules.clustering import greedy_clusters
+
+
+def baseline_clusters(distance, indices, threshold, min_size):
+    """
+    The greedy clustering of get_items before it was vectorized, kept as the reference.
+
+    Returns:
+        list: The (cluster id, members) of every cluster, sorted by descending size.
+    """
+    cluster_dict = {}
+    for i, (dist, idx) in enumerate(zip(distance, indices)):
+        cluster_dict[i] = idx[: np.searchsorted(dist, threshold, side='right')].tolist()
+    sorted_clusters = sorted(
+        cluster_dict.items(), key=lambda x: len(x[1]), reverse=True
+    )
+
+    used_items = set()
+    output_clusters = []
+    cluster_id = 0
+    for _, members in sorted_clusters:
+        unique_members = [m for m in members if m not in used_items]
+        if len(unique_members) >= min_size:
+            output_clusters.append((cluster_id, unique_members))
+            used_items.update(unique_members)
+            cluster_id += 1
+    output_clusters.sort(key=lambda x: len(x[1]), reverse=True)
+    return output_clusters
+
+
+def random_knn(seed, n, k, groups, spread):
+    """
+    Builds the exact kNN graph of normalized points drawn around a few centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(groups, 8))
+    points = centers[rng.integers(groups, size=n)]
+    points += rng.normal(scale=spread, size=(n, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    distance = np.maximum(2 - 2 * points @ points.T, 0).astype(np.float32)
+    indices = np.argsort(distance, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distance, indices, axis=1), indices
+
+
+def assert_same_clusters(distance, indices, threshold, min_size):
+    clusters = greedy_clusters(distance, indices, threshold, min_size)
+    expected = baseline_clusters(distance, indices, threshold, min_size)
+    assert len(clusters) == len(expected)
+    for cluster_id, members, (expected_id, expected_members) in zip(
+        clusters.ids.tolist(), clusters, expected
+    ):
+        assert cluster_id == expected_id
+        assert members.tolist() == expected_members
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('threshold', [0.0, 0.01, 0.05, 0.2])
+@pytest.mark.parametrize('min_size', [1, 2, 5])
+def test_greedy_clusters_match_baseline(seed, threshold, min_size):
+    distance, indices = random_knn(seed, n=400, k=30, groups=40, spread=0.05)
+    assert_same_clusters(distance, indices, threshold, min_size)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('threshold', [0.02, 0.1])
+def test_greedy_clusters_match_baseline_with_sequential_walk(seed, threshold):
+    # dense groups of overlapping proposals make the vectorized rounds unproductive,
+    # so more than SEQUENTIAL_MIN_PROPOSALS of them are walked one by one between rounds
+    distance, indices = random_knn(seed, n=6000, k=40, groups=30, spread=0.1)
+    assert_same_clusters(distance, indices, threshold, 2)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_greedy_clusters_match_baseline_with_short_sequential_walks(seed, monkeypatch):
+    monkeypatch.setattr(clustering, 'SEQUENTIAL_MIN_PROPOSALS', 4)
+    distance, indices = random_knn(seed, n=800, k=50, groups=20, spread=0.1)
+    for threshold in (0.01, 0.05, 0.2):
+        for min_size in (1, 3):
+            assert_same_clusters(distance, indices, threshold, min_size)
+
+
+def test_greedy_clusters_empty():
+    distance = np.full((5, 3), 1.0, dtype=np.float32)
+    indices = np.tile(np.arange(3), (5, 1))
+    clusters = greedy_clusters(distance, indices, 0.5, 2)
+    assert len(clusters) == 0
+    assert baseline_clusters(distance, indices, 0.5, 2) == []
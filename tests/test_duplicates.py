@@ -0,0 +1,93 @@
+import faiss
+import numpy as np
+import pytest
+
+from modules import duplicates
+from modules.duplicates import duplicate_groups, expand_knn
+
+K = 12
+
+
+def vectors_with_copies(seed, n, copies):
+    """
+    Draws normalized vectors, some of them exact copies of one of the first tenth.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, 8))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    sources = rng.integers(n, size=copies) % (n // 10)
+    copied = rng.choice(np.arange(n // 10, n), copies, replace=False)
+    vectors[copied] = vectors[sources]
+    return vectors.astype(np.float32)
+
+
+def search(vectors, k):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(vectors, k)
+
+
+def naive_groups(vectors, step):
+    """
+    Groups the vectors by their rounded coordinates, numbered by their first item.
+    """
+    rounded = np.rint(vectors / step).astype(np.int64)
+    keys = [tuple(vector) for vector in rounded.tolist()]
+    groups = {}
+    for key in keys:
+        groups.setdefault(key, len(groups))
+    return np.array([groups[key] for key in keys])
+
+
+@pytest.mark.parametrize('step', [1e-6, 0.05, 0.5])
+def test_groups_match_rounded_coordinates(step):
+    vectors = vectors_with_copies(0, 500, 150)
+    groups = duplicate_groups(vectors, step)
+    np.testing.assert_array_equal(groups.group_of, naive_groups(vectors, step))
+    assert groups.duplicates == len(vectors) - len(groups)
+    assert (groups.group_of[groups.representatives] == np.arange(len(groups))).all()
+    assert (groups.representatives == np.sort(groups.representatives)).all()
+
+
+def test_hash_collisions_are_kept_apart(monkeypatch):
+    # every vector hashes to zero, the groups come from the comparisons with the first
+    monkeypatch.setattr(duplicates, '_HASH_MULTIPLIERS', np.zeros(4, dtype=np.uint64))
+    vectors = vectors_with_copies(1, 200, 50)
+    groups = duplicate_groups(vectors, 1e-6)
+    copies_of_first = (vectors == vectors[0]).all(axis=1)
+    assert (groups.group_of[copies_of_first] == 0).all()
+    assert (groups.group_of[~copies_of_first] != 0).all()
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('copies', [50, 300])
+def test_expanded_knn_matches_undeduplicated_build(seed, copies):
+    vectors = vectors_with_copies(seed, 600, copies)
+    expected_distance, expected_indices = search(vectors, K)
+    groups = duplicate_groups(vectors, 1e-6)
+    distance, indices = expand_knn(
+        groups, *search(vectors[groups.representatives], K), K
+    )
+    items = np.arange(len(vectors))
+    assert (indices[:, 0] == items).all()
+    np.testing.assert_allclose(distance, expected_distance, atol=1e-5)
+    # every neighbour is at its listed distance, and the neighbours closer than the
+    # farthest are the same, the copies at the farthest distance are interchangeable
+    true_distance = ((vectors[items[:, None]] - vectors[indices]) ** 2).sum(axis=2)
+    np.testing.assert_allclose(true_distance, distance, atol=1e-5)
+    farthest = expected_distance[:, -1:] - 1e-5
+    for row in items:
+        closer = set(indices[row][distance[row] < farthest[row]].tolist())
+        expected_closer = expected_indices[row, expected_distance[row] < farthest[row]]
+        assert closer == set(expected_closer.tolist())
+        assert len(set(indices[row].tolist())) == K
+
+
+def test_representatives_listed_after_a_copy_are_moved_first():
+    vectors = vectors_with_copies(2, 100, 30)
+    groups = duplicate_groups(vectors, 1e-6)
+    distance, indices = search(vectors[groups.representatives], K)
+    # swap the first two neighbours, as a tie or an approximate index may
+    indices[:, [0, 1]] = indices[:, [1, 0]]
+    distance, indices = expand_knn(groups, distance, indices, K)
+    assert (indices[:, 0] == np.arange(len(vectors))).all()
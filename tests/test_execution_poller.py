@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+
+from modules.execution_poller import ExecutionPoller
+
+
+class FakeExecution:
+    def __init__(self, execution_id, status):
+        self.id = execution_id
+        self.latest_status = {'status': status}
+
+
+class FakeExecutions:
+    """
+    The executions of a project, statuses set by the test, listing at most `listed`.
+    """
+
+    def __init__(self, listed=None):
+        self.statuses = {}
+        self.listed = listed
+        self.list_calls = 0
+        self.get_calls = 0
+        self.fail = False
+        self._lock = threading.Lock()
+
+    def list(self, filters=None):
+        with self._lock:
+            self.list_calls += 1
+            if self.fail:
+                raise ConnectionError('Platform unreachable')
+            ids = [
+                execution_id
+                for single in filters.and_filter_list
+                for execution_id in single.values
+                if execution_id in self.statuses
+            ][: self.listed]
+            return FakePages([FakeExecution(i, self.statuses[i]) for i in ids])
+
+    def get(self, execution_id=None):
+        with self._lock:
+            self.get_calls += 1
+            return FakeExecution(execution_id, self.statuses[execution_id])
+
+
+class FakePages:
+    def __init__(self, executions):
+        self._executions = executions
+
+    def all(self):
+        return iter(self._executions)
+
+
+class FakeProject:
+    def __init__(self, project_id, listed=None):
+        self.id = project_id
+        self.executions = FakeExecutions(listed)
+
+
+class Recorder:
+    def __init__(self):
+        self.statuses = []
+        self.done = []
+        self.finished = threading.Event()
+
+    def on_status(self, status):
+        self.statuses.append(status['status'])
+
+    def on_done(self, status):
+        self.done.append(status)
+        self.finished.set()
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def poller():
+    return ExecutionPoller(interval=0.1, timeout=0, batch_size=2)
+
+
+def test_same_key_is_watched_once(poller):
+    project = FakeProject('project')
+    project.executions.statuses.update({'e1': 'in-progress', 'e2': 'in-progress'})
+    first, second = Recorder(), Recorder()
+    assert poller.watch(
+        ('dataset', 'clip'), project, 'e1', first.on_status, first.on_done
+    )
+    assert not poller.watch(
+        ('dataset', 'clip'), project, 'e2', second.on_status, second.on_done
+    )
+    assert poller.pending() == [('dataset', 'clip')]
+    project.executions.statuses['e1'] = 'success'
+    assert first.finished.wait(10)
+    assert second.statuses == [] and second.done == []
+    wait_until(lambda: not poller.pending())
+    # the key can be watched again once its execution completed
+    assert poller.watch(
+        ('dataset', 'clip'), project, 'e2', second.on_status, second.on_done
+    )
+    project.executions.statuses['e2'] = 'failed'
+    assert second.finished.wait(10)
+    assert second.done == [{'status': 'failed'}]
+
+
+def test_completion_runs_exactly_once(poller):
+    projects = [FakeProject('project-a', listed=1), FakeProject('project-b')]
+    recorders = {}
+    for i in range(5):
+        project = projects[i % 2]
+        project.executions.statuses[f'e{i}'] = 'in-progress'
+        recorders[i] = Recorder()
+        poller.watch(i, project, f'e{i}', recorders[i].on_status, recorders[i].on_done)
+    wait_until(lambda: poller.stats()['polls'] >= 2)
+    # the watches listed by a poll before their executions completed
+    stale = list(poller._watches.values())
+    for i in range(5):
+        projects[i % 2].executions.statuses[f'e{i}'] = 'success'
+    for recorder in recorders.values():
+        assert recorder.finished.wait(10)
+    # a poll that listed the watches before they completed does not complete them again
+    poller._poll(stale)
+    time.sleep(0.3)
+    for recorder in recorders.values():
+        assert recorder.done == [{'status': 'success'}]
+        assert recorder.statuses[-1] == 'success'
+    stats = poller.stats()
+    assert stats['completed'] == 5
+    assert stats['pending'] == 0
+    # executions not listed are fetched one by one
+    assert projects[0].executions.get_calls > 0
+
+
+def test_fetch_errors_are_retried(poller):
+    project = FakeProject('project')
+    project.executions.statuses['e1'] = 'success'
+    project.executions.fail = True
+    recorder = Recorder()
+    poller.watch('key', project, 'e1', recorder.on_status, recorder.on_done)
+    wait_until(lambda: poller.stats()['errors'] >= 2)
+    assert recorder.done == []
+    project.executions.fail = False
+    assert recorder.finished.wait(10)
+    assert recorder.done == [{'status': 'success'}]
+
+
+def test_timed_out_execution_completes_with_none():
+    poller = ExecutionPoller(interval=0.1, timeout=0.2)
+    project = FakeProject('project')
+    project.executions.statuses['e1'] = 'in-progress'
+    recorder = Recorder()
+    poller.watch('key', project, 'e1', recorder.on_status, recorder.on_done)
+    assert recorder.finished.wait(10)
+    assert recorder.done == [None]
+    assert poller.stats()['timed_out'] == 1
+    assert poller.stats()['completed'] == 0
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from modules.executors import BoundedPool, PoolBusy, PoolTimeout
+
+
+def test_run_returns_the_result_off_the_event_loop():
+    pool = BoundedPool('test', max_workers=2, max_queue=0, timeout=0)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        result, thread = await pool.run(lambda x: (x * 2, threading.get_ident()), 21)
+        return result, thread != loop_thread
+
+    assert asyncio.run(main()) == (42, True)
+    assert pool.stats()['pending'] == 0
+    assert pool.stats()['submitted'] == 1
+
+
+def test_full_pool_rejects_right_away():
+    pool = BoundedPool('test', max_workers=1, max_queue=1, timeout=0)
+    release = threading.Event()
+
+    async def main():
+        running = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PoolBusy):
+            await pool.run(time.sleep, 0)
+        release.set()
+        return await asyncio.gather(*running)
+
+    assert asyncio.run(main()) == [True, True]
+    stats = pool.stats()
+    assert stats['rejected'] == 1
+    assert stats['submitted'] == 2
+    assert stats['pending'] == 0
+
+
+def test_timed_out_task_keeps_its_slot_until_it_completes():
+    pool = BoundedPool('test', max_workers=1, max_queue=0, timeout=0.05)
+    release = threading.Event()
+
+    async def main():
+        with pytest.raises(PoolTimeout):
+            await pool.run(release.wait)
+        # the timed out task still runs, so the pool is full
+        with pytest.raises(PoolBusy):
+            await pool.run(time.sleep, 0)
+        release.set()
+        while pool.stats()['pending']:
+            await asyncio.sleep(0.01)
+        return await pool.run(lambda: 'free')
+
+    assert asyncio.run(main()) == 'free'
+    assert pool.stats()['timed_out'] == 1
+
+
+def test_errors_are_raised_to_the_caller():
+    pool = BoundedPool('test', max_workers=1, max_queue=0, timeout=0)
+
+    def fail():
+        raise KeyError('missing')
+
+    async def main():
+        with pytest.raises(KeyError):
+            await pool.run(fail)
+
+    asyncio.run(main())
+    assert pool.stats()['pending'] == 0
+
+
+def test_busy_and_timed_out_pools_answer_503_and_504(tmp_path):
+    pytest.importorskip('dtlpy_exporter')
+    os.environ.setdefault('CLEANUP_INDEX_DIR', str(tmp_path))
+    import app
+
+    busy = asyncio.run(app.pool_busy_handler(None, PoolBusy("The cpu pool is busy")))
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == '1'
+    timed_out = asyncio.run(app.pool_timeout_handler(None, PoolTimeout("Too slow")))
+    assert timed_out.status_code == 504
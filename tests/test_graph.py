@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from modules.clustering import greedy_clusters, greedy_graph_clusters
+from modules.graph import NeighbourGraph
+
+RADIUS = 0.3
+
+
+def points_with_copies(seed, n, copies):
+    """
+    Draws normalized points around a few centers, some of them copies of another point.
+
+    Returns:
+        np.ndarray: The (n, n) squared L2 distances between the points.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, 8))
+    points = centers[rng.integers(20, size=n)] + rng.normal(scale=0.1, size=(n, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    copied = rng.choice(n, copies, replace=False)
+    points[copied] = points[rng.integers(n, size=copies)]
+    return np.maximum(2 - 2 * points @ points.T, 0).astype(np.float32)
+
+
+def knn_rows(distance):
+    """
+    Sorts every row by ascending distance, ties with the item itself then by index.
+    """
+    items = np.arange(len(distance))
+    indices = np.stack(
+        [np.lexsort((items != row, distance[row])) for row in items]
+    )
+    return np.take_along_axis(distance, indices, axis=1), indices
+
+
+def shuffled_edges(distance, rng):
+    """
+    Lists the edges within the radius of every row in random order, as a search may.
+    """
+    lengths, indices, distances = [], [], []
+    for row in distance:
+        within = rng.permutation(np.flatnonzero(row < RADIUS))
+        lengths.append(len(within))
+        indices.append(within)
+        distances.append(row[within])
+    return np.array(lengths), np.concatenate(indices), np.concatenate(distances)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('threshold', [0.0, 0.05, 0.2])
+@pytest.mark.parametrize('min_size', [1, 2])
+def test_graph_clusters_match_knn_clusters(seed, threshold, min_size):
+    distance = points_with_copies(seed, n=300, copies=60)
+    knn_distance, knn_indices = knn_rows(distance)
+    graph = NeighbourGraph.from_rows(
+        *shuffled_edges(distance, np.random.default_rng(seed))
+    )
+    expected = greedy_clusters(knn_distance, knn_indices, threshold, min_size)
+    clusters = greedy_graph_clusters(graph, threshold, min_size)
+    assert len(clusters) == len(expected)
+    for members, expected_members in zip(clusters, expected):
+        assert members.tolist() == expected_members.tolist()
+
+
+def test_item_comes_first_among_its_copies_in_every_chunk():
+    distance = points_with_copies(0, n=200, copies=80)
+    rng = np.random.default_rng(1)
+    graph = NeighbourGraph.concatenate(
+        [
+            NeighbourGraph.from_rows(
+                *shuffled_edges(distance[start : start + 50], rng),
+                first_row=start,
+            )
+            for start in range(0, len(distance), 50)
+        ]
+    )
+    assert (graph.indices[graph.offsets[:-1]] == np.arange(len(distance))).all()
+    for row in range(len(distance)):
+        row_distance = graph.distance[graph.offsets[row] : graph.offsets[row + 1]]
+        assert (np.diff(row_distance) >= 0).all()
@@ -0,0 +1,68 @@
+import faiss
+import numpy as np
+import pytest
+
+from modules.incremental import FeatureSetDelta, update_knn
+
+K = 10
+
+
+def search(vectors, k=K):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    distance, indices = index.search(vectors, k)
+    return index, distance, indices
+
+
+def incremental_vs_rebuild(old_vectors, removed, added_vectors):
+    """
+    Updates the kNN graph of the old vectors with a delta, and rebuilds it from scratch.
+
+    Returns:
+        tuple: The incremental and rebuilt (N_new, k) neighbour distances and indices.
+    """
+    index, old_distance, old_indices = search(old_vectors)
+    kept = np.setdiff1d(np.arange(len(old_vectors)), removed)
+    new_vectors = np.concatenate([old_vectors[kept], added_vectors])
+    new_to_old = np.concatenate([kept, np.full(len(added_vectors), -1)])
+    delta = FeatureSetDelta(new_to_old, len(old_vectors))
+    _, distance, indices, _ = update_knn(
+        index,
+        np.arange(len(old_vectors)),
+        delta,
+        old_distance,
+        old_indices,
+        new_vectors,
+    )
+    _, expected_distance, expected_indices = search(new_vectors)
+    return distance, indices, expected_distance, expected_indices
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_update_matches_rebuild(seed):
+    rng = np.random.default_rng(seed)
+    old_vectors = rng.normal(size=(500, 8)).astype(np.float32)
+    removed = rng.choice(len(old_vectors), 25, replace=False)
+    added_vectors = rng.normal(size=(30, 8)).astype(np.float32)
+    distance, indices, expected_distance, expected_indices = incremental_vs_rebuild(
+        old_vectors, removed, added_vectors
+    )
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distance, expected_distance, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('copies', [K, 3 * K, 10 * K])
+def test_rows_behind_many_removed_vectors_are_filled(copies):
+    # the removed copies of an item are closer to it than all its live neighbours, so
+    # the first search of its row only returns removed vectors besides the item itself
+    rng = np.random.default_rng(copies)
+    base = rng.normal(size=(300, 8)).astype(np.float32)
+    duplicates = base[:1] + rng.normal(scale=1e-4, size=(copies, 8)).astype(np.float32)
+    old_vectors = np.concatenate([base, duplicates])
+    removed = np.arange(len(base), len(old_vectors))
+    distance, indices, expected_distance, expected_indices = incremental_vs_rebuild(
+        old_vectors, removed, base[:0]
+    )
+    assert (indices >= 0).all()
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distance, expected_distance, rtol=1e-5, atol=1e-5)
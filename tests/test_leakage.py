@@ -0,0 +1,124 @@
+import faiss
+import numpy as np
+import pytest
+
+from modules.ann import FlatBackend
+from modules.leakage import cross_matches
+
+
+def normalized(rng, n, groups=10, spread=0.05):
+    centers = rng.normal(size=(groups, 8))
+    points = centers[rng.integers(groups, size=n)]
+    points += rng.normal(scale=spread, size=(n, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return points.astype(np.float32)
+
+
+def flat_index(vectors):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+
+def naive_matches(queries, targets, threshold, k, exclude_self=False):
+    """
+    Compares every source item with every target item.
+
+    Returns:
+        dict: The matched targets of every source item with any, nearest first.
+    """
+    squared = (queries**2).sum(1)[:, None] + (targets**2).sum(1)[None]
+    distance = np.maximum(squared - 2 * queries @ targets.T, 0)
+    expected = {}
+    for source, row in enumerate(distance):
+        found = [
+            (target, row[target])
+            for target in np.lexsort((np.arange(len(row)), row))
+            if row[target] <= threshold and not (exclude_self and target == source)
+        ]
+        if found:
+            expected[source] = [target for target, _ in found[:k]]
+    return expected
+
+
+def as_dict(matches):
+    return {
+        int(source): matches.matches(i)[0].tolist()
+        for i, source in enumerate(matches.sources)
+    }
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('k', [1, 3, 10])
+def test_cross_matches_match_naive_search(seed, k):
+    rng = np.random.default_rng(seed)
+    queries, targets = normalized(rng, 200), normalized(rng, 300)
+    matches = cross_matches(
+        flat_index(targets),
+        np.arange(len(targets)),
+        FlatBackend(),
+        queries,
+        targets,
+        0.01,
+        k,
+    )
+    assert as_dict(matches) == naive_matches(queries, targets, 0.01, k)
+    nearest = [matches.matches(i)[1][0] for i in range(len(matches))]
+    assert (np.diff(nearest) >= 0).all()
+
+
+@pytest.mark.parametrize('k', [1, 2, 5])
+def test_same_feature_set_excludes_self_and_keeps_k_matches(k):
+    vectors = normalized(np.random.default_rng(0), 300)
+    matches = cross_matches(
+        flat_index(vectors),
+        np.arange(len(vectors)),
+        FlatBackend(),
+        vectors,
+        vectors,
+        0.01,
+        k,
+        exclude_self=True,
+    )
+    expected = naive_matches(vectors, vectors, 0.01, k, exclude_self=True)
+    assert len(expected) > 0
+    assert as_dict(matches) == expected
+
+
+@pytest.mark.parametrize('k', [1, 3])
+@pytest.mark.parametrize('exclude_self', [False, True])
+def test_duplicate_groups_are_cut_at_k_matches(k, exclude_self):
+    # items 0 to 5 are exact copies indexed once, under the label of item 0
+    vectors = normalized(np.random.default_rng(1), 100)
+    vectors[1:6] = vectors[0]
+    labels = np.concatenate([[0] * 6, np.arange(1, 95)])
+    representatives = np.concatenate([vectors[:1], vectors[6:]])
+    matches = cross_matches(
+        flat_index(representatives),
+        labels,
+        FlatBackend(),
+        vectors,
+        vectors,
+        1e-6,
+        k,
+        exclude_self=exclude_self,
+    )
+    found = as_dict(matches)
+    for copy in range(6):
+        copies = [other for other in range(6) if not (exclude_self and other == copy)]
+        assert found[copy] == copies[:k]
+
+
+def test_removed_labels_are_dropped():
+    vectors = normalized(np.random.default_rng(2), 50)
+    # the index still holds the removed vector of label 0, now without an item
+    matches = cross_matches(
+        flat_index(vectors),
+        np.arange(1, 50),
+        FlatBackend(),
+        vectors[:1],
+        vectors[1:],
+        1e-6,
+        5,
+    )
+    assert len(matches) == 0
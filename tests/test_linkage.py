@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from modules.graph import NeighbourGraph
+from modules.linkage import LinkageHierarchy, graph_edges, knn_edges
+
+MAX_DISTANCE = 0.3
+
+
+def random_knn(seed, n, k, groups, spread):
+    """
+    Builds the exact kNN graph of normalized points drawn around a few centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(groups, 8))
+    points = centers[rng.integers(groups, size=n)]
+    points += rng.normal(scale=spread, size=(n, 8))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    distance = np.maximum(2 - 2 * points @ points.T, 0).astype(np.float32)
+    indices = np.argsort(distance, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distance, indices, axis=1), indices
+
+
+def union_find_clusters(n, first, second, distance, threshold, min_size):
+    """
+    Joins the items of every edge within the threshold, one edge at a time.
+
+    Returns:
+        set: The clusters of at least min_size items, as frozensets.
+    """
+    parent = list(range(n))
+
+    def find(item):
+        while parent[item] != item:
+            item = parent[item]
+        return item
+
+    for a, b, d in zip(first.tolist(), second.tolist(), distance.tolist()):
+        if d <= threshold:
+            parent[find(a)] = find(b)
+    clusters = {}
+    for item in range(n):
+        clusters.setdefault(find(item), set()).add(item)
+    return {
+        frozenset(members) for members in clusters.values() if len(members) >= min_size
+    }
+
+
+def assert_same_clusters(hierarchy, n, edges, threshold, min_size):
+    clusters = hierarchy.clusters(threshold, min_size)
+    expected = union_find_clusters(n, *edges, threshold, min_size)
+    found = [frozenset(members.tolist()) for members in clusters]
+    assert len(found) == len(expected)
+    assert set(found) == expected
+    sizes = [len(members) for members in found]
+    assert sizes == sorted(sizes, reverse=True)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('min_size', [1, 2, 4])
+def test_hierarchy_matches_union_find(seed, min_size):
+    n = 500
+    distance, indices = random_knn(seed, n, k=20, groups=40, spread=0.1)
+    edges = knn_edges(distance, indices, MAX_DISTANCE)
+    hierarchy = LinkageHierarchy.from_edges(n, *edges)
+    for threshold in [0.0, 0.005, 0.02, 0.05, 0.1, MAX_DISTANCE]:
+        assert_same_clusters(hierarchy, n, edges, threshold, min_size)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_curve_counts_the_clusters_of_every_threshold(seed):
+    n = 400
+    distance, indices = random_knn(seed, n, k=15, groups=30, spread=0.1)
+    edges = knn_edges(distance, indices, MAX_DISTANCE)
+    hierarchy = LinkageHierarchy.from_edges(n, *edges)
+    thresholds = np.linspace(0, MAX_DISTANCE, 13)
+    clusters, duplicates = hierarchy.curve(thresholds)
+    for threshold, count, duplicate_count in zip(thresholds, clusters, duplicates):
+        expected = union_find_clusters(n, *edges, threshold, 2)
+        assert count == len(expected)
+        assert duplicate_count == sum(len(members) - 1 for members in expected)
+
+
+def test_graph_edges_give_the_knn_hierarchy():
+    n = 300
+    distance, indices = random_knn(0, n, k=n, groups=20, spread=0.1)
+    within = distance < MAX_DISTANCE
+    graph = NeighbourGraph.from_rows(
+        within.sum(axis=1), indices[within], distance[within]
+    )
+    from_graph = LinkageHierarchy.from_edges(n, *graph_edges(graph, MAX_DISTANCE))
+    edges = knn_edges(distance, indices, MAX_DISTANCE)
+    for threshold in [0.01, 0.1, 0.25]:
+        assert_same_clusters(from_graph, n, edges, threshold, 2)
+
+
+def test_items_without_edges_are_single_clusters():
+    hierarchy = LinkageHierarchy.from_edges(
+        5, np.array([0, 3]), np.array([1, 4]), np.array([0.1, 0.2], dtype=np.float32)
+    )
+    # the ties are in leaf order, where the items with an edge come first
+    assert [members.tolist() for members in hierarchy.clusters(0.15, 1)] == [
+        [0, 1],
+        [3],
+        [4],
+        [2],
+    ]
+    assert len(hierarchy.clusters(0.05, 2)) == 0
+    empty = LinkageHierarchy.from_edges(3, [], [], [])
+    assert len(empty.clusters(1.0, 1)) == 3
@@ -0,0 +1,86 @@
+import asyncio
+import cProfile
+
+import pytest
+
+from modules.executors import BoundedPool
+from modules.metrics import Gauge, Histogram, MetricsRegistry
+from modules.profiling import ACTIVE_PROFILER, profile_summary
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = Histogram(
+        'query_seconds', 'Query time.', ['route'], buckets=(0.1, 1), registry=registry
+    )
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, route='get_items')
+    histogram.observe(0.2, route='cache_stats')
+    lines = registry.render().splitlines()
+    assert lines[:2] == [
+        '# HELP query_seconds Query time.',
+        '# TYPE query_seconds histogram',
+    ]
+    assert 'query_seconds_bucket{route="get_items",le="0.1"} 2' in lines
+    assert 'query_seconds_bucket{route="get_items",le="1"} 3' in lines
+    assert 'query_seconds_bucket{route="get_items",le="+Inf"} 4' in lines
+    assert 'query_seconds_sum{route="get_items"} 3.65' in lines
+    assert 'query_seconds_count{route="get_items"} 4' in lines
+    assert 'query_seconds_count{route="cache_stats"} 1' in lines
+
+
+def test_histogram_times_its_block_even_on_error():
+    histogram = Histogram('block_seconds', 'Block time.', registry=None)
+    with pytest.raises(RuntimeError):
+        with histogram.time():
+            raise RuntimeError('failed')
+    assert histogram.collect()[-1] == 'block_seconds_count 1'
+
+
+def test_gauges_and_label_escaping():
+    registry = MetricsRegistry()
+    gauge = Gauge('jobs', 'Running jobs.', ['dataset'], registry=registry)
+    gauge.inc(dataset='a"b')
+    gauge.inc(2, dataset='a"b')
+    gauge.dec(dataset='a"b')
+    Gauge(
+        'resident_bytes',
+        'Resident bytes.',
+        ['dataset'],
+        callback=lambda: [(('d1',), 10), (('d2',), 20)],
+        registry=registry,
+    )
+    lines = registry.render().splitlines()
+    assert 'jobs{dataset="a\\"b"} 2' in lines
+    assert 'resident_bytes{dataset="d1"} 10' in lines
+    assert 'resident_bytes{dataset="d2"} 20' in lines
+
+
+def test_registry_rejects_duplicates_and_skips_failing_callbacks():
+    registry = MetricsRegistry()
+    Gauge('broken', 'Broken.', callback=lambda: 1 / 0, registry=registry)
+    Gauge('working', 'Working.', registry=registry).set(1)
+    with pytest.raises(ValueError):
+        Gauge('working', 'Again.', registry=registry)
+    lines = registry.render().splitlines()
+    assert '# TYPE broken gauge' in lines
+    assert 'working 1' in lines
+
+
+def test_profiled_request_profiles_its_pool_work():
+    pool = BoundedPool('test', max_workers=1, max_queue=0, timeout=0)
+
+    def pool_work():
+        return sum(range(1000))
+
+    async def main():
+        profiler = cProfile.Profile()
+        token = ACTIVE_PROFILER.set(profiler)
+        try:
+            await pool.run(pool_work)
+        finally:
+            ACTIVE_PROFILER.reset(token)
+        return profiler
+
+    assert 'pool_work' in profile_summary(asyncio.run(main()))
+    assert profile_summary(cProfile.Profile()) == ''
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from modules.quality import QualityScores, item_quality_scores
+
+
+def random_scores(seed, n):
+    """
+    Draws scores rounded to two decimals, so many items share a score, some unscored.
+    """
+    rng = np.random.default_rng(seed)
+    scores = np.round(rng.random(n), 2)
+    scores[rng.random(n) < 0.1] = np.nan
+    return scores
+
+
+def naive_between(scores, min_v, max_v):
+    """
+    Scans every item, as the platform filters do: strictly greater and less than.
+
+    Returns:
+        list: The rows in the range, by ascending score then row.
+    """
+    rows = [
+        row
+        for row, score in enumerate(scores)
+        if not np.isnan(score) and min_v < score < max_v
+    ]
+    return sorted(rows, key=lambda row: (scores[row], row))
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize(
+    'min_v, max_v', [(0.0, 1.0), (0.25, 0.5), (0.3, 0.3), (0.5, 0.25), (-1.0, 2.0)]
+)
+def test_range_bounds_are_strict(seed, min_v, max_v):
+    scores = random_scores(seed, 500)
+    quality = QualityScores(scores)
+    expected = naive_between(scores, min_v, max_v)
+    assert quality.count(min_v, max_v) == len(expected)
+    total, rows = quality.between(min_v, max_v)
+    assert total == len(expected)
+    assert rows.tolist() == expected
+
+
+def test_items_on_a_bound_are_left_out():
+    quality = QualityScores([0.2, 0.5, 0.5, 0.8, 0.2, np.nan])
+    assert quality.between(0.2, 0.8)[1].tolist() == [1, 2]
+    assert quality.count(0.19, 0.81) == 5
+    assert len(quality) == 5
+
+
+@pytest.mark.parametrize('limit', [1, 7, 50])
+def test_pages_cover_the_range_once(limit):
+    scores = random_scores(0, 300)
+    quality = QualityScores(scores)
+    expected = naive_between(scores, 0.1, 0.9)
+    pages = []
+    for offset in range(0, len(expected) + limit, limit):
+        total, rows = quality.between(0.1, 0.9, offset=offset, limit=limit)
+        assert total == len(expected)
+        assert len(rows) <= limit
+        pages.extend(rows.tolist())
+    assert pages == expected
+    assert len(quality.between(0.1, 0.9, offset=len(expected) + 5, limit=limit)[1]) == 0
+
+
+def test_histogram_includes_the_last_edge():
+    scores = random_scores(1, 400)
+    quality = QualityScores(scores)
+    counts, edges = quality.histogram(bins=10)
+    scored = scores[~np.isnan(scores)]
+    expected, expected_edges = np.histogram(scored, bins=10, range=(0.0, 1.0))
+    assert counts.tolist() == expected.tolist()
+    np.testing.assert_allclose(edges, expected_edges)
+
+
+def test_item_quality_scores():
+    record = {
+        'metadata': {
+            'user': {'quality_scores': {'darkness_score': 1, 'blurriness_score': 'x'}}
+        }
+    }
+    assert item_quality_scores(record) == {'darkness_score': 1.0}
+    assert item_quality_scores({'metadata': None}) == {}
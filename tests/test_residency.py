@@ -0,0 +1,111 @@
+import contextlib
+import os
+
+import numpy as np
+import pytest
+
+from modules.residency import ResidencyManager
+
+
+class Resident:
+    """
+    An exporter holding a fixed number of bytes, which can be evicted and reloaded.
+    """
+
+    def __init__(self, nbytes, stored=True):
+        self.nbytes = nbytes
+        self.stored = stored
+        self.resident = True
+
+    def memory_usage(self):
+        return {'heap_bytes': self.nbytes if self.resident else 0, 'mapped_bytes': 0}
+
+    def evict(self):
+        if not self.stored:
+            return False
+        self.resident = False
+        return True
+
+
+def tracked(max_bytes, **exporters):
+    manager = ResidencyManager(max_bytes)
+    for dataset_id, exporter in exporters.items():
+        manager.track(dataset_id, exporter)
+        manager.acquire(dataset_id)
+        manager.release(dataset_id)
+    return manager
+
+
+def test_least_recently_used_datasets_are_evicted_first():
+    a, b, c = Resident(40), Resident(40), Resident(40)
+    manager = tracked(100, a=a, b=b, c=c)
+    assert (a.resident, b.resident, c.resident) == (False, True, True)
+    manager.acquire('b')
+    manager.release('b')
+    d = Resident(40)
+    manager.track('d', d)
+    manager.acquire('d')
+    manager.release('d')
+    assert (c.resident, b.resident, d.resident) == (False, True, True)
+    stats = manager.stats()
+    assert stats['resident_bytes'] == 80
+    assert stats['datasets']['a']['evictions'] == 1
+    assert list(stats['datasets']) == ['a', 'c', 'b', 'd']
+
+
+def test_datasets_in_use_or_not_stored_are_kept():
+    a, b, c = Resident(60), Resident(60, stored=False), Resident(60)
+    manager = tracked(0, a=a, b=b, c=c)
+    manager.max_bytes = 100
+    manager.acquire('a')
+    manager.acquire('c')
+    manager.release('c')
+    assert a.resident and b.resident and c.resident
+    manager.release('a')
+    assert not a.resident and b.resident and c.resident
+    assert manager.stats()['resident_bytes'] == 120
+
+
+def test_most_recently_used_dataset_stays_over_the_budget():
+    a = Resident(500)
+    manager = tracked(100, a=a)
+    assert a.resident
+    assert manager.stats()['datasets']['a']['evictions'] == 0
+
+
+@contextlib.contextmanager
+def exported(dataset_id, seed, tmp_path):
+    pytest.importorskip('dtlpy_exporter')
+    os.environ.setdefault('CLEANUP_INDEX_DIR', str(tmp_path))
+    from benchmarks.fakes import SyntheticExport, offline_exporter
+    from modules.exporter import Exporter
+
+    export = SyntheticExport(400, dimension=16, seed=seed)
+    with offline_exporter(Exporter, dataset_id, export) as exporter:
+        exporter.process_data()
+        yield exporter
+
+
+def test_evicted_dataset_reloads_the_same_state(tmp_path):
+    with exported('residency-a', 0, tmp_path) as a, exported(
+        'residency-b', 1, tmp_path
+    ) as b:
+        if not a.index_store.enabled:
+            pytest.skip("The index store is disabled")
+        distance = np.array(a.distance['clip'])
+        indices = np.array(a.indices['clip'])
+        ids = list(a.items.ids)
+        data_version = a.data_version
+        budget = ResidencyManager._total(b.memory_usage()) + 1
+        manager = tracked(budget, **{'residency-a': a, 'residency-b': b})
+        assert not a.resident and b.resident
+        assert a.memory_usage()['heap_bytes'] < budget
+
+        assert a.reload()
+        manager.record_reload('residency-a')
+        assert a.resident
+        assert a.data_version == data_version
+        assert list(a.items.ids) == ids
+        np.testing.assert_array_equal(a.distance['clip'], distance)
+        np.testing.assert_array_equal(a.indices['clip'], indices)
+        assert manager.stats()['datasets']['residency-a']['reloads'] == 1
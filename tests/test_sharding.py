@@ -0,0 +1,110 @@
+import faiss
+import numpy as np
+import pytest
+
+from modules import sharding
+from modules.ann import FlatBackend
+from modules.build import range_search_chunked, search_chunked
+from modules.sharding import shard_bounds, sharded_knn
+from modules.storage import DecodedVectors, vector_storage
+
+K = 10
+RADIUS = 0.6
+TOLERANCE = 1e-5
+
+
+def normalized(seed, n, dimension=16):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def unsharded(vectors, k, radius):
+    """
+    Builds and searches a single flat index of all the vectors.
+    """
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    distance, indices = search_chunked(index, vectors, k)
+    return distance, indices, range_search_chunked(index, vectors, radius, k)
+
+
+def assert_same_neighbours(distance, indices, expected_distance, expected_indices):
+    np.testing.assert_allclose(distance, expected_distance, atol=TOLERANCE)
+    # the neighbours closer than the farthest are the same, whatever the order of ties
+    farthest = expected_distance[:, -1:] - TOLERANCE
+    for row in range(len(distance)):
+        closer = indices[row][distance[row] < farthest[row]]
+        expected = expected_indices[row][expected_distance[row] < farthest[row]]
+        assert set(closer.tolist()) == set(expected.tolist())
+        assert len(set(indices[row].tolist())) == indices.shape[1]
+
+
+def rows_within(graph, row, radius):
+    """
+    The neighbours of a row of the graph, but the ones at the radius up to rounding.
+    """
+    edges = slice(graph.offsets[row], graph.offsets[row + 1])
+    kept = graph.distance[edges] < radius - TOLERANCE
+    return set(graph.indices[edges][kept].tolist())
+
+
+@pytest.mark.parametrize('n, shards', [(10, 3), (100, 7), (1000, 4)])
+def test_shard_bounds_split_the_rows(n, shards):
+    bounds = shard_bounds(n, shards)
+    assert bounds[0] == 0 and bounds[-1] == n and len(bounds) == shards + 1
+    sizes = np.diff(bounds)
+    assert sizes.max() - sizes.min() <= 1
+
+
+@pytest.mark.parametrize('shards', [3, 5])
+def test_sharded_build_matches_the_unsharded_build(monkeypatch, tmp_path, shards):
+    # several query blocks, so the range graph of a block starts past the first row
+    monkeypatch.setattr(sharding, 'QUERY_BLOCK_ROWS', 240)
+    vectors = normalized(shards, 1000)
+    index, distance, indices, graph = sharded_knn(
+        vectors, FlatBackend(), K, shards, 2, radius=RADIUS, directory=str(tmp_path)
+    )
+    expected_distance, expected_indices, expected_graph = unsharded(vectors, K, RADIUS)
+    assert index.ntotal == len(vectors)
+    assert (indices[:, 0] == np.arange(len(vectors))).all()
+    assert_same_neighbours(distance, indices, expected_distance, expected_indices)
+    assert len(graph) == len(vectors)
+    for row in range(len(vectors)):
+        assert graph.indices[graph.offsets[row]] == row
+        assert rows_within(graph, row, RADIUS) == rows_within(
+            expected_graph, row, RADIUS
+        )
+    # the merged index searches as the unsharded one
+    merged_distance, merged_indices = index.search(vectors[:50], K)
+    assert_same_neighbours(
+        merged_distance, merged_indices, expected_distance[:50], expected_indices[:50]
+    )
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shards_smaller_than_k_are_padded(tmp_path):
+    vectors = normalized(7, 40)
+    _, distance, indices, graph = sharded_knn(
+        vectors, FlatBackend(), 12, 8, 2, directory=str(tmp_path)
+    )
+    expected_distance, expected_indices, _ = unsharded(vectors, 12, RADIUS)
+    assert graph is None
+    assert (indices >= 0).all()
+    assert_same_neighbours(distance, indices, expected_distance, expected_indices)
+
+
+def test_sharded_build_of_encoded_vectors(tmp_path):
+    vectors = normalized(8, 600)
+    storage = vector_storage('int8').fit(vectors)
+    decoded = DecodedVectors(storage.encode(vectors), storage)
+    _, distance, indices, _ = sharded_knn(
+        decoded, FlatBackend(), K, 3, 2, storage=storage, directory=str(tmp_path)
+    )
+    index = FlatBackend().build(vectors, storage.scalar_quantizer)
+    index.add(np.ascontiguousarray(decoded[:], dtype=np.float32))
+    expected_distance, expected_indices = index.search(
+        np.ascontiguousarray(decoded[:], dtype=np.float32), K
+    )
+    assert_same_neighbours(distance, indices, expected_distance, expected_indices)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from modules.singleflight import SingleFlight
+
+
+def test_identical_requests_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return {'value': value}
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.run(('clusters', 1), compute, 1) for _ in range(5)),
+            flight.run(('clusters', 2), compute, 2),
+        )
+
+    results = asyncio.run(main())
+    assert calls == [1, 2]
+    assert results[:5] == [{'value': 1}] * 5
+    assert all(result is results[0] for result in results[:5])
+    assert results[5] == {'value': 2}
+    assert flight.stats() == {'executed': 2, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_completed_computation_is_not_reused():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        return len(calls)
+
+    async def main():
+        return [await flight.run('key', compute) for _ in range(3)]
+
+    assert asyncio.run(main()) == [1, 2, 3]
+    assert flight.stats()['coalesced'] == 0
+
+
+def test_error_is_raised_to_every_waiter_then_forgotten():
+    flight = SingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise ValueError('bad threshold')
+
+    async def main():
+        results = await asyncio.gather(
+            *(flight.run('key', fail) for _ in range(3)), return_exceptions=True
+        )
+        with pytest.raises(ValueError):
+            await flight.run('key', fail)
+        return results
+
+    results = asyncio.run(main())
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 2
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    async def main():
+        first = asyncio.ensure_future(flight.run('key', compute))
+        second = asyncio.ensure_future(flight.run('key', compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 'done'
+    assert flight.stats() == {'executed': 1, 'coalesced': 1, 'in_flight': 0}
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from modules.storage import (
+    STORAGE_NAMES,
+    DecodedVectors,
+    Float16Storage,
+    Int8Storage,
+    PCAStorage,
+    storage_agreement,
+    storage_from_state,
+    vector_storage,
+)
+
+
+def normalized(seed, n, dimension=32):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def pair_distances(vectors):
+    vectors = vectors.astype(np.float64)
+    squared = (vectors**2).sum(axis=1)
+    return squared[:, None] + squared[None] - 2 * vectors @ vectors.T
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_float16_error_is_half_precision_rounding(seed):
+    vectors = normalized(seed, 2000)
+    storage = vector_storage('float16').fit(vectors)
+    codes = storage.encode(vectors)
+    assert codes.dtype == np.float16
+    error = np.abs(storage.decode(codes) - vectors)
+    # 11 significant bits, the values being at most 1 in magnitude
+    assert (error <= np.abs(vectors) * 2.0**-11 + 2.0**-25).all()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_int8_error_is_half_a_step_of_every_dimension(seed):
+    vectors = normalized(seed, 2000)
+    storage = vector_storage('int8').fit(vectors)
+    codes = storage.encode(vectors)
+    assert codes.dtype == np.uint8 and codes.shape == vectors.shape
+    error = np.abs(storage.decode(codes) - vectors)
+    step = storage.vdiff / 255
+    assert (error <= step / 2 + 1e-6).all()
+
+
+def test_int8_range_is_kept_while_the_vectors_fit_it():
+    vectors = normalized(0, 1000)
+    storage = vector_storage('int8').fit(vectors)
+    assert storage.fit(vectors[:500], previous=storage) is storage
+    wider = np.concatenate([vectors, -1.5 * vectors[:1]])
+    refitted = storage.fit(wider, previous=storage)
+    assert refitted is not storage
+    assert (refitted.vmin <= wider.min(axis=0)).all()
+
+
+def test_pca_distances_are_at_most_the_full_distances():
+    vectors = normalized(1, 1500)
+    storage = PCAStorage(8).fit(vectors)
+    codes = storage.encode(vectors)
+    assert codes.shape == (len(vectors), 8)
+    full = pair_distances(vectors)
+    projected = pair_distances(storage.decode(codes))
+    assert (projected <= full + 1e-5).all()
+
+
+def test_pca_of_vectors_in_a_subspace_keeps_their_distances():
+    rng = np.random.default_rng(2)
+    basis = np.linalg.qr(rng.normal(size=(32, 6)))[0].T
+    vectors = rng.normal(size=(1000, 6)) @ basis
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+    storage = PCAStorage(6).fit(vectors)
+    projected = pair_distances(storage.decode(storage.encode(vectors)))
+    np.testing.assert_allclose(projected, pair_distances(vectors), atol=1e-4)
+
+
+@pytest.mark.parametrize('name', STORAGE_NAMES)
+def test_restored_storage_gives_the_same_codes(name):
+    vectors = normalized(3, 500)
+    storage = vector_storage(name, pca_dimensions=16).fit(vectors)
+    restored = storage_from_state(storage.state())
+    assert type(restored) is type(storage)
+    assert restored.params() == storage.params()
+    np.testing.assert_array_equal(restored.encode(vectors), storage.encode(vectors))
+    decoded = DecodedVectors(storage.encode(vectors), storage)
+    assert decoded.shape == (500, 16 if name == 'pca' else 32)
+    np.testing.assert_array_equal(
+        decoded[10:20], storage.decode(storage.encode(vectors[10:20]))
+    )
+
+
+def test_agreement_of_the_encodings():
+    vectors = normalized(4, 3000, dimension=16)
+    exact = storage_agreement(vectors, vector_storage('float32'), 1000, queries=200)
+    assert exact['recall_at_10'] == 1.0
+    assert exact['distance_error_max'] == 0.0
+    for storage in (Float16Storage(), Int8Storage()):
+        agreement = storage_agreement(vectors, storage.fit(vectors), 1000, queries=200)
+        assert agreement['recall_at_10'] >= 0.9
+        assert agreement['distance_error_max'] < 0.05
+
+
+def test_unknown_storage_is_rejected():
+    with pytest.raises(ValueError):
+        vector_storage('int4')
@@ -0,0 +1,128 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+from modules import wire
+from modules.clustering import ClusterList
+from modules.columns import FeatureSetColumns, ItemTable
+from modules.wire import (
+    COMPRESS_MIN_BYTES,
+    compact_clusters,
+    compress,
+    content_encoding,
+    encode_json,
+    item_table_page,
+)
+
+
+def random_clusters(seed, n_items, n_vectors, n_clusters):
+    """
+    Builds an item table, a feature set over some of its items and clusters of vectors.
+    """
+    rng = np.random.default_rng(seed)
+    items = ItemTable()
+    for row in range(n_items):
+        items.add(f'item-{row}', f'name é {row}', f'thumb/{row}', row % 3 == 0)
+    items.freeze()
+    rows = rng.choice(n_items, n_vectors, replace=False)
+    feature_set = FeatureSetColumns(items, rows, np.zeros((n_vectors, 4)))
+    members = rng.permutation(n_vectors)[: n_vectors // 2]
+    cuts = rng.choice(np.arange(1, len(members)), n_clusters - 1, replace=False)
+    offsets = np.concatenate([[0], np.sort(cuts), [len(members)]])
+    ids = rng.permutation(n_clusters) + 100
+    return feature_set, ClusterList(members, offsets, ids)
+
+
+def full_layout(clusters, feature_set, start, stop):
+    """
+    The item dictionaries of every cluster of the range, as the full format lists them.
+    """
+    return [
+        (int(clusters.ids[i]), [feature_set.record(member) for member in clusters[i]])
+        for i in range(start, stop)
+    ]
+
+
+def decoded_layout(compact, page):
+    """
+    Joins the compact clusters with the item table page back into item dictionaries.
+    """
+    rows = range(page['start'], page['start'] + len(page['ids']))
+    records = {
+        row: {'itemId': i, 'thumbnail': thumbnail, 'name': name, 'annotated': flag}
+        for row, i, name, thumbnail, flag in zip(
+            rows, page['ids'], page['names'], page['thumbnails'], page['annotated']
+        )
+    }
+    offsets = compact['offsets']
+    return [
+        (
+            cluster_id,
+            [records[row] for row in compact['items'][offsets[i] : offsets[i + 1]]],
+        )
+        for i, cluster_id in enumerate(compact['ids'])
+    ]
+
+
+@pytest.mark.parametrize('use_orjson', [False, True])
+@pytest.mark.parametrize('start, stop', [(0, 12), (3, 7), (11, 12), (5, 5)])
+def test_compact_clusters_round_trip(monkeypatch, use_orjson, start, stop):
+    if use_orjson:
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(wire, 'orjson', None)
+    feature_set, clusters = random_clusters(0, 300, 200, 12)
+    compact = compact_clusters(clusters, feature_set, start, stop)
+    compact = json.loads(encode_json(compact))
+    page = json.loads(encode_json(item_table_page(feature_set.items, 0, 0)))
+    assert page['total'] == 300
+    assert compact['offsets'][0] == 0 and len(compact['offsets']) == stop - start + 1
+    expected = full_layout(clusters, feature_set, start, stop)
+    assert decoded_layout(compact, page) == expected
+
+
+@pytest.mark.parametrize('limit', [0, 1, 64, 1000])
+def test_item_table_pages_cover_the_table(limit):
+    feature_set, _ = random_clusters(1, 250, 100, 5)
+    items = feature_set.items
+    start, pages = 0, []
+    while True:
+        page = json.loads(encode_json(item_table_page(items, start, limit)))
+        assert page['start'] == start and page['total'] == len(items)
+        pages.append(page)
+        start += len(page['ids'])
+        if start >= len(items):
+            break
+    assert [item_id for page in pages for item_id in page['ids']] == list(items.ids)
+    annotated = [flag for page in pages for flag in page['annotated']]
+    assert annotated == items.annotated.tolist()
+    # a start past the end gives an empty page
+    page = item_table_page(items, len(items) + 10, limit)
+    assert page['start'] == len(items) and page['ids'] == []
+
+
+def test_compressed_body_round_trips():
+    feature_set, clusters = random_clusters(2, 2000, 1500, 40)
+    body = encode_json(compact_clusters(clusters, feature_set, 0, len(clusters)))
+    assert len(body) >= COMPRESS_MIN_BYTES
+    compressed, encoding = compress(body, 'gzip')
+    assert encoding == 'gzip'
+    assert gzip.decompress(compressed) == body
+    assert compress(body[: COMPRESS_MIN_BYTES - 1], 'gzip') == (
+        body[: COMPRESS_MIN_BYTES - 1],
+        None,
+    )
+    assert compress(body, None) == (body, None)
+
+
+def test_content_encoding_follows_the_accepted_encodings(monkeypatch):
+    monkeypatch.setattr(wire, 'brotli', None)
+    assert content_encoding('gzip, deflate, br') == 'gzip'
+    assert content_encoding('GZIP;q=0.5') == 'gzip'
+    assert content_encoding('identity') is None
+    assert content_encoding(None) is None
+    monkeypatch.setattr(wire, 'brotli', object())
+    assert content_encoding('gzip, br;q=1.0') == 'br'
+    assert content_encoding('gzip') == 'gzip'